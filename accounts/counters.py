@@ -0,0 +1,140 @@
+"""
+Denormalized dashboard counters.
+
+The dashboards used to run a COUNT(*) per figure on every load. The figures
+now live in ``Counter`` rows that are adjusted in the same transaction as
+the change that moves them, and are read back with a single query. A
+missing counter is computed from the source tables on first read;
+``manage.py reconcile_counters`` recomputes everything and reports drift.
+"""
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Case, Count, F, Value, When
+
+from .models import Counter, User
+
+PENDING_REQUESTS = 'requests:pending'
+TOTAL_STUDENTS = 'students:total'
+TOTAL_BOOKS = 'books:total'
+
+# Request statuses tracked per student.
+STUDENT_STATUSES = ('pending', 'approved')
+
+
+def student_requests_key(student_id, status):
+    return f'student:{student_id}:requests:{status}'
+
+
+def compute(key):
+    """Count the value of ``key`` from the source tables."""
+    from books.models import Book, BookRequest
+
+    if key == PENDING_REQUESTS:
+        return BookRequest.objects.filter(status='pending').count()
+    if key == TOTAL_STUDENTS:
+        return User.objects.filter(user_type='student').count()
+    if key == TOTAL_BOOKS:
+        return Book.objects.count()
+    _, student_id, _, status = key.split(':')
+    return BookRequest.objects.filter(student_id=student_id, status=status).count()
+
+
+def seed(keys):
+    """
+    Create the counters for ``keys`` from the source tables; returns
+    ``{key: value}``.
+
+    The rows go in at zero first, so changes made while counting are
+    applied to them by ``adjust()`` rather than skipped. The count then
+    runs with the rows locked by an UPDATE (on SQLite, the database write
+    lock): writers that got there first are waited for and included in the
+    count, which replaces what they added; later ones wait and add their
+    delta on top.
+    """
+    Counter.objects.bulk_create([Counter(key=key, value=0) for key in keys], ignore_conflicts=True)
+    with transaction.atomic():
+        Counter.objects.filter(key__in=keys).update(value=0)
+        values = {key: compute(key) for key in keys}
+        Counter.objects.filter(key__in=keys).update(
+            value=Case(*[When(key=key, then=Value(value)) for key, value in values.items()]),
+        )
+    return values
+
+
+def get_counters(keys):
+    """Return ``{key: value}`` for ``keys`` in one query, filling in any missing ones."""
+    values = dict(Counter.objects.filter(key__in=keys).values_list('key', 'value'))
+    missing = [key for key in keys if key not in values]
+    if missing:
+        values.update(seed(missing))
+    return values
+
+
+async def aget_counters(keys):
+    """``get_counters`` for async views; missing counters are computed in a thread."""
+    rows = Counter.objects.filter(key__in=keys).values_list('key', 'value')
+    values = {key: value async for key, value in rows}
+    missing = [key for key in keys if key not in values]
+    if missing:
+        values.update(await sync_to_async(get_counters)(missing))
+    return values
+
+
+def adjust(deltas):
+    """
+    Apply ``{key: delta}`` to the stored counters in one UPDATE. Counters
+    that don't exist yet are left alone; they are computed when first read.
+    """
+    deltas = [(key, delta) for key, delta in deltas.items() if delta]
+    # Batched to stay well within the database's bound-parameter limit.
+    for start in range(0, len(deltas), 500):
+        batch = deltas[start:start + 500]
+        Counter.objects.filter(key__in=[key for key, _ in batch]).update(
+            value=F('value') + Case(
+                *[When(key=key, then=Value(delta)) for key, delta in batch],
+                default=Value(0),
+            )
+        )
+
+
+def request_status_deltas(changes):
+    """
+    Turn ``(student_id, old_status, new_status)`` triples into counter
+    deltas. ``old_status`` is ``None`` for new requests, ``new_status``
+    ``None`` for deleted ones.
+    """
+    deltas = {}
+    for student_id, old, new in changes:
+        if old == new:
+            continue
+        for status, delta in ((old, -1), (new, 1)):
+            if status == 'pending':
+                deltas[PENDING_REQUESTS] = deltas.get(PENDING_REQUESTS, 0) + delta
+            if status in STUDENT_STATUSES:
+                key = student_requests_key(student_id, status)
+                deltas[key] = deltas.get(key, 0) + delta
+    return deltas
+
+
+def record_request_status_changes(changes):
+    adjust(request_status_deltas(changes))
+
+
+def expected_counters():
+    """Recompute every counter from scratch; returns ``{key: value}``."""
+    from books.models import Book, BookRequest
+
+    expected = {
+        PENDING_REQUESTS: BookRequest.objects.filter(status='pending').count(),
+        TOTAL_STUDENTS: User.objects.filter(user_type='student').count(),
+        TOTAL_BOOKS: Book.objects.count(),
+    }
+    rows = (
+        BookRequest.objects.filter(status__in=STUDENT_STATUSES)
+        .order_by()
+        .values_list('student_id', 'status')
+        .annotate(n=Count('pk'))
+    )
+    for student_id, status, n in rows:
+        expected[student_requests_key(student_id, status)] = n
+    return expected
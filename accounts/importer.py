@@ -0,0 +1,196 @@
+"""
+Bulk student roster import.
+
+Reads a CSV roster one row at a time and writes students in
+``bulk_create`` batches. Usernames, mobile numbers and emails are checked
+for uniqueness against in-memory sets loaded from ``User`` in one query
+up front. Rows accepted earlier in the file are added to the sets as
+they go. Initial passwords are hashed in a process pool, so the key
+derivation for a term's roster runs on every core instead of one. A row
+without a password gets an unusable one, and the student sets it through
+password reset. Bad rows go to an error report instead of stopping the
+import. A dry run validates the whole file without hashing or writing
+anything. Used by ``manage.py import_students``.
+"""
+import csv
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import validate_password
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from .counters import TOTAL_STUDENTS, adjust
+from .models import User
+
+COLUMNS = ('username', 'full_name', 'mobile_number', 'email', 'password')
+
+# Tries at writing a batch whose rows keep clashing with concurrent registrations.
+WRITE_ATTEMPTS = 3
+
+username_validator = UnicodeUsernameValidator()
+
+
+def read_rows(stream):
+    """Yield ``(line_number, fields)`` from a binary CSV stream."""
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    for row in reader:
+        yield reader.line_num, {
+            key.strip().lower(): (value or '').strip() for key, value in row.items() if key
+        }
+
+
+def clean_row(fields):
+    """Validate a row into keyword arguments for ``User`` plus the raw password. Raises ValueError."""
+    cleaned = {name: fields.get(name, '') for name in COLUMNS}
+    cleaned['email'] = cleaned['email'].lower()
+    for name in ('username', 'full_name', 'mobile_number', 'email'):
+        if not cleaned[name]:
+            raise ValueError(f'{name} is required')
+        max_length = User._meta.get_field(name).max_length
+        if len(cleaned[name]) > max_length:
+            raise ValueError(f'{name} is longer than {max_length} characters')
+    if not cleaned['mobile_number'].lstrip('+').isdigit():
+        raise ValueError(f"invalid mobile number {cleaned['mobile_number']!r}")
+    try:
+        username_validator(cleaned['username'])
+        validate_email(cleaned['email'])
+        if cleaned['password']:
+            validate_password(cleaned['password'], User(
+                username=cleaned['username'], full_name=cleaned['full_name'], email=cleaned['email'],
+            ))
+    except ValidationError as error:
+        raise ValueError(' '.join(error.messages))
+    return cleaned
+
+
+class StudentImporter:
+    """
+    Import students from a binary CSV stream. ``errors`` is an optional
+    text stream that receives a CSV row per rejected record; ``workers``
+    the number of hashing processes (1 hashes in this process);
+    ``progress`` is called with the running stats after every batch.
+    """
+
+    def __init__(self, batch_size=1000, workers=None, dry_run=False, errors=None, progress=None):
+        self.batch_size = batch_size
+        self.workers = workers or os.cpu_count() or 1
+        self.dry_run = dry_run
+        self.errors = csv.writer(errors) if errors is not None else None
+        self.progress = progress
+        self.usernames, self.mobile_numbers, self.emails = set(), set(), set()
+        for username, mobile_number, email in User.objects.values_list('username', 'mobile_number', 'email'):
+            self.usernames.add(username)
+            self.mobile_numbers.add(mobile_number)
+            if email:
+                self.emails.add(email.lower())
+        self.stats = dict.fromkeys(('records', 'created', 'errors'), 0)
+
+    def run(self, stream):
+        if self.errors is not None:
+            self.errors.writerow(['line', 'username', 'error'])
+        self.started = time.monotonic()
+        pool = None
+        if self.workers > 1 and not self.dry_run:
+            # Workers set Django up themselves in case they were spawned rather than forked.
+            pool = ProcessPoolExecutor(max_workers=self.workers, initializer=django.setup)
+        try:
+            batch = []
+            for number, fields in read_rows(stream):
+                self.stats['records'] += 1
+                try:
+                    student = clean_row(fields)
+                    self.claim(student)
+                except ValueError as error:
+                    self.reject(number, fields.get('username', ''), error)
+                    continue
+                batch.append((number, student))
+                if len(batch) >= self.batch_size:
+                    self.flush(batch, pool)
+                    batch = []
+            self.flush(batch, pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return self.stats
+
+    def claim(self, student):
+        """Reserve the student's unique values, or raise ValueError if taken."""
+        for name, taken in (('username', self.usernames), ('mobile_number', self.mobile_numbers),
+                            ('email', self.emails)):
+            if student[name] in taken:
+                raise ValueError(f'{name} {student[name]!r} is already taken')
+        self.usernames.add(student['username'])
+        self.mobile_numbers.add(student['mobile_number'])
+        self.emails.add(student['email'])
+
+    def reject(self, number, username, error):
+        self.stats['errors'] += 1
+        if self.errors is not None:
+            self.errors.writerow([number, username, str(error)])
+
+    def hash_passwords(self, passwords, pool):
+        if pool is None:
+            return [make_password(password) for password in passwords]
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(pool.map(make_password, passwords, chunksize=chunksize))
+
+    def flush(self, batch, pool):
+        if batch and self.dry_run:
+            self.stats['created'] += len(batch)
+        elif batch:
+            # Rows without a password get an unusable one; make_password(None) is cheap.
+            hashes = self.hash_passwords([student['password'] or None for _, student in batch], pool)
+            users = {
+                number: User(
+                    user_type='student', password=password,
+                    **{name: value for name, value in student.items() if name != 'password'},
+                )
+                for (number, student), password in zip(batch, hashes)
+            }
+            self.write_batch(users)
+        elapsed = time.monotonic() - self.started
+        self.stats['elapsed'] = elapsed
+        self.stats['rate'] = self.stats['records'] / elapsed if elapsed else 0.0
+        if self.progress:
+            self.progress(self.stats)
+
+    def write_batch(self, users):
+        for _ in range(WRITE_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    self.insert(users.values())
+                return
+            except IntegrityError:
+                # The student IDs went back to the sequence with the rollback; draw new ones.
+                for user in users.values():
+                    user.student_id = None
+                self.drop_taken(users)
+        for number, user in users.items():
+            self.reject(number, user.username, 'kept clashing with registrations during the import')
+    
+    def drop_taken(self, users):
+        """Reject the users someone registered since the import started."""
+        taken = User.objects.filter(
+            Q(username__in=[user.username for user in users.values()])
+            | Q(mobile_number__in=[user.mobile_number for user in users.values()])
+        ).values_list('username', 'mobile_number')
+        taken = {value for row in taken for value in row}
+        for number, user in list(users.items()):
+            if user.username in taken or user.mobile_number in taken:
+                self.reject(number, user.username, 'taken by a registration during the import')
+                del users[number]
+
+    def insert(self, users):
+        users = list(users)
+        User.objects.bulk_create(users)
+        # bulk_create skips the signal that keeps the student counter current.
+        adjust({TOTAL_STUDENTS: len(users)})
+        self.stats['created'] += len(users)
@@ -0,0 +1,77 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library_management.benchmark import TARGETS, compare, compare_servers, run_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Measure throughput, latency and query counts of the main pages, optionally against a baseline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='*', metavar='url_name',
+                            help=f"URL names to benchmark (default: all of {', '.join(TARGETS)}).")
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Measured requests per URL (default: 50).')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Requests in flight at once (default: 4).')
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='Unmeasured requests per URL first (default: 5).')
+        parser.add_argument('-o', '--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--baseline', help='Results file of an earlier run to compare against.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed slowdown in p95 latency and throughput (default: 0.25).')
+        parser.add_argument('--compare-servers', action='store_true',
+                            help='Compare the WSGI and ASGI applications instead, e.g. with '
+                                 '--concurrency 1000 --requests 5000 (default targets: the async views).')
+
+    def handle(self, *args, **options):
+        unknown = set(options['targets']) - set(TARGETS)
+        if unknown:
+            raise CommandError(f"Unknown URL name(s): {', '.join(sorted(unknown))}")
+        if options['compare_servers']:
+            return self.compare_servers(options)
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+
+        try:
+            results = run_benchmark(
+                targets=options['targets'], requests=options['requests'],
+                concurrency=options['concurrency'], warmup=options['warmup'],
+                progress=self.stdout.write,
+            )
+        except ValueError as error:
+            raise CommandError(error)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
+
+        if baseline is not None:
+            regressions = compare(results, baseline, tolerance=options['tolerance'])
+            if regressions:
+                for regression in regressions:
+                    self.stderr.write(regression)
+                raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}.')
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["baseline"]}.'))
+
+    def compare_servers(self, options):
+        if options['baseline']:
+            raise CommandError('--baseline cannot be used with --compare-servers.')
+        try:
+            results = compare_servers(
+                targets=options['targets'], requests=options['requests'],
+                concurrency=options['concurrency'], warmup=options['warmup'],
+                progress=self.stdout.write,
+            )
+        except ValueError as error:
+            raise CommandError(error)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
+        for name, speedup in results['speedup'].items():
+            if speedup is not None:
+                self.stdout.write(f'{name}: ASGI at {speedup:.2f}x WSGI throughput')
@@ -0,0 +1,30 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from library_management.benchmark import run_registration_benchmark
+
+
+class Command(BaseCommand):
+    help = ('Time student registration as the student table grows, e.g. to 500k students. '
+            'Everything written is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=500000,
+                            help='Students in the table at the last step (default: 500000).')
+        parser.add_argument('--steps', type=int, default=5,
+                            help='Table sizes to measure at (default: 5).')
+        parser.add_argument('--sample', type=int, default=200,
+                            help='Registrations timed at each size (default: 200).')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Students per bulk insert while filling the table (default: 5000).')
+        parser.add_argument('-o', '--output', help='Write the results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        results = run_registration_benchmark(
+            students=options['students'], steps=options['steps'], sample=options['sample'],
+            batch_size=options['batch_size'], progress=self.stdout.write,
+        )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
@@ -0,0 +1,46 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from accounts.importer import COLUMNS, StudentImporter
+
+
+class Command(BaseCommand):
+    help = f"Import a student roster from a CSV file with the columns {', '.join(COLUMNS)}."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file to import.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Students written per bulk insert (default: 1000).')
+        parser.add_argument('--workers', type=int,
+                            help='Processes hashing passwords (default: one per CPU).')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Validate the file and report errors without creating anyone.')
+        parser.add_argument('--errors', help='Where to write rejected rows (default: PATH.errors.csv).')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        errors_path = options['errors'] or f'{path}.errors.csv'
+
+        def progress(stats):
+            self.stdout.write(
+                f"  {stats['records']} rows, {stats['created']} created, {stats['errors']} errors "
+                f"({stats['rate']:.0f} rows/s)"
+            )
+
+        with open(path, 'rb') as stream, open(errors_path, 'w', newline='', encoding='utf-8') as errors:
+            importer = StudentImporter(
+                batch_size=options['batch_size'], workers=options['workers'], dry_run=options['dry_run'],
+                errors=errors, progress=progress if options['verbosity'] > 1 else None,
+            )
+            stats = importer.run(stream)
+
+        verb = 'Would create' if options['dry_run'] else 'Created'
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {stats['records']} rows in {stats['elapsed']:.2f}s ({stats['rate']:.0f} rows/s). "
+            f"{verb} {stats['created']} students."
+        ))
+        if stats['errors']:
+            self.stdout.write(self.style.WARNING(f"{stats['errors']} rows rejected; see {errors_path}."))
+        else:
+            os.remove(errors_path)
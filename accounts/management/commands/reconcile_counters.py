@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.counters import expected_counters
+from accounts.models import Counter
+
+
+class Command(BaseCommand):
+    help = 'Recompute the dashboard counters from scratch and report any drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drift without correcting the stored counters.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            expected = expected_counters()
+            stored = dict(Counter.objects.select_for_update().values_list('key', 'value'))
+
+            drifted = []
+            for key in sorted(set(expected) | set(stored)):
+                want = expected.get(key, 0)
+                have = stored.get(key)
+                if have is not None and have != want:
+                    drifted.append((key, have, want))
+                    self.stdout.write(f'{key}: stored {have}, actual {want} ({want - have:+d})')
+
+            if drifted and not options['dry_run']:
+                Counter.objects.bulk_update(
+                    [Counter(key=key, value=want) for key, _, want in drifted],
+                    ['value'], batch_size=1000,
+                )
+
+        verb = 'found' if options['dry_run'] else 'corrected'
+        style = self.style.WARNING if drifted else self.style.SUCCESS
+        self.stdout.write(style(f'{len(drifted)} drifted counter(s) {verb}; {len(expected)} checked.'))
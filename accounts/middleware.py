@@ -0,0 +1,93 @@
+"""
+Signed-in user loading through the cache.
+
+``AuthenticationMiddleware`` reads the ``User`` row on every request.
+``CachedAuthenticationMiddleware`` keeps it in the ``USER_CACHE`` cache
+for ``USER_CACHE_TIMEOUT`` seconds instead. A cached user is only used
+if the session's auth hash still matches it, so a password change signs
+out other sessions as before. Saving or deleting a user drops the
+cached copy (``accounts.signals``), so profile edits, deactivation and
+``last_login`` updates show up on the next request.
+
+The cache must be shared by every server process, or invalidation only
+reaches the process that saved the user; a ``LocMemCache`` is ignored.
+The cached object includes the password hash, so a cache shared between
+servers must be as private as the database.
+"""
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+
+def user_cache():
+    alias = getattr(settings, 'USER_CACHE', 'default')
+    if not alias or isinstance(caches[alias], LocMemCache):
+        return None
+    return caches[alias]
+
+
+def user_cache_key(user_id):
+    return f'auth-user:{user_id}'
+
+
+def invalidate_user(user_id):
+    cache = user_cache()
+    if cache is not None:
+        cache.delete(user_cache_key(user_id))
+
+
+def load_user(request):
+    """``auth.get_user`` with a read-through cache in front of it."""
+    cache = user_cache()
+    try:
+        user_id = request.session[auth.SESSION_KEY]
+        session_hash = request.session[auth.HASH_SESSION_KEY]
+        backend = request.session[auth.BACKEND_SESSION_KEY]
+    except KeyError:
+        return auth.get_user(request)
+    if cache is None or backend not in settings.AUTHENTICATION_BACKENDS:
+        return auth.get_user(request)
+
+    key = user_cache_key(user_id)
+    user = cache.get(key)
+    if (user is not None and constant_time_compare(session_hash, user.get_session_auth_hash())
+            and user_can_authenticate(backend, user)):
+        user.backend = backend
+        return user
+    user = auth.get_user(request)
+    if user.is_authenticated:
+        cache.set(key, user, getattr(settings, 'USER_CACHE_TIMEOUT', 60))
+    return user
+
+
+def user_can_authenticate(backend, user):
+    """The backend's own check (``is_active`` for ``ModelBackend``), as ``auth.get_user`` applies it."""
+    check = getattr(auth.load_backend(backend), 'user_can_authenticate', None)
+    return check is None or check(user)
+
+
+def get_user(request):
+    if not hasattr(request, '_cached_user'):
+        request._cached_user = load_user(request)
+    return request._cached_user
+
+
+async def aget_user(request):
+    if not hasattr(request, '_acached_user'):
+        request._acached_user = await sync_to_async(load_user)(request)
+    return request._acached_user
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
+        request.auser = partial(aget_user, request)
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:33
+
+import accounts.models
+from django.db import migrations, models
+from django.db.models.functions import Length
+
+
+def start_student_id_sequence(apps, schema_editor):
+    # Start above the randomly drawn IDs already handed out.
+    User = apps.get_model('accounts', 'User')
+    IdSequence = apps.get_model('accounts', 'IdSequence')
+    latest = (
+        User.objects.filter(student_id__regex=r'^STU[0-9]+$')
+        .order_by(Length('student_id').desc(), '-student_id')
+        .values_list('student_id', flat=True).first()
+    )
+    IdSequence.objects.create(name='student_id', next_value=int(latest[3:]) + 1 if latest else 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdSequence',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('next_value', models.BigIntegerField()),
+            ],
+        ),
+        migrations.RunPython(start_student_id_sequence, migrations.RunPython.noop),
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', accounts.models.UserManager()),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+"""
+Access checks for class-based views with ``async def`` handlers.
+
+``LoginRequiredMixin`` and ``UserPassesTestMixin`` read ``request.user``
+in a synchronous ``dispatch``. Under ASGI, the first read of the lazy
+user loads the session from the database, and Django refuses to do that
+from the event loop. ``AsyncLoginRequiredMixin`` loads the user with
+``request.auser()`` and stores it on the request. Code that runs later
+(``test_func``, templates, context processors) then reads a plain
+object.
+"""
+from django.contrib.auth.mixins import AccessMixin
+
+
+class AsyncLoginRequiredMixin(AccessMixin):
+    """
+    Login required, then ``test_func`` if the view defines one. The view's
+    handlers must all be coroutines.
+    """
+
+    def allows_anonymous(self):
+        return False
+
+    def dispatch(self, request, *args, **kwargs):
+        return self.adispatch(request, *args, **kwargs)
+
+    async def adispatch(self, request, *args, **kwargs):
+        request.user = user = await request.auser()
+        if not user.is_authenticated:
+            if not self.allows_anonymous():
+                return self.handle_no_permission()
+        elif hasattr(self, 'test_func') and not self.test_func():
+            return self.handle_no_permission()
+        return await super().dispatch(request, *args, **kwargs)
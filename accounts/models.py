@@ -1,7 +1,15 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager as BaseUserManager
 from django.db import models
-import random
-import string
+
+class UserManager(BaseUserManager):
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        # save() is bypassed, so students get their IDs here, in one reservation.
+        from .student_ids import assign_student_ids
+        
+        objs = list(objs)
+        assign_student_ids(objs)
+        return super().bulk_create(objs, *args, **kwargs)
 
 class User(AbstractUser):
     USER_TYPE_CHOICES = (
@@ -16,14 +24,13 @@ class User(AbstractUser):
     is_approved = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = UserManager()
+    
     def save(self, *args, **kwargs):
         if self.user_type == 'student' and not self.student_id:
-            # Generate unique student ID
-            while True:
-                student_id = 'STU' + ''.join(random.choices(string.digits, k=6))
-                if not User.objects.filter(student_id=student_id).exists():
-                    self.student_id = student_id
-                    break
+            from .student_ids import assign_student_ids
+            
+            assign_student_ids([self])
         super().save(*args, **kwargs)
     
     def __str__(self):
@@ -39,4 +46,24 @@ class AdminProfile(models.Model):
     department = models.CharField(max_length=100, default='Library Management')
     
     def __str__(self):
-        return f"Admin - {self.user.full_name}"
\ No newline at end of file
+        return f"Admin - {self.user.full_name}"
+
+class Counter(models.Model):
+    """
+    A denormalized count backing the dashboards, e.g. ``requests:pending``
+    or ``student:42:requests:approved``. See ``accounts.counters``.
+    """
+    key = models.CharField(max_length=100, primary_key=True)
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.key} = {self.value}"
+
+class IdSequence(models.Model):
+    """The next number to hand out for ``name``. See ``accounts.student_ids``."""
+    name = models.CharField(max_length=50, primary_key=True)
+    next_value = models.BigIntegerField()
+    
+    def __str__(self):
+        return f"{self.name} -> {self.next_value}"
@@ -0,0 +1,70 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from books.models import Book, BookRequest
+from . import counters
+from .middleware import invalidate_user
+from .models import User
+
+
+# Remember the values counted for each instance so saves can apply deltas.
+# Read from __dict__ so deferred fields are never loaded just for this.
+
+@receiver(post_init, sender=BookRequest)
+def remember_request_status(sender, instance, **kwargs):
+    instance._counted_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=BookRequest)
+def count_request_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    old = None if created else instance._counted_status
+    if 'status' in instance.__dict__ and (created or old is not None):
+        counters.record_request_status_changes([(instance.student_id, old, instance.status)])
+        instance._counted_status = instance.status
+
+
+@receiver(post_delete, sender=BookRequest)
+def count_request_delete(sender, instance, **kwargs):
+    counters.record_request_status_changes([(instance.student_id, instance.status, None)])
+
+
+@receiver(post_init, sender=User)
+def remember_user_type(sender, instance, **kwargs):
+    instance._counted_user_type = instance.__dict__.get('user_type')
+
+
+@receiver(post_save, sender=User)
+def count_user_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw or 'user_type' not in instance.__dict__:
+        return
+    was_student = not created and instance._counted_user_type == 'student'
+    is_student = instance.user_type == 'student'
+    if was_student != is_student:
+        counters.adjust({counters.TOTAL_STUDENTS: 1 if is_student else -1})
+    instance._counted_user_type = instance.user_type
+
+
+@receiver(post_delete, sender=User)
+def count_user_delete(sender, instance, **kwargs):
+    if instance.user_type == 'student':
+        counters.adjust({counters.TOTAL_STUDENTS: -1})
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def drop_cached_user(sender, instance, **kwargs):
+    # Profile edits, deactivation and password changes show on the next request.
+    invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=Book)
+def count_book_save(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        counters.adjust({counters.TOTAL_BOOKS: 1})
+
+
+@receiver(post_delete, sender=Book)
+def count_book_delete(sender, instance, **kwargs):
+    counters.adjust({counters.TOTAL_BOOKS: -1})
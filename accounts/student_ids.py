@@ -0,0 +1,62 @@
+"""
+Student ID allocation.
+
+Student IDs are ``STU`` followed by a number, zero-padded to six digits.
+Numbers come from the ``student_id`` row of ``IdSequence``. ``reserve``
+claims a block of consecutive numbers with one UPDATE, whatever the size
+of the block. So ``bulk_create`` of a whole roster costs the same as one
+registration, and neither gets slower as the student table grows. The
+UPDATE locks the row until the surrounding transaction ends. Concurrent
+registrations queue on it and never get the same numbers. A rolled-back
+transaction hands its numbers back.
+
+The sequence starts above the largest ``STU`` number already issued.
+Earlier versions drew IDs at random, and those are never repeated.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Length
+
+from .models import IdSequence, User
+
+PREFIX = 'STU'
+SEQUENCE = 'student_id'
+
+
+def format_student_id(number):
+    return f'{PREFIX}{number:06d}'
+
+
+def initial_value():
+    """One more than the largest number in an existing ``STU`` ID."""
+    latest = (
+        User.objects.filter(student_id__regex=rf'^{PREFIX}[0-9]+$')
+        .order_by(Length('student_id').desc(), '-student_id')
+        .values_list('student_id', flat=True).first()
+    )
+    return int(latest[len(PREFIX):]) + 1 if latest else 1
+
+
+def reserve(count):
+    """Claim ``count`` consecutive numbers and return the first."""
+    with transaction.atomic():
+        claimed = IdSequence.objects.filter(name=SEQUENCE).update(next_value=F('next_value') + count)
+        if not claimed:
+            # First use (or the row was deleted): start above the existing IDs.
+            try:
+                with transaction.atomic():
+                    IdSequence.objects.create(name=SEQUENCE, next_value=initial_value() + count)
+            except IntegrityError:
+                # Another worker created it first.
+                IdSequence.objects.filter(name=SEQUENCE).update(next_value=F('next_value') + count)
+        next_value = IdSequence.objects.filter(name=SEQUENCE).values_list('next_value', flat=True).get()
+    return next_value - count
+
+
+def assign_student_ids(users):
+    """Give every student in ``users`` without a ``student_id`` a new one."""
+    pending = [user for user in users if user.user_type == 'student' and not user.student_id]
+    if pending:
+        first = reserve(len(pending))
+        for offset, user in enumerate(pending):
+            user.student_id = format_student_id(first + offset)
@@ -1,3 +1,417 @@
-from django.test import TestCase
+import csv
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from books.models import BookRequest, Category
+from books.tests import make_admin, make_book, make_reader, make_student
+from library_management import benchmark
+from transactions.models import Transaction
+from . import counters, student_ids
+from .importer import StudentImporter
+from .middleware import user_cache_key
+from .models import Counter, IdSequence, User
+
+
+SHARED_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'library-management-test-cache')
+PROCESS_LOCAL_CACHES = settings.CACHES
+
+
+def shared_cache():
+    """Cached sessions and users on a cache every server process shares."""
+    return override_settings(
+        CACHES={**settings.CACHES, 'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': SHARED_CACHE_DIR,
+        }},
+        SESSION_ENGINE='django.contrib.sessions.backends.cached_db', USER_CACHE='default',
+    )
+
+
+class DashboardQueryCountTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        cls.student = make_student()
+        category = Category.objects.create(name='Reference')
+        for i in range(10):
+            book = make_book(category, cls.admin, title=f'Book {i}', isbn=f'{i:013d}')
+            BookRequest.objects.create(student=cls.student, book=book)
+            Transaction.objects.create(
+                student=cls.student, book=book, transaction_type='issue',
+                processed_by=cls.admin,
+            )
+
+    def test_student_dashboard(self):
+        self.client.force_login(self.student)
+        self.client.get(reverse('dashboard'))
+        # session, user, counters, recent transactions
+        with self.assertNumQueries(4):
+            self.client.get(reverse('dashboard'))
+
+    def test_admin_dashboard(self):
+        self.client.force_login(self.admin)
+        self.client.get(reverse('dashboard'))
+        # session, user, counters, recent requests
+        with self.assertNumQueries(4):
+            self.client.get(reverse('dashboard'))
+
+    @shared_cache()
+    def test_shared_cache_saves_the_session_and_user_queries(self):
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+        client = Client()
+        client.force_login(self.student)
+        client.get(reverse('dashboard'))
+        # counters, recent transactions
+        with self.assertNumQueries(2):
+            client.get(reverse('dashboard'))
+
+    async def test_dashboard_under_asgi(self):
+        self.assertEqual((await self.async_client.get(reverse('dashboard'))).status_code, 302)
+        await self.async_client.aforce_login(self.student)
+        response = await self.async_client.get(reverse('dashboard'))
+        self.assertEqual(response.context['pending_requests'], 10)
+        self.assertEqual(len(response.context['recent_transactions']), 5)
+
+
+@shared_cache()
+class UserCacheTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+        self.student = make_student()
+        self.client.force_login(self.student)
+        self.client.get(reverse('dashboard'))
+
+    def test_profile_updates_show_on_the_next_request(self):
+        self.client.post(reverse('profile'), {
+            'full_name': 'Renamed Student', 'email': 'renamed@example.com',
+            'mobile_number': self.student.mobile_number,
+        })
+        self.assertContains(self.client.get(reverse('dashboard')), 'Renamed Student')
+
+    def test_password_change_and_deactivation_sign_out(self):
+        for change in ({'password': 'changed'}, {'is_active': False}):
+            self.client.force_login(self.student)
+            self.client.get(reverse('dashboard'))
+            user = User.objects.get(pk=self.student.pk)
+            if 'password' in change:
+                user.set_password(change['password'])
+            else:
+                user.is_active = False
+            user.save()
+            self.assertEqual(self.client.get(reverse('dashboard')).status_code, 302, change)
+            self.student.refresh_from_db()
+            self.student.is_active = True
+            self.student.save()
+
+    def test_logout_and_deactivation_reach_other_workers(self):
+        # Another server process: its own connection to the same cache.
+        other_worker = FileBasedCache(SHARED_CACHE_DIR, {})
+        self.assertIsNotNone(other_worker.get(user_cache_key(self.student.pk)))
+        copied = Client()
+        copied.cookies[settings.SESSION_COOKIE_NAME] = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.assertEqual(copied.get(reverse('dashboard')).status_code, 200)
+        self.client.get(reverse('logout'))
+        self.assertEqual(copied.get(reverse('dashboard')).status_code, 302)
+
+        self.client.force_login(self.student)
+        self.client.get(reverse('dashboard'))
+        self.student.is_active = False
+        self.student.save()
+        self.assertIsNone(other_worker.get(user_cache_key(self.student.pk)))
+        self.assertEqual(self.client.get(reverse('dashboard')).status_code, 302)
+
+    def test_cached_inactive_user_is_refused(self):
+        # Deactivated without a save(), so nothing dropped the entry.
+        User.objects.filter(pk=self.student.pk).update(is_active=False)
+        inactive = User.objects.get(pk=self.student.pk)
+        FileBasedCache(SHARED_CACHE_DIR, {}).set(user_cache_key(self.student.pk), inactive)
+        self.assertEqual(self.client.get(reverse('dashboard')).status_code, 302)
+
+    def test_process_local_cache_is_not_used(self):
+        with override_settings(CACHES=PROCESS_LOCAL_CACHES, USER_CACHE='default'):
+            self.client.get(reverse('dashboard'))
+            self.assertIsNone(caches['default'].get(user_cache_key(self.student.pk)))
+
+    def test_entry_for_another_user_is_ignored(self):
+        # E.g. left behind by a deleted user whose primary key was reused.
+        other = make_student('other')
+        caches['default'].set(user_cache_key(self.student.pk), other)
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['user'], self.student)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookie_sessions(self):
+        # A new client, so its session middleware picks up the engine.
+        client = Client()
+        client.force_login(self.student)
+        client.get(reverse('dashboard'))
+        with self.assertNumQueries(2):
+            self.assertEqual(client.get(reverse('dashboard')).status_code, 200)
+
+
+class CounterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        cls.student = make_student()
+        category = Category.objects.create(name='Reference')
+        cls.books = [
+            make_book(category, cls.admin, title=f'Book {i}', isbn=f'{i:013d}') for i in range(3)
+        ]
+
+    def dashboard_counts(self, user):
+        self.client.force_login(user)
+        context = self.client.get(reverse('dashboard')).context
+        return {key: context[key] for key in ('pending_requests', 'approved_requests', 'total_students')
+                if key in context}
+
+    def test_counters_follow_request_lifecycle(self):
+        # Prime the counters so the following changes are applied incrementally.
+        self.assertEqual(self.dashboard_counts(self.student), {'pending_requests': 0, 'approved_requests': 0})
+        self.assertEqual(self.dashboard_counts(self.admin), {'pending_requests': 0, 'total_students': 1})
+
+        requests = [BookRequest.objects.create(student=self.student, book=book) for book in self.books]
+        requests[0].approve(self.admin)
+        requests[1].reject(self.admin)
+        make_student('another')
+
+        self.assertEqual(self.dashboard_counts(self.student), {'pending_requests': 1, 'approved_requests': 1})
+        self.assertEqual(self.dashboard_counts(self.admin), {'pending_requests': 1, 'total_students': 2})
+
+        requests[0].mark_returned(self.student)
+        BookRequest.bulk_approve([requests[2].pk], self.admin)
+        self.assertEqual(self.dashboard_counts(self.student), {'pending_requests': 0, 'approved_requests': 1})
+        self.assertEqual(Counter.objects.get(key=counters.PENDING_REQUESTS).value, 0)
+
+    def test_save_after_a_status_change_is_not_counted_twice(self):
+        counters.get_counters([counters.PENDING_REQUESTS, counters.student_requests_key(self.student.pk, 'approved')])
+        requests = [BookRequest.objects.create(student=self.student, book=book) for book in self.books]
+        requests[0].approve(self.admin)
+        requests[1].reject(self.admin)
+        requests[0].mark_returned(self.student)
+        for book_request in requests[:2]:
+            book_request.notes = 'Checked.'
+            book_request.save()
+
+        self.assertEqual(self.dashboard_counts(self.student), {'pending_requests': 1, 'approved_requests': 0})
+        self.assertEqual(Counter.objects.get(key=counters.PENDING_REQUESTS).value, 1)
+
+    def test_reconcile_reports_and_fixes_drift(self):
+        BookRequest.objects.create(student=self.student, book=self.books[0])
+        counters.get_counters([counters.PENDING_REQUESTS, counters.TOTAL_STUDENTS])
+        Counter.objects.filter(key=counters.PENDING_REQUESTS).update(value=7)
+
+        out = StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertIn('requests:pending: stored 7, actual 1 (-6)', out.getvalue())
+        self.assertEqual(Counter.objects.get(key=counters.PENDING_REQUESTS).value, 7)
+
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(Counter.objects.get(key=counters.PENDING_REQUESTS).value, 1)
+
+
+class StudentIdTests(TestCase):
+
+    def test_ids_are_sequential(self):
+        first, second = make_student('first'), make_student('second')
+        self.assertRegex(first.student_id, r'^STU\d{6}$')
+        self.assertEqual(int(second.student_id[3:]), int(first.student_id[3:]) + 1)
+        self.assertIsNone(make_admin().student_id)
+
+    def test_sequence_starts_above_existing_ids(self):
+        User.objects.create_user(username='legacy', mobile_number='5550000001', student_id='STU999998')
+        IdSequence.objects.all().delete()
+        self.assertEqual(make_student().student_id, 'STU999999')
+        self.assertEqual(make_student('next').student_id, 'STU1000000')
+
+    def test_bulk_create_reserves_one_block(self):
+        users = [
+            User(username=f'bulk{n}', mobile_number=f'555100{n:04d}', user_type='student')
+            for n in range(50)
+        ]
+        with self.assertNumQueries(5):  # savepoint, claim, read back, release, insert
+            User.objects.bulk_create(users)
+        numbers = [int(user.student_id[3:]) for user in users]
+        self.assertEqual(numbers, list(range(numbers[0], numbers[0] + 50)))
+        self.assertEqual(make_student().student_id, student_ids.format_student_id(numbers[-1] + 1))
+
+    def test_registration_cost_is_flat(self):
+        results = benchmark.run_registration_benchmark(students=200, steps=2, sample=5, batch_size=50)
+        self.assertEqual([step['students'] for step in results], [105, 205])
+        self.assertEqual(results[0]['queries'], results[1]['queries'])
+        self.assertFalse(User.objects.filter(username__startswith='bench-').exists())
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class StudentImportTests(TestCase):
+    ROSTER = (
+        'username,full_name,mobile_number,email,password\n'
+        'asha,Asha Rao,9100000001,asha@example.com,Tr1cky-Passw0rd\n'
+        'ben,Ben Ode,9100000002,BEN@example.com,\n'
+        'taken,Taken Name,9100000003,taken@example.com,Tr1cky-Passw0rd\n'
+        'carl,Carl Ng,9100000001,carl@example.com,Tr1cky-Passw0rd\n'
+        'dee,Dee Lo,9100000004,not-an-email,Tr1cky-Passw0rd\n'
+        'eve,,9100000005,eve@example.com,Tr1cky-Passw0rd\n'
+        'fay,Fay Wu,9100000006,fay@example.com,fay\n'
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        make_student('taken')
+
+    def run_import(self, **kwargs):
+        errors = StringIO()
+        stats = StudentImporter(errors=errors, workers=1, **kwargs).run(BytesIO(self.ROSTER.encode()))
+        return stats, list(csv.reader(StringIO(errors.getvalue())))
+
+    def test_valid_rows_are_created_and_bad_ones_reported(self):
+        stats, errors = self.run_import(batch_size=2)
+        self.assertEqual((stats['records'], stats['created'], stats['errors']), (7, 2, 5))
+        self.assertEqual([row[:2] for row in errors[1:]], [
+            ['4', 'taken'], ['5', 'carl'], ['6', 'dee'], ['7', 'eve'], ['8', 'fay'],
+        ])
+        self.assertIn("mobile_number '9100000001' is already taken", errors[2][2])
+        asha, ben = User.objects.filter(username__in=['asha', 'ben']).order_by('username')
+        self.assertTrue(asha.check_password('Tr1cky-Passw0rd'))
+        self.assertFalse(ben.has_usable_password())
+        self.assertEqual(ben.email, 'ben@example.com')
+        self.assertRegex(asha.student_id, r'^STU\d{6}$')
+        self.assertEqual(counters.get_counters([counters.TOTAL_STUDENTS])[counters.TOTAL_STUDENTS], 3)
+
+    def test_registration_during_the_import(self):
+        importer = StudentImporter(workers=1)
+        # Registers after the sets were loaded, with the same username as a roster row.
+        make_student('asha')
+        stats = importer.run(BytesIO(self.ROSTER.encode()))
+        self.assertEqual((stats['created'], stats['errors']), (1, 6))
+        # The rolled-back attempt's student IDs were not kept, so later registrations get fresh ones.
+        later = [make_student(f'later{n}') for n in range(3)]
+        ids = list(User.objects.filter(user_type='student').values_list('student_id', flat=True))
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertRegex(later[-1].student_id, r'^STU\d{6}$')
+
+    def test_uniqueness_sets_are_loaded_in_one_query(self):
+        with self.assertNumQueries(1):
+            StudentImporter(dry_run=True)
+
+    def test_dry_run_writes_nothing(self):
+        stats, errors = self.run_import(dry_run=True)
+        self.assertEqual((stats['created'], stats['errors']), (2, 5))
+        self.assertFalse(User.objects.filter(username='asha').exists())
+
+    def test_passwords_are_hashed_in_worker_processes(self):
+        errors = StringIO()
+        StudentImporter(errors=errors, workers=2).run(BytesIO(self.ROSTER.encode()))
+        self.assertTrue(User.objects.get(username='asha').check_password('Tr1cky-Passw0rd'))
+
+    def test_command_writes_an_error_report(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'roster.csv')
+        with open(path, 'w', encoding='utf-8') as roster:
+            roster.write(self.ROSTER)
+        out = StringIO()
+        call_command('import_students', path, workers=1, stdout=out)
+        self.assertIn('Created 2 students', out.getvalue())
+        with open(f'{path}.errors.csv', encoding='utf-8') as report:
+            self.assertEqual(len(report.readlines()), 6)
+
+
+class ConcurrentRegistrationTests(TransactionTestCase):
+
+    def register_in_thread(self, n, barrier, ids):
+        try:
+            barrier.wait()
+            while True:
+                try:
+                    with transaction.atomic():
+                        student = make_reader(f'racer{n}')
+                    ids.append(student.student_id)
+                    return
+                except OperationalError:
+                    # SQLite reports lock contention instead of blocking; retry.
+                    time.sleep(0.01)
+        finally:
+            connection.close()
+
+    def test_parallel_registrations_get_distinct_ids(self):
+        barrier = threading.Barrier(20)
+        ids = []
+        threads = [
+            threading.Thread(target=self.register_in_thread, args=(n, barrier, ids)) for n in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(ids)), 20)
+
+
+class ConcurrentCounterTests(TransactionTestCase):
+
+    def setUp(self):
+        self.admin = make_admin()
+        category = Category.objects.create(name='Reference')
+        self.books = [
+            make_book(category, self.admin, title=f'Book {i}', isbn=f'{i:013d}') for i in range(10)
+        ]
+        self.students = [make_reader(f'reader{i}') for i in range(10)]
+
+    def retry(self, barrier, work):
+        try:
+            barrier.wait()
+            while True:
+                try:
+                    return work()
+                except OperationalError:
+                    # SQLite reports lock contention instead of blocking; retry.
+                    time.sleep(0.01)
+        finally:
+            connection.close()
+
+    def file_request(self, student, book):
+        with transaction.atomic():
+            BookRequest.objects.create(student=student, book=book)
+
+    def reseed(self):
+        Counter.objects.filter(key=counters.PENDING_REQUESTS).delete()
+        counters.get_counters([counters.PENDING_REQUESTS])
+
+    def test_requests_filed_while_a_counter_is_seeded_are_kept(self):
+        compute = counters.compute
+
+        def slow_compute(key):
+            # Widen the window between counting and storing the result.
+            value = compute(key)
+            time.sleep(0.05)
+            return value
+
+        jobs = [
+            lambda student=student, book=book: self.file_request(student, book)
+            for student, book in zip(self.students, self.books)
+        ] + [self.reseed] * 10
+        barrier = threading.Barrier(len(jobs))
+        threads = [threading.Thread(target=self.retry, args=(barrier, job)) for job in jobs]
+        with mock.patch.object(counters, 'compute', slow_compute):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(counters.get_counters([counters.PENDING_REQUESTS])[counters.PENDING_REQUESTS], 10)
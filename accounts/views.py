@@ -7,6 +7,8 @@ from django.contrib import messages
 from django.urls import reverse_lazy
 from django.db.models import Q
 from .models import User, AdminProfile
+from . import counters
+from .mixins import AsyncLoginRequiredMixin
 from .forms import StudentRegistrationForm, AdminLoginForm, UserProfileForm
 from books.models import BookRequest
 from transactions.models import Transaction
@@ -58,27 +60,33 @@ class LogoutView(View):
         logout(request)
         return redirect('home')
 
-class DashboardView(LoginRequiredMixin, TemplateView):
+class DashboardView(AsyncLoginRequiredMixin, TemplateView):
     template_name = 'accounts/dashboard.html'
     
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        user = self.request.user
+    async def get(self, request, *args, **kwargs):
+        context = self.get_context_data(**kwargs)
+        user = request.user
         
         if user.user_type == 'student':
+            pending_key = counters.student_requests_key(user.pk, 'pending')
+            approved_key = counters.student_requests_key(user.pk, 'approved')
+            values = await counters.aget_counters([pending_key, approved_key])
+            recent = Transaction.objects.filter(student=user).select_related('book')[:5]
             context.update({
-                'pending_requests': BookRequest.objects.filter(student=user, status='pending').count(),
-                'approved_requests': BookRequest.objects.filter(student=user, status='approved').count(),
-                'recent_transactions': Transaction.objects.filter(student=user)[:5],
+                'pending_requests': values[pending_key],
+                'approved_requests': values[approved_key],
+                'recent_transactions': [transaction async for transaction in recent],
             })
         elif user.user_type == 'admin':
+            values = await counters.aget_counters([counters.PENDING_REQUESTS, counters.TOTAL_STUDENTS])
+            recent = BookRequest.objects.filter(status='pending').select_related('student', 'book')[:5]
             context.update({
-                'pending_requests': BookRequest.objects.filter(status='pending').count(),
-                'total_students': User.objects.filter(user_type='student').count(),
-                'recent_requests': BookRequest.objects.filter(status='pending')[:5],
+                'pending_requests': values[counters.PENDING_REQUESTS],
+                'total_students': values[counters.TOTAL_STUDENTS],
+                'recent_requests': [book_request async for book_request in recent],
             })
         
-        return context
+        return self.render_to_response(context)
 
 class ProfileView(LoginRequiredMixin, UpdateView):
     model = User
@@ -0,0 +1,119 @@
+"""
+Field selection and serialization for the JSON API.
+
+Each serializer maps public field names to model attribute paths, written
+the way the ORM spells them (``category__name``). ``?fields=a,b`` picks a
+sparse fieldset. ``prepare`` narrows the queryset to exactly the columns
+those fields need, using ``select_related`` for related ones, so
+serializing a page never runs a query per row.
+"""
+
+
+class Serializer:
+    fields = {}
+    default_fields = ()
+
+    def __init__(self, requested=None):
+        if requested:
+            names = [name.strip() for name in requested.split(',') if name.strip()]
+            unknown = [name for name in names if name not in self.fields]
+            if unknown:
+                raise ValueError(f"Unknown field(s): {', '.join(unknown)}. "
+                                 f"Available: {', '.join(self.fields)}.")
+            self.selected = list(dict.fromkeys(names))
+        else:
+            self.selected = list(self.default_fields or self.fields)
+
+    def prepare(self, queryset, *extra_columns):
+        """Load only the selected fields' columns (plus ``extra_columns``)."""
+        paths = [self.fields[name] for name in self.selected]
+        columns = [path for path in paths if path != 'pk'] + list(extra_columns)
+        relations = {path.rsplit('__', 1)[0] for path in paths if '__' in path}
+        return queryset.select_related(None).select_related(*relations).only(*columns)
+
+    def serialize(self, obj):
+        data = {}
+        for name in self.selected:
+            value = obj
+            for attribute in self.fields[name].split('__'):
+                value = getattr(value, attribute)
+                if value is None:
+                    break
+            data[name] = value
+        return data
+
+
+class CategorySerializer(Serializer):
+    fields = {'id': 'pk', 'name': 'name', 'description': 'description'}
+
+
+class BookSerializer(Serializer):
+    fields = {
+        'id': 'pk',
+        'title': 'title',
+        'author': 'author',
+        'isbn': 'isbn',
+        'category_id': 'category_id',
+        'category': 'category__name',
+        'description': 'description',
+        'pages': 'pages',
+        'publication_date': 'publication_date',
+        'publisher': 'publisher',
+        'total_copies': 'total_copies',
+        'available_copies': 'available_copies',
+        'created_at': 'created_at',
+        'updated_at': 'updated_at',
+    }
+    default_fields = ('id', 'title', 'author', 'isbn', 'category', 'available_copies')
+
+
+class BookRequestSerializer(Serializer):
+    fields = {
+        'id': 'pk',
+        'status': 'status',
+        'book_id': 'book_id',
+        'book_title': 'book__title',
+        'book_author': 'book__author',
+        'student_id': 'student_id',
+        'student_name': 'student__full_name',
+        'student_number': 'student__student_id',
+        'request_date': 'request_date',
+        'approval_date': 'approval_date',
+        'due_date': 'due_date',
+        'return_date': 'return_date',
+    }
+    default_fields = ('id', 'status', 'book_id', 'book_title', 'student_id', 'request_date', 'due_date')
+
+
+class TransactionSerializer(Serializer):
+    fields = {
+        'id': 'pk',
+        'type': 'transaction_type',
+        'book_id': 'book_id',
+        'book_title': 'book__title',
+        'student_id': 'student_id',
+        'student_name': 'student__full_name',
+        'loan_id': 'loan_id',
+        'transaction_date': 'transaction_date',
+        'due_date': 'due_date',
+        'return_date': 'return_date',
+        'fine_amount': 'fine_amount',
+        'processed_by': 'processed_by__full_name',
+    }
+    default_fields = ('id', 'type', 'book_id', 'book_title', 'student_id', 'transaction_date', 'due_date')
+
+
+class FineSerializer(Serializer):
+    fields = {
+        'id': 'pk',
+        'student_id': 'student_id',
+        'student_name': 'student__full_name',
+        'transaction_id': 'transaction_id',
+        'book_title': 'transaction__book__title',
+        'amount': 'amount',
+        'reason': 'reason',
+        'is_paid': 'is_paid',
+        'created_at': 'created_at',
+        'paid_date': 'paid_date',
+    }
+    default_fields = ('id', 'student_id', 'book_title', 'amount', 'reason', 'is_paid', 'created_at')
@@ -0,0 +1,157 @@
+import json
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+
+from accounts import counters
+from books.models import Book, BookHold, BookRequest, Category
+from books.tests import make_admin, make_book, make_student
+from transactions.models import Fine, Transaction
+
+
+class ApiTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        cls.student = make_student()
+        cls.category = Category.objects.create(name='Reference')
+        cls.books = [
+            make_book(cls.category, cls.admin, title=f'Book {i}', isbn=f'{i:013d}')
+            for i in range(5)
+        ]
+
+    def get(self, name, user=None, **params):
+        self.client.force_login(user or self.student)
+        return self.client.get(reverse(f'api:{name}'), params)
+
+    def batch(self, name, ids, user=None):
+        self.client.force_login(user or self.student)
+        response = self.client.post(reverse(f'api:{name}'), json.dumps({'ids': ids}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return {row['id']: row['outcome'] for row in response.json()['results']}
+
+
+class ApiListTests(ApiTestCase):
+
+    def test_books_default_fields(self):
+        results = self.get('books').json()['results']
+        self.assertEqual(len(results), 5)
+        self.assertEqual(set(results[0]), {'id', 'title', 'author', 'isbn', 'category', 'available_copies'})
+        self.assertEqual(results[0]['category'], 'Reference')
+
+    def test_sparse_fieldset(self):
+        results = self.get('books', fields='id,title').json()['results']
+        self.assertEqual(results[0], {'id': self.books[-1].pk, 'title': 'Book 4'})
+        response = self.get('books', fields='title,shelf')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('shelf', response.json()['error'])
+
+    def test_cursor_pagination(self):
+        seen = []
+        params = {'limit': 2, 'fields': 'id'}
+        while True:
+            body = self.get('books', **params).json()
+            seen += [row['id'] for row in body['results']]
+            if not body['next']:
+                break
+            params['cursor'] = body['next']
+        self.assertEqual(seen, [book.pk for book in reversed(self.books)])
+        self.assertEqual(self.get('books', cursor='garbage').status_code, 400)
+
+    def test_no_query_per_row(self):
+        for book in self.books:
+            BookRequest.objects.create(student=self.student, book=book)
+        self.client.force_login(self.admin)
+        # session, user, page
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('api:requests'),
+                                       {'fields': 'id,book_title,student_name,student_number'})
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_fines_follow_nested_relations(self):
+        loan = Transaction.objects.create(student=self.student, book=self.books[0],
+                                          transaction_type='issue', processed_by=self.admin)
+        Fine.objects.create(student=self.student, transaction=loan, amount='1.50', reason='Late')
+        self.client.force_login(self.admin)
+        with self.assertNumQueries(3):
+            [fine] = self.client.get(reverse('api:fines')).json()['results']
+        self.assertEqual((fine['book_title'], fine['amount']), ('Book 0', '1.50'))
+        [fine] = self.get('my_fines').json()['results']
+        self.assertEqual(fine['student_id'], self.student.pk)
+
+    def test_book_detail(self):
+        book = self.books[0]
+        self.client.force_login(self.student)
+        body = self.client.get(reverse('api:book', args=[book.pk]), {'fields': 'isbn,pages'}).json()
+        self.assertEqual(body, {'isbn': book.isbn, 'pages': book.pages})
+        self.assertEqual(self.client.get(reverse('api:book', args=[0])).status_code, 404)
+
+    def test_permissions_follow_the_html_views(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('api:books')).status_code, 401)
+        self.assertEqual(self.get('requests').status_code, 403)
+        self.assertEqual(self.get('transactions').status_code, 403)
+        self.assertEqual(self.get('my_requests', user=self.admin).status_code, 403)
+        self.assertEqual(self.get('categories').json()['results'][0]['name'], 'Reference')
+
+
+class ApiBatchTests(ApiTestCase):
+
+    def test_request_many_books(self):
+        checked_out = self.books[1]
+        Book.objects.filter(pk=checked_out.pk).update(available_copies=0)
+        BookRequest.objects.create(student=self.student, book=self.books[2])
+        counters.get_counters([counters.PENDING_REQUESTS])
+
+        outcomes = self.batch('batch_request', [self.books[0].pk, checked_out.pk, self.books[2].pk, 0])
+        self.assertEqual(outcomes, {
+            self.books[0].pk: 'requested', checked_out.pk: 'waitlisted',
+            self.books[2].pk: 'already_requested', 0: 'not_found',
+        })
+        self.assertTrue(BookHold.objects.filter(queue_id=checked_out.pk, student=self.student).exists())
+        self.assertEqual(counters.get_counters([counters.PENDING_REQUESTS])[counters.PENDING_REQUESTS], 2)
+
+        # Once a copy is back, a request takes the place of the hold.
+        Book.objects.filter(pk=checked_out.pk).update(available_copies=1)
+        self.assertEqual(self.batch('batch_request', [checked_out.pk]), {checked_out.pk: 'requested'})
+        self.assertEqual(BookHold.objects.get(queue_id=checked_out.pk, student=self.student).status, 'cancelled')
+
+    def test_request_filed_concurrently_is_reported(self):
+        insert = BookRequest.objects.bulk_create
+
+        def racing_insert(requests, **kwargs):
+            # Another tab files a request for the second book just before this insert.
+            if not BookRequest.objects.filter(book=self.books[1]).exists():
+                BookRequest.objects.create(student=self.student, book=self.books[1])
+            return insert(requests, **kwargs)
+
+        with mock.patch.object(BookRequest.objects, 'bulk_create', racing_insert):
+            outcomes = self.batch('batch_request', [self.books[0].pk, self.books[1].pk])
+        self.assertEqual(outcomes, {self.books[0].pk: 'requested', self.books[1].pk: 'already_requested'})
+        self.assertEqual(BookRequest.objects.filter(student=self.student, status='pending').count(), 2)
+        self.assertEqual(counters.get_counters([counters.PENDING_REQUESTS])[counters.PENDING_REQUESTS], 2)
+
+    def test_approve_and_return_many(self):
+        loans = [BookRequest.objects.create(student=self.student, book=book) for book in self.books[:3]]
+        ids = [loan.pk for loan in loans]
+        self.assertEqual(self.batch('batch_approve', ids, user=self.admin),
+                         dict.fromkeys(ids, 'approved'))
+        self.assertEqual(self.batch('batch_return', ids[:2] + [0]),
+                         {ids[0]: 'returned', ids[1]: 'returned', 0: 'not_found'})
+        self.assertEqual(self.batch('batch_return', ids[:1]), {ids[0]: 'already_returned'})
+        self.assertEqual(Transaction.objects.filter(transaction_type='return').count(), 2)
+
+    def test_batch_permissions_and_validation(self):
+        self.client.force_login(self.student)
+        url = reverse('api:batch_approve')
+        response = self.client.post(url, '{"ids": [1]}', content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.client.force_login(self.admin)
+        for body in ('not json', '{"ids": []}', '{"ids": ["1"]}', json.dumps({'ids': list(range(101))})):
+            response = self.client.post(url, body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+        response = self.client.post(url, '{"ids": [true]}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,20 @@
+from django.urls import path
+from . import views
+
+app_name = 'api'
+
+urlpatterns = [
+    path('categories/', views.CategoryListAPI.as_view(), name='categories'),
+    path('books/', views.BookListAPI.as_view(), name='books'),
+    path('books/<int:pk>/', views.BookDetailAPI.as_view(), name='book'),
+    path('requests/', views.RequestQueueAPI.as_view(), name='requests'),
+    path('requests/batch/request/', views.BatchRequestAPI.as_view(), name='batch_request'),
+    path('requests/batch/approve/', views.BatchApproveAPI.as_view(), name='batch_approve'),
+    path('requests/batch/reject/', views.BatchRejectAPI.as_view(), name='batch_reject'),
+    path('requests/batch/return/', views.BatchReturnAPI.as_view(), name='batch_return'),
+    path('my/requests/', views.MyRequestsAPI.as_view(), name='my_requests'),
+    path('transactions/', views.TransactionListAPI.as_view(), name='transactions'),
+    path('my/transactions/', views.MyTransactionsAPI.as_view(), name='my_transactions'),
+    path('fines/', views.FineListAPI.as_view(), name='fines'),
+    path('my/fines/', views.MyFinesAPI.as_view(), name='my_fines'),
+]
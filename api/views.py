@@ -0,0 +1,197 @@
+"""
+JSON API, version 1.
+
+Each endpoint subclasses the HTML view it mirrors. It keeps that view's
+``test_func`` (who may call it) and ``get_queryset`` (which rows they
+see), and swaps the template for JSON. Authentication is the site's
+session login. Unsafe methods need the CSRF token like any form post.
+
+Lists take ``?fields=`` for a sparse fieldset, ``?limit=`` (at most
+``MAX_PAGE_SIZE``) and ``?cursor=``. They page newest first with the
+ledgers' keyset pagination and return ``{"results", "next",
+"previous"}``. Batch endpoints take ``{"ids": [...]}`` and report an
+outcome per id, so one failed item doesn't fail the rest.
+"""
+import json
+
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import JsonResponse
+from django.views.generic import ListView, View
+
+from books.models import Book, BookRequest, Category
+from books.search import search_books
+from books.conditional import CatalogueAccessMixin
+from books.views import (
+    BookListView, BookRequestListView, BulkRequestActionView, MyRequestsView,
+    RequestBookView, ReturnBookView,
+)
+from transactions.pagination import KeysetPage, decode_cursor
+from transactions.views import FineListView, MyFinesView, MyTransactionsView, TransactionListView
+from .serializers import (
+    BookRequestSerializer, BookSerializer, CategorySerializer, FineSerializer, TransactionSerializer,
+)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BATCH_SIZE = 100
+
+
+def error(message, status=400):
+    return JsonResponse({'error': message}, status=status)
+
+
+class ApiMixin:
+    """JSON errors instead of login redirects and HTML error pages."""
+
+    def handle_no_permission(self):
+        if not self.request.user.is_authenticated:
+            return error('Authentication required.', status=401)
+        return error('You do not have permission to use this endpoint.', status=403)
+
+
+class ResourceListMixin(ApiMixin):
+    serializer_class = None
+    keyset_field = None
+
+    def get_limit(self):
+        limit = self.request.GET.get('limit', '')
+        if limit.isdigit():
+            return min(max(int(limit), 1), MAX_PAGE_SIZE)
+        return DEFAULT_PAGE_SIZE
+
+    def get(self, request, *args, **kwargs):
+        try:
+            serializer = self.serializer_class(request.GET.get('fields'))
+        except ValueError as exc:
+            return error(str(exc))
+        cursor = None
+        if request.GET.get('cursor'):
+            cursor = decode_cursor(request.GET['cursor'])
+            if cursor is None:
+                return error('Invalid cursor.')
+
+        queryset = serializer.prepare(self.get_queryset(), self.keyset_field)
+        page = KeysetPage(queryset, self.keyset_field, self.get_limit(), cursor=cursor)
+        return JsonResponse({
+            'results': [serializer.serialize(obj) for obj in page.object_list],
+            'next': page.next_cursor,
+            'previous': page.previous_cursor,
+        })
+
+
+class BatchMixin(ApiMixin):
+    """Parses ``{"ids": [...]}`` and answers with ``{"results": [{"id", "outcome"}]}``."""
+
+    def post(self, request, *args, **kwargs):
+        try:
+            ids = json.loads(request.body or b'{}').get('ids')
+        except (ValueError, AttributeError):
+            return error('Expected a JSON object.')
+        # bool is an int subclass, but true/false are not ids.
+        if not isinstance(ids, list) or not ids or not all(
+            isinstance(pk, int) and not isinstance(pk, bool) for pk in ids
+        ):
+            return error('"ids" must be a non-empty list of integers.')
+        if len(ids) > MAX_BATCH_SIZE:
+            return error(f'At most {MAX_BATCH_SIZE} ids per call.')
+        outcomes = self.run_batch(ids)
+        return JsonResponse({
+            'results': [{'id': pk, 'outcome': outcome} for pk, outcome in outcomes.items()],
+        })
+
+    def run_batch(self, ids):
+        raise NotImplementedError
+
+
+class CategoryListAPI(ResourceListMixin, LoginRequiredMixin, ListView):
+    model = Category
+    serializer_class = CategorySerializer
+    keyset_field = 'created_at'
+
+
+class BookListAPI(ResourceListMixin, BookListView):
+    """The catalogue; ``?all=1`` includes checked-out books, ``?q=`` searches."""
+    serializer_class = BookSerializer
+    keyset_field = 'created_at'
+
+    def get_queryset(self):
+        books = super().get_queryset()
+        query = self.request.GET.get('q', '').strip()
+        if query:
+            books = books.filter(pk__in=search_books(query).book_ids)
+        category = self.request.GET.get('category', '')
+        if category.isdigit():
+            books = books.filter(category_id=category)
+        return books
+
+
+class BookDetailAPI(ApiMixin, CatalogueAccessMixin, View):
+    # Not a BookDetailView subclass: that view's handlers are async.
+
+    def get(self, request, *args, **kwargs):
+        try:
+            serializer = BookSerializer(request.GET.get('fields'))
+        except ValueError as exc:
+            return error(str(exc))
+        book = Book.objects.filter(pk=kwargs['pk'])
+        book = serializer.prepare(book).first()
+        if book is None:
+            return error('Not found.', status=404)
+        return JsonResponse(serializer.serialize(book))
+
+
+class RequestQueueAPI(ResourceListMixin, BookRequestListView):
+    """Pending requests (librarians)."""
+    serializer_class = BookRequestSerializer
+    keyset_field = 'request_date'
+
+
+class MyRequestsAPI(ResourceListMixin, MyRequestsView):
+    serializer_class = BookRequestSerializer
+    keyset_field = 'request_date'
+
+
+class TransactionListAPI(ResourceListMixin, TransactionListView):
+    serializer_class = TransactionSerializer
+    keyset_field = 'transaction_date'
+
+
+class MyTransactionsAPI(ResourceListMixin, MyTransactionsView):
+    serializer_class = TransactionSerializer
+    keyset_field = 'transaction_date'
+
+
+class FineListAPI(ResourceListMixin, FineListView):
+    serializer_class = FineSerializer
+    keyset_field = 'created_at'
+
+
+class MyFinesAPI(ResourceListMixin, MyFinesView):
+    serializer_class = FineSerializer
+    keyset_field = 'created_at'
+
+
+class BatchRequestAPI(BatchMixin, RequestBookView):
+    """Request books (``ids`` are book ids); checked-out ones join the waitlist."""
+
+    def run_batch(self, ids):
+        return BookRequest.bulk_request(ids, self.request.user)
+
+
+class BatchApproveAPI(BatchMixin, BulkRequestActionView):
+
+    def run_batch(self, ids):
+        return BookRequest.bulk_approve(ids, self.request.user)
+
+
+class BatchRejectAPI(BatchMixin, BulkRequestActionView):
+
+    def run_batch(self, ids):
+        return BookRequest.bulk_reject(ids, self.request.user)
+
+
+class BatchReturnAPI(BatchMixin, ReturnBookView):
+    """Return the student's own loans (``ids`` are request ids)."""
+
+    def run_batch(self, ids):
+        return BookRequest.bulk_return(ids, self.request.user)
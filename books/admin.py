@@ -1,5 +1,11 @@
-from django.contrib import admin
-from .models import Category, Book, BookRequest
+import io
+
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.template.response import TemplateResponse
+from django.urls import path
+from .forms import BookImportForm
+from .models import Category, Book, BookHold, BookRequest
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -14,6 +20,7 @@ class BookAdmin(admin.ModelAdmin):
     search_fields = ('title', 'author', 'isbn')
     ordering = ('-created_at',)
     readonly_fields = ('created_at', 'updated_at')
+    change_list_template = 'admin/books/book/change_list.html'
     
     fieldsets = (
         ('Book Information', {
@@ -33,6 +40,50 @@ class BookAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+    
+    # Errors shown on the result page; the full report is in the download.
+    IMPORT_ERRORS_SHOWN = 50
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Copies added by hand go to the waitlist first, as returned ones do.
+        if change and 'available_copies' in form.changed_data:
+            fulfilled = BookHold.objects.fulfil_available(obj.pk, request.user)
+            if fulfilled:
+                obj.refresh_from_db(fields=['available_copies'])
+                messages.info(request, f'{len(fulfilled)} copies were issued to students on the waitlist.')
+    
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='books_book_import'),
+        ] + super().get_urls()
+    
+    def import_view(self, request):
+        from .importer import BookImporter
+        
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        form = BookImportForm(request.POST or None, request.FILES or None)
+        context = {**self.admin_site.each_context(request), 'opts': self.model._meta,
+                   'title': 'Import books', 'form': form}
+        
+        if request.method == 'POST' and form.is_valid():
+            errors = io.StringIO()
+            importer = BookImporter(request.user, update_existing=form.cleaned_data['update_existing'],
+                                    errors=errors)
+            try:
+                stats = importer.run(form.cleaned_data['file'].file, form.cleaned_data['format'])
+            except (ValueError, SyntaxError) as error:
+                messages.error(request, f'The file could not be read: {error}')
+            else:
+                messages.success(request, (
+                    f"Imported {stats['records']} records: {stats['created']} created, "
+                    f"{stats['updated']} updated, {stats['skipped']} skipped as existing."
+                ))
+                error_rows = errors.getvalue().splitlines()[1:]
+                context.update(stats=stats, error_rows=error_rows[:self.IMPORT_ERRORS_SHOWN],
+                               error_report=errors.getvalue() if error_rows else '')
+        return TemplateResponse(request, 'admin/books/book/import.html', context)
 
 @admin.register(BookRequest)
 class BookRequestAdmin(admin.ModelAdmin):
@@ -56,4 +107,13 @@ class BookRequestAdmin(admin.ModelAdmin):
             'fields': ('request_date',),
             'classes': ('collapse',)
         }),
-    )
\ No newline at end of file
+    )
+
+@admin.register(BookHold)
+class BookHoldAdmin(admin.ModelAdmin):
+    list_display = ('student', 'queue', 'ticket', 'status', 'created_at', 'fulfilled_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('student__username', 'student__full_name', 'queue__book__title')
+    list_select_related = ('student', 'queue__book')
+    raw_id_fields = ('loan',)
+    readonly_fields = ('queue', 'ticket', 'created_at', 'fulfilled_at')
\ No newline at end of file
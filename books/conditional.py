@@ -0,0 +1,171 @@
+"""
+Conditional GET for the catalogue pages.
+
+``ConditionalGetMixin`` computes validators for a page before rendering
+it. If the client's copy still matches, it answers ``304 Not Modified``
+and no template is rendered. The catalogue validator is built from
+``MAX(Book.updated_at)`` and the ``books:total`` counter; the counter
+catches deletions, which don't move the maximum. Detail pages use the
+book's own ``updated_at``. Views add the per-user state that shows on the
+page through ``get_page_state``. The ETag also covers the user (the
+navbar shows their name) and the full URL.
+
+``Last-Modified`` is always sent, but ``If-Modified-Since`` is only
+checked for signed-out pages. A date alone can't tell two users apart.
+
+With ``CATALOGUE_PUBLIC`` set, signed-out visitors (kiosks) may browse
+the catalogue. ``CATALOGUE_SHARED_MAX_AGE`` then lets a shared proxy
+cache those signed-out pages for that many seconds.
+
+``AsyncConditionalGetMixin`` does the same for views with async
+handlers. They implement ``aget_page_state`` and ``aget_page`` instead.
+"""
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db.models import Max, Subquery
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from accounts.mixins import AsyncLoginRequiredMixin
+
+
+def catalogue_state():
+    """``(MAX(updated_at), number of books)`` for the whole catalogue, in one query."""
+    from accounts.counters import TOTAL_BOOKS, get_counters
+    from accounts.models import Counter
+    from .models import Book
+
+    latest = Book.objects.order_by('-updated_at').values('updated_at')[:1]
+    row = (
+        Counter.objects.filter(key=TOTAL_BOOKS).annotate(latest=Subquery(latest))
+        .values_list('latest', 'value').first()
+    )
+    if row is None:
+        # The counter is computed on first read.
+        count = get_counters([TOTAL_BOOKS])[TOTAL_BOOKS]
+        return Book.objects.aggregate(latest=Max('updated_at'))['latest'], count
+    return row
+
+
+async def acatalogue_state():
+    from accounts.counters import TOTAL_BOOKS
+    from accounts.models import Counter
+    from .models import Book
+
+    latest = Book.objects.order_by('-updated_at').values('updated_at')[:1]
+    row = await (
+        Counter.objects.filter(key=TOTAL_BOOKS).annotate(latest=Subquery(latest))
+        .values_list('latest', 'value').afirst()
+    )
+    if row is None:
+        return await sync_to_async(catalogue_state)()
+    return row
+
+
+def has_messages(request):
+    return bool(len(messages.get_messages(request)))
+
+
+def make_etag(*parts):
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+    # Weak: equivalent pages, not byte-for-byte identical ones (CSRF tokens differ).
+    return f'W/"{digest}"'
+
+
+class CatalogueAccessMixin(LoginRequiredMixin):
+    """Login required, unless ``CATALOGUE_PUBLIC`` opens the catalogue to signed-out visitors."""
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated and getattr(settings, 'CATALOGUE_PUBLIC', False):
+            return super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)
+        return super().dispatch(request, *args, **kwargs)
+
+
+class AsyncCatalogueAccessMixin(AsyncLoginRequiredMixin):
+
+    def allows_anonymous(self):
+        return getattr(settings, 'CATALOGUE_PUBLIC', False)
+
+
+class ConditionalGetMixin:
+
+    def get_page_state(self):
+        """
+        Return ``(last_modified, parts)``: the newest change to the data on
+        the page, and anything else it depends on (counts, the user's own
+        requests) as a tuple of plain values.
+        """
+        latest, count = catalogue_state()
+        return latest, (count,)
+
+    def get_validators(self, page_state=None):
+        user = self.request.user
+        identity = (user.pk, user.user_type, user.full_name) if user.is_authenticated else None
+        last_modified, parts = page_state or self.get_page_state()
+        etag = make_etag(
+            self.request.get_full_path(), identity, last_modified and last_modified.isoformat(), *parts,
+        )
+        return etag, last_modified
+
+    def get_not_modified(self, etag, last_modified):
+        """The ``304`` (or ``412``) response if the client's copy is current, else ``None``."""
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        shared = not self.request.user.is_authenticated
+        return get_conditional_response(
+            self.request, etag=etag, last_modified=timestamp if shared else None,
+        )
+
+    def get(self, request, *args, **kwargs):
+        # Flash messages are shown once; a 304 would swallow them.
+        if has_messages(request):
+            response = super().get(request, *args, **kwargs)
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        etag, last_modified = self.get_validators()
+        response = self.get_not_modified(etag, last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        return self.set_validators(response, etag, last_modified)
+
+    def set_validators(self, response, etag, last_modified):
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        shared = not self.request.user.is_authenticated
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        max_age = getattr(settings, 'CATALOGUE_SHARED_MAX_AGE', 0)
+        if shared and max_age:
+            patch_cache_control(response, public=True, max_age=max_age)
+        else:
+            # Revalidate on every visit; the answer is usually a 304.
+            patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Cookie'])
+        return response
+
+
+class AsyncConditionalGetMixin(ConditionalGetMixin):
+
+    async def aget_page_state(self):
+        latest, count = await acatalogue_state()
+        return latest, (count,)
+
+    async def aget_page(self, request, *args, **kwargs):
+        """Build the full response; only called when there is no ``304`` to send."""
+        raise NotImplementedError
+
+    async def get(self, request, *args, **kwargs):
+        if await sync_to_async(has_messages)(request):
+            response = await self.aget_page(request, *args, **kwargs)
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        etag, last_modified = self.get_validators(await self.aget_page_state())
+        response = self.get_not_modified(etag, last_modified)
+        if response is None:
+            response = await self.aget_page(request, *args, **kwargs)
+        return self.set_validators(response, etag, last_modified)
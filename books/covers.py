@@ -0,0 +1,155 @@
+"""
+Cover thumbnails.
+
+Uploaded covers are kept as they are; smaller derivatives are generated
+off the request path and their storage paths recorded in
+``Book.cover_thumbnails`` as ``{format: {width: path}}``. Derivative
+names start with a hash of the original's bytes, so re-uploading the same
+image (or the same cover on several books) reuses the files already
+there. Templates build ``srcset`` from them with ``Book.cover_sources``.
+
+New uploads are queued on a small thread pool after the saving
+transaction commits; ``manage.py generate_cover_thumbnails`` backfills
+existing covers across a process pool.
+"""
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_DIR = 'book_covers/thumbs'
+
+# Widths for the 1x/2x/3x variants of the ~200px catalogue cards and the detail page.
+WIDTHS = (200, 400, 800)
+
+# Pillow format name, file extension and encoder options, smallest output first.
+FORMATS = (
+    ('AVIF', 'avif', {'quality': 50}),
+    ('WEBP', 'webp', {'quality': 75, 'method': 4}),
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def available_formats():
+    return [(name, extension, options) for name, extension, options in FORMATS
+            if features.check(extension)]
+
+
+def build_thumbnails(data):
+    """
+    Write the derivatives of the image in ``data`` (bytes) to storage and
+    return the ``{format: {width: path}}`` map. Files that already exist
+    under the same content hash are not regenerated.
+    """
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    thumbnails = {}
+    for name, extension, options in available_formats():
+        paths = {}
+        for width in WIDTHS:
+            # Never upscale; a small original just gets fewer variants.
+            if width > image.width and paths:
+                break
+            path = f'{THUMBNAIL_DIR}/{digest}-{width}.{extension}'
+            if not default_storage.exists(path):
+                resized = image.copy()
+                resized.thumbnail((width, width * 4), Image.Resampling.LANCZOS)
+                output = io.BytesIO()
+                resized.save(output, name, **options)
+                default_storage.save(path, ContentFile(output.getvalue()))
+            paths[str(width)] = path
+        thumbnails[extension] = paths
+    return thumbnails
+
+
+def generate_cover_thumbnails(book_id, force=False):
+    """
+    Generate the derivatives for one book's cover. Returns True if the book
+    was updated. The result is only stored if the cover hasn't changed in
+    the meantime.
+    """
+    from .fragments import invalidate_books
+    from .models import Book
+
+    book = Book.objects.filter(pk=book_id).only('cover_image', 'cover_thumbnails').first()
+    if book is None or not book.cover_image:
+        return False
+    if book.cover_thumbnails and not force:
+        return False
+    with book.cover_image.open('rb') as cover:
+        data = cover.read()
+    thumbnails = build_thumbnails(data)
+    updated = bool(
+        Book.objects.filter(pk=book_id, cover_image=book.cover_image.name)
+        # Moves the catalogue's Last-Modified/ETag (books.conditional) too.
+        .update(cover_thumbnails=thumbnails, updated_at=timezone.now())
+    )
+    if updated:
+        # Cached cards still point at the original cover.
+        invalidate_books([book_id])
+    return updated
+
+
+def _run_in_worker(book_id):
+    try:
+        generate_cover_thumbnails(book_id)
+    except Exception:
+        logger.exception('Generating cover thumbnails for book %s failed', book_id)
+    finally:
+        # Worker threads get their own connection; don't leave it open.
+        connection.close()
+
+
+def init_backfill_worker():
+    # Models are imported lazily in this module so spawned workers can
+    # unpickle their tasks before Django is set up.
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+
+def backfill_cover(book_id, force=False):
+    """Process-pool entry point for the backfill; returns ``(book_id, updated, error)``."""
+    try:
+        return book_id, generate_cover_thumbnails(book_id, force=force), None
+    except Exception as error:
+        return book_id, False, f'{type(error).__name__}: {error}'
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'COVER_THUMBNAIL_WORKERS', 2),
+                thread_name_prefix='cover-thumbnails',
+            )
+        return _executor
+
+
+def queue_cover_thumbnails(book_id):
+    """
+    Generate a book's thumbnails once the current transaction commits.
+    With ``COVER_THUMBNAIL_WORKERS = 0`` they are generated inline instead.
+    """
+    if getattr(settings, 'COVER_THUMBNAIL_WORKERS', 2):
+        transaction.on_commit(lambda: get_executor().submit(_run_in_worker, book_id))
+    else:
+        transaction.on_commit(lambda: generate_cover_thumbnails(book_id))
@@ -0,0 +1,172 @@
+"""
+File downloads with byte ranges and conditional requests.
+
+PDF readers fetch large scans in pieces with ``Range`` requests. Serving
+these through ``django.conf.urls.static`` reads the whole file for every
+request. ``serve_file`` answers ``Range`` with ``206 Partial Content``,
+honours ``If-None-Match``/``If-Modified-Since`` and ``If-Range``, and
+streams whole files through ``FileResponse`` so the WSGI server can use
+``os.sendfile``. With ``PDF_SENDFILE_HEADER`` set, the bytes are left to
+the front proxy (nginx ``X-Accel-Redirect`` or Apache/lighttpd
+``X-Sendfile``) and Django only checks permissions and sets headers. The
+files themselves live outside ``MEDIA_ROOT`` (``books.storage``), so the
+proxy's internal location is the only other way to them.
+
+Under ASGI the body is an async iterator. Django would read a sync
+iterator into memory whole before sending it, and a long download would
+hold a thread throughout.
+"""
+import re
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """
+    Return ``(start, end)`` (inclusive) for a single-range ``Range`` header,
+    ``None`` to ignore it and send the whole file, or ``False`` if it can't
+    be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # Multiple or malformed ranges: a full response is always allowed.
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if not length:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def range_chunks(file, start, end, chunk_size=CHUNK_SIZE):
+    """Yield bytes ``start``..``end`` (inclusive) of ``file``, then close it."""
+    try:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+async def arange_chunks(file, start, end, chunk_size=CHUNK_SIZE):
+    """``range_chunks`` as an async iterator; each read runs in a worker thread."""
+    read = sync_to_async(file.read, thread_sensitive=False)
+    try:
+        await sync_to_async(file.seek, thread_sensitive=False)(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def file_validators(field_file):
+    """Return ``(etag, last_modified timestamp or None, size)`` for a stored file."""
+    storage, name = field_file.storage, field_file.name
+    try:
+        size = storage.size(name)
+    except OSError:
+        # The row points at a file that is no longer on storage.
+        raise Http404('The file is missing.')
+    try:
+        modified = storage.get_modified_time(name).timestamp()
+    except (NotImplementedError, AttributeError):
+        modified = None
+    etag = f'"{int((modified or 0) * 1000000):x}-{size:x}"'
+    return etag, modified, size
+
+
+def if_range_matches(request, etag, modified):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and modified is not None and int(modified) <= since
+
+
+def sendfile_response(field_file, header):
+    response = HttpResponse()
+    if header == 'X-Accel-Redirect':
+        prefix = getattr(settings, 'PDF_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        response[header] = prefix.rstrip('/') + '/' + quote(field_file.name)
+    else:
+        response[header] = field_file.path
+    # Let the proxy fill in the type, length and ranges of the file itself.
+    del response['Content-Type']
+    return response
+
+
+def serve_file(request, field_file, content_type, filename):
+    """Serve ``field_file`` with range and conditional request support."""
+    etag, modified, size = file_validators(field_file)
+    last_modified = int(modified) if modified is not None else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        header = getattr(settings, 'PDF_SENDFILE_HEADER', None)
+        byte_range = None
+        if header:
+            response = sendfile_response(field_file, header)
+        else:
+            if 'Range' in request.headers and if_range_matches(request, etag, modified):
+                byte_range = parse_range(request.headers['Range'], size)
+            if byte_range is False:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+            elif byte_range:
+                start, end = byte_range
+                file = field_file.storage.open(field_file.name, 'rb')
+                chunks = arange_chunks if isinstance(request, ASGIRequest) else range_chunks
+                response = StreamingHttpResponse(
+                    chunks(file, start, end), status=206, content_type=content_type,
+                )
+                response['Content-Range'] = f'bytes {start}-{end}/{size}'
+                response['Content-Length'] = str(end - start + 1)
+            elif isinstance(request, ASGIRequest):
+                file = field_file.storage.open(field_file.name, 'rb')
+                response = StreamingHttpResponse(
+                    arange_chunks(file, 0, size - 1), content_type=content_type,
+                )
+                response['Content-Length'] = str(size)
+            else:
+                file = field_file.storage.open(field_file.name, 'rb')
+                response = FileResponse(file, content_type=content_type)
+                response['Content-Length'] = str(size)
+        response['Content-Disposition'] = f"inline; filename*=UTF-8''{quote(filename)}"
+        response['Accept-Ranges'] = 'bytes'
+
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Downloads are permission-checked, so shared caches must not keep them.
+    response['Cache-Control'] = 'private, max-age=0, must-revalidate'
+    return response
@@ -38,4 +38,28 @@ class CategoryForm(forms.ModelForm):
         widgets = {
             'name': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Category name'}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 3, 'placeholder': 'Category description'}),
-        }
\ No newline at end of file
+        }
+
+class BookImportForm(forms.Form):
+    FORMAT_CHOICES = (
+        ('', 'Detect from file extension'),
+        ('csv', 'CSV'),
+        ('marc', 'MARC 21'),
+        ('onix', 'ONIX 3.0'),
+    )
+    
+    file = forms.FileField()
+    format = forms.ChoiceField(choices=FORMAT_CHOICES, required=False)
+    update_existing = forms.BooleanField(required=False,
+                                         help_text='Update books whose ISBN is already in the catalogue.')
+    
+    def clean(self):
+        from .importer import guess_format
+        
+        cleaned_data = super().clean()
+        upload = cleaned_data.get('file')
+        if upload and not cleaned_data.get('format'):
+            cleaned_data['format'] = guess_format(upload.name)
+            if not cleaned_data['format']:
+                raise forms.ValidationError("Can't tell the format from the file name; choose one.")
+        return cleaned_data
\ No newline at end of file
@@ -0,0 +1,62 @@
+"""
+Cached HTML fragments for books.
+
+``{% bookfragment 'card' book %}...{% endbookfragment %}`` (from the
+``book_fragments`` tag library) renders its contents once per book and
+serves them from the ``BOOK_FRAGMENT_CACHE`` cache until the book
+changes. Entries are stored under ``book-fragment:<kind>:<pk>`` together
+with the book's ``updated_at``. A hit only counts if that timestamp
+still matches, so a change from another process can never be served
+stale. ``invalidate_books`` deletes the entries outright. It is called
+from the ``Book``/``Category`` signals and after copy counts change, so
+with a shared backend (file or Redis) every process drops them together.
+
+Only per-book content belongs inside the tag. Anything that depends on
+the user (request buttons, the student's own request, CSRF tokens) has
+to stay outside it.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+KINDS = ('card', 'result', 'detail')
+
+
+def fragment_cache():
+    alias = getattr(settings, 'BOOK_FRAGMENT_CACHE', 'fragments')
+    return caches[alias] if alias else None
+
+
+def fragment_key(kind, book_id):
+    return f'book-fragment:{kind}:{book_id}'
+
+
+def fragment_version(book):
+    return book.updated_at.isoformat() if book.updated_at else None
+
+
+def get_fragment(kind, book):
+    cache = fragment_cache()
+    if cache is None or book.pk is None:
+        return None
+    cached = cache.get(fragment_key(kind, book.pk))
+    if cached and cached[0] == fragment_version(book):
+        return cached[1]
+    return None
+
+
+def set_fragment(kind, book, html):
+    cache = fragment_cache()
+    if cache is not None and book.pk is not None:
+        cache.set(fragment_key(kind, book.pk), (fragment_version(book), html))
+
+
+def invalidate_books(book_ids):
+    cache = fragment_cache()
+    if cache is not None:
+        cache.delete_many([fragment_key(kind, book_id) for book_id in book_ids for kind in KINDS])
+
+
+def invalidate_books_on_commit(book_ids):
+    book_ids = list(book_ids)
+    transaction.on_commit(lambda: invalidate_books(book_ids))
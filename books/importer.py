@@ -0,0 +1,370 @@
+"""
+Bulk catalogue import.
+
+Reads CSV, MARC 21 (ISO 2709) or ONIX 3.0 records one at a time and writes
+them in ``bulk_create`` batches. Categories are resolved through an
+in-memory name -> id map and created on demand. Books are matched on ISBN
+against the unique index, and existing ones are either skipped or updated
+in place (upsert). Bad records go to an error report instead of stopping
+the import. After every batch the import records how far it got in a
+checkpoint file, so an interrupted import can pick up where it stopped.
+Used by ``manage.py import_books`` and the book admin's import page.
+"""
+import csv
+import io
+import json
+import os
+import re
+import time
+from datetime import date
+from xml.etree import ElementTree
+
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from accounts.counters import TOTAL_BOOKS, adjust
+from .models import Book, Category
+from .search import get_backend, normalize_isbn
+
+FORMATS = ('csv', 'marc', 'onix')
+
+EXTENSIONS = {
+    '.csv': 'csv',
+    '.mrc': 'marc', '.marc': 'marc',
+    '.xml': 'onix', '.onix': 'onix',
+}
+
+DEFAULT_CATEGORY = 'Uncategorized'
+
+# Descriptive fields refreshed when an existing book is updated. Copy counts
+# are left alone; they track books that are out on loan.
+UPDATE_FIELDS = (
+    'title', 'author', 'category', 'description', 'pages',
+    'publication_date', 'publisher', 'updated_at',
+)
+
+MARC_RECORD_TERMINATOR = b'\x1d'
+
+YEAR_RE = re.compile(r'\d{4}')
+# "xix, 1292 pages", "312 p."
+PAGES_RE = re.compile(r'\d+(?=\s*(?:pages|p\b))')
+
+
+def guess_format(filename):
+    return EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+
+
+# Readers. Each takes a binary stream and yields ``(record_number, raw)``;
+# ``raw`` is turned into a field dict by the matching parser, which may
+# raise ValueError for that record alone. A reader only raises when the
+# rest of the file can't be read (malformed CSV encoding or XML); the
+# import stops there.
+
+def read_csv(stream):
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    for number, row in enumerate(reader, 1):
+        yield number, row
+
+
+def parse_csv_row(row):
+    return {key.strip().lower(): (value or '').strip() for key, value in row.items() if key}
+
+
+def read_marc(stream, chunk_size=64 * 1024):
+    # Records are split on their terminator rather than read by the length
+    # in the leader, so a corrupt length costs that record alone.
+    number = 0
+    pending = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        pending += chunk
+        *records, pending = pending.split(MARC_RECORD_TERMINATOR)
+        if not chunk:
+            records.append(pending)
+        for record in records:
+            record = record.lstrip()
+            if record:
+                number += 1
+                yield number, record + MARC_RECORD_TERMINATOR
+        if not chunk:
+            return
+
+
+def parse_marc_record(data):
+    if not data[:5].isdigit() or int(data[:5]) != len(data):
+        raise ValueError(f'corrupt MARC record length {data[:5]!r}')
+    try:
+        base = int(data[12:17])
+    except ValueError:
+        raise ValueError('corrupt MARC leader')
+    directory = data[24:base - 1]
+    fields = {}
+    for offset in range(0, len(directory) - 11, 12):
+        entry = directory[offset:offset + 12]
+        tag = entry[:3].decode('ascii', 'replace')
+        if tag < '010' or tag in fields:
+            continue
+        length, start = int(entry[3:7]), int(entry[7:12])
+        value = data[base + start:base + start + length].rstrip(b'\x1e').decode('utf-8', 'replace')
+        subfields = {}
+        for chunk in value.split('\x1f')[1:]:
+            if chunk:
+                subfields.setdefault(chunk[0], chunk[1:].strip())
+        fields[tag] = subfields
+
+    def subfield(tag, code):
+        return fields.get(tag, {}).get(code, '')
+
+    def first_match(pattern, text):
+        match = pattern.search(text)
+        return match.group() if match else ''
+
+    title = ' '.join(filter(None, [subfield('245', 'a').rstrip(' /:;'), subfield('245', 'b').rstrip(' /:;')]))
+    return {
+        'isbn': subfield('020', 'a').split(' ')[0],
+        'title': title,
+        'author': (subfield('100', 'a') or subfield('110', 'a')).rstrip(' ,'),
+        'publisher': (subfield('264', 'b') or subfield('260', 'b')).rstrip(' ,;:'),
+        'publication_date': first_match(YEAR_RE, subfield('264', 'c') or subfield('260', 'c')),
+        'pages': first_match(PAGES_RE, subfield('300', 'a')),
+        'description': subfield('520', 'a'),
+        'category': subfield('650', 'a').rstrip(' .'),
+    }
+
+
+def read_onix(stream):
+    number = 0
+    root = None
+    for event, element in ElementTree.iterparse(stream, events=('start', 'end')):
+        if root is None:
+            root = element
+        if event != 'end' or element.tag.rsplit('}', 1)[-1] != 'Product':
+            continue
+        number += 1
+        for child in element.iter():
+            child.tag = child.tag.rsplit('}', 1)[-1]
+        yield number, onix_product(element)
+        # Drop parsed products so memory stays flat.
+        root.clear()
+
+
+def onix_product(product):
+    isbn = ''
+    for identifier in product.iter('ProductIdentifier'):
+        if identifier.findtext('ProductIDType') in ('15', '03'):
+            isbn = identifier.findtext('IDValue', '')
+            break
+    title = ' '.join(filter(None, [
+        product.findtext('.//TitleDetail/TitleElement/TitleText', '').strip(),
+        product.findtext('.//TitleDetail/TitleElement/Subtitle', '').strip(),
+    ]))
+    author = (product.findtext('.//Contributor/PersonName')
+              or product.findtext('.//Contributor/CorporateName') or '')
+    return {
+        'isbn': isbn,
+        'title': title,
+        'author': author,
+        'publisher': product.findtext('.//Publisher/PublisherName', ''),
+        'publication_date': product.findtext('.//PublishingDate/Date', ''),
+        'pages': product.findtext('.//Extent/ExtentValue', ''),
+        'description': product.findtext('.//CollateralDetail/TextContent/Text', ''),
+        'category': product.findtext('.//Subject/SubjectHeadingText', ''),
+    }
+
+
+READERS = {
+    'csv': (read_csv, parse_csv_row),
+    'marc': (read_marc, parse_marc_record),
+    'onix': (read_onix, dict),
+}
+
+
+def parse_publication_date(value):
+    value = value.strip()
+    if re.fullmatch(r'\d{8}', value):
+        value = f'{value[:4]}-{value[4:6]}-{value[6:]}'
+    elif re.fullmatch(r'\d{4}', value):
+        return date(int(value), 1, 1)
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError(f'invalid publication date {value!r}')
+    return parsed
+
+
+def parse_count(value, name, default, minimum):
+    if not value:
+        return default
+    try:
+        count = int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be a whole number')
+    if count < minimum:
+        raise ValueError(f'{name} must be at least {minimum}')
+    return count
+
+
+def clean_record(fields):
+    """Validate a field dict into keyword arguments for ``Book``. Raises ValueError."""
+    isbn = normalize_isbn(fields.get('isbn', ''))
+    if not isbn:
+        raise ValueError(f"invalid ISBN {fields.get('isbn', '')!r}")
+    cleaned = {
+        'isbn': isbn,
+        'title': fields.get('title', '').strip(),
+        'author': fields.get('author', '').strip(),
+        'publisher': fields.get('publisher', '').strip(),
+        'description': fields.get('description', '').strip(),
+        'category': fields.get('category', '').strip() or DEFAULT_CATEGORY,
+        'pages': parse_count(fields.get('pages', ''), 'pages', 0, 0),
+        'total_copies': parse_count(fields.get('total_copies', ''), 'total_copies', 1, 1),
+    }
+    for name in ('title', 'author'):
+        if not cleaned[name]:
+            raise ValueError(f'{name} is required')
+    for name in ('title', 'author', 'publisher'):
+        max_length = Book._meta.get_field(name).max_length
+        if len(cleaned[name]) > max_length:
+            raise ValueError(f'{name} is longer than {max_length} characters')
+    if len(cleaned['category']) > Category._meta.get_field('name').max_length:
+        raise ValueError('category name is too long')
+    if not fields.get('publication_date', '').strip():
+        raise ValueError('publication_date is required')
+    cleaned['publication_date'] = parse_publication_date(fields['publication_date'])
+    return cleaned
+
+
+class BookImporter:
+    """
+    Import books from a binary stream. ``errors`` is an optional text
+    stream that receives a CSV row per rejected record; ``checkpoint`` an
+    optional path used to resume an interrupted import of the same source;
+    ``progress`` is called with the running stats after every batch.
+    """
+
+    def __init__(self, added_by, batch_size=1000, update_existing=False,
+                 errors=None, checkpoint=None, progress=None):
+        self.added_by = added_by
+        self.batch_size = batch_size
+        self.update_existing = update_existing
+        self.errors = csv.writer(errors) if errors is not None else None
+        self.checkpoint = checkpoint
+        self.progress = progress
+        self.categories = dict(Category.objects.values_list('name', 'pk'))
+        self.stats = dict.fromkeys(
+            ('records', 'created', 'updated', 'skipped', 'duplicates', 'errors'), 0,
+        )
+
+    def run(self, stream, format, source=None):
+        reader, parse = READERS[format]
+        resume_after = self.load_checkpoint(source)
+        self.resumed_records = self.stats['records']
+        if self.errors is not None and not resume_after:
+            self.errors.writerow(['record', 'isbn', 'error'])
+        started = time.monotonic()
+        batch = {}
+        last = resume_after
+
+        for number, raw in reader(stream):
+            if number <= resume_after:
+                continue
+            last = number
+            self.stats['records'] += 1
+            try:
+                book = clean_record(parse(raw))
+            except (ValueError, KeyError, TypeError) as error:
+                self.reject(number, raw, error)
+            else:
+                if book['isbn'] in batch:
+                    self.stats['duplicates'] += 1
+                    if not self.update_existing:
+                        continue
+                # When updating, the last record for an ISBN wins, as it would across batches.
+                batch[book['isbn']] = book
+            if len(batch) >= self.batch_size:
+                self.flush(batch, last, source, started)
+                batch = {}
+
+        self.flush(batch, last, source, started)
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        return self.stats
+
+    def reject(self, number, raw, error):
+        self.stats['errors'] += 1
+        if self.errors is not None:
+            isbn = raw.get('isbn', '') if isinstance(raw, dict) else ''
+            self.errors.writerow([number, isbn, str(error)])
+
+    def resolve_categories(self, names):
+        missing = {name for name in names if name not in self.categories}
+        if missing:
+            Category.objects.bulk_create([Category(name=name) for name in missing], ignore_conflicts=True)
+            self.categories.update(Category.objects.filter(name__in=missing).values_list('name', 'pk'))
+
+    def flush(self, batch, last, source, started):
+        if batch:
+            with transaction.atomic():
+                self.write_batch(batch)
+        self.save_checkpoint(last, source)
+        elapsed = time.monotonic() - started
+        self.stats['elapsed'] = elapsed
+        read = self.stats['records'] - self.resumed_records
+        self.stats['rate'] = read / elapsed if elapsed else 0.0
+        if self.progress:
+            self.progress(self.stats)
+
+    def write_batch(self, batch):
+        self.resolve_categories({book['category'] for book in batch.values()})
+        existing = set(Book.objects.filter(isbn__in=batch).values_list('isbn', flat=True))
+        rows = batch.values() if self.update_existing else [
+            book for isbn, book in batch.items() if isbn not in existing
+        ]
+        books = [
+            Book(
+                added_by=self.added_by,
+                category_id=self.categories[book['category']],
+                available_copies=book['total_copies'],
+                **{key: value for key, value in book.items() if key != 'category'},
+            )
+            for book in rows
+        ]
+        if self.update_existing:
+            Book.objects.bulk_create(books, update_conflicts=True, unique_fields=['isbn'],
+                                     update_fields=UPDATE_FIELDS)
+            self.stats['updated'] += len(existing)
+        else:
+            Book.objects.bulk_create(books, ignore_conflicts=True)
+            self.stats['skipped'] += len(existing)
+        self.stats['created'] += len(batch) - len(existing)
+        # bulk_create skips the signal that keeps the catalogue size counter current.
+        adjust({TOTAL_BOOKS: len(batch) - len(existing)})
+
+        # bulk_create skips the post_save signal that keeps the search index current.
+        book_ids = list(Book.objects.filter(isbn__in=[book.isbn for book in books]).values_list('pk', flat=True))
+        backend = get_backend()
+        for start in range(0, len(book_ids), 500):
+            backend.index_books(book_ids[start:start + 500])
+
+    def load_checkpoint(self, source):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return 0
+        with open(self.checkpoint, encoding='utf-8') as checkpoint:
+            state = json.load(checkpoint)
+        if state.get('source') != source:
+            return 0
+        self.stats.update(state['stats'])
+        return state['record']
+
+    def save_checkpoint(self, record, source):
+        if not self.checkpoint:
+            return
+        state = {'source': source, 'record': record, 'stats': {
+            key: value for key, value in self.stats.items() if key not in ('elapsed', 'rate')
+        }}
+        temporary = f'{self.checkpoint}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as checkpoint:
+            json.dump(state, checkpoint)
+        os.replace(temporary, self.checkpoint)
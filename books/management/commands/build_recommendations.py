@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from books.recommendations import build_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Update the "borrowed together" lists from issue transactions since the last run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Transactions read per fetch (default: 10000).')
+        parser.add_argument('--full', action='store_true',
+                            help='Ignore the checkpoint and rebuild every list.')
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+
+        def progress(stats):
+            if verbosity > 1:
+                self.stdout.write(
+                    f"  {stats['transactions']} transactions read, "
+                    f"{stats['recommendations']} recommendations written"
+                )
+
+        stats = build_recommendations(
+            batch_size=options['batch_size'], full=options['full'], progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {stats['transactions']} transactions in {stats['elapsed']:.2f}s: "
+            f"{stats['recommendations']} recommendations for {stats['books']} books."
+        ))
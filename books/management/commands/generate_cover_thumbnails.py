@@ -0,0 +1,54 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from books.covers import backfill_cover, init_backfill_worker
+from books.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Generate cover thumbnails for books that have a cover but no thumbnails yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes (default: one per CPU core).')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate thumbnails for every book with a cover.')
+
+    def handle(self, *args, **options):
+        books = Book.objects.exclude(cover_image='').exclude(cover_image__isnull=True)
+        if not options['force']:
+            books = books.filter(cover_thumbnails={})
+        book_ids = list(books.order_by('pk').values_list('pk', flat=True))
+        work = partial(backfill_cover, force=options['force'])
+        workers = max(1, min(options['workers'], len(book_ids)))
+        started = time.monotonic()
+
+        if workers == 1:
+            results = map(work, book_ids)
+        else:
+            # Each worker opens its own database connection; don't share ours.
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=init_backfill_worker)
+            results = pool.map(work, book_ids, chunksize=max(1, len(book_ids) // (workers * 8)))
+
+        updated = failed = 0
+        try:
+            for book_id, done, error in results:
+                if error:
+                    failed += 1
+                    self.stderr.write(f'Book {book_id}: {error}')
+                elif done:
+                    updated += 1
+        finally:
+            if workers > 1:
+                pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated thumbnails for {updated} of {len(book_ids)} covers in '
+            f'{time.monotonic() - started:.2f}s using {workers} worker(s); {failed} failed.'
+        ))
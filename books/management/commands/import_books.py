@@ -0,0 +1,75 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import User
+from books.importer import FORMATS, BookImporter, guess_format
+
+
+class Command(BaseCommand):
+    help = 'Import books from a CSV, MARC 21 or ONIX 3.0 file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import.')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Input format (default: guessed from the file extension).')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Books written per bulk insert (default: 1000).')
+        parser.add_argument('--update', action='store_true',
+                            help='Update books whose ISBN already exists instead of skipping them.')
+        parser.add_argument('--added-by', help='Username of the admin recorded as adding the books '
+                                               '(default: the first admin account).')
+        parser.add_argument('--errors', help='Where to write rejected records (default: PATH.errors.csv).')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore any checkpoint left by an interrupted import of PATH.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or guess_format(path)
+        if format is None:
+            raise CommandError(f"Can't tell the format of {path}; pass --format.")
+
+        admins = User.objects.filter(user_type='admin').order_by('pk')
+        if options['added_by']:
+            admins = admins.filter(username=options['added_by'])
+        added_by = admins.first()
+        if added_by is None:
+            raise CommandError('No matching admin account to record as adding the books.')
+
+        checkpoint = f'{path}.checkpoint.json'
+        if options['restart'] and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        resuming = os.path.exists(checkpoint)
+        errors_path = options['errors'] or f'{path}.errors.csv'
+
+        def progress(stats):
+            self.stdout.write(
+                f"  {stats['records']} records, {stats['created']} created, {stats['updated']} updated, "
+                f"{stats['errors']} errors ({stats['rate']:.0f} records/s)"
+            )
+
+        with open(path, 'rb') as stream, \
+                open(errors_path, 'a' if resuming else 'w', newline='', encoding='utf-8') as errors:
+            importer = BookImporter(
+                added_by, batch_size=options['batch_size'], update_existing=options['update'],
+                errors=errors, checkpoint=checkpoint,
+                progress=progress if options['verbosity'] > 1 else None,
+            )
+            try:
+                stats = importer.run(stream, format, source=os.path.abspath(path))
+            except (ValueError, SyntaxError) as error:
+                # The file itself is unreadable from here on; resuming would stop at the same place.
+                raise CommandError(
+                    f"The file could not be read after record {importer.stats['records']}: {error}. "
+                    'Books from the completed batches were saved; fix the file and re-run.'
+                )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['records']} records in {stats['elapsed']:.2f}s "
+            f"({stats['rate']:.0f} records/s): {stats['created']} created, {stats['updated']} updated, "
+            f"{stats['skipped']} skipped as existing, {stats['duplicates']} duplicate ISBNs in the file."
+        ))
+        if stats['errors']:
+            self.stdout.write(self.style.WARNING(f"{stats['errors']} records rejected; see {errors_path}."))
+        elif not resuming:
+            os.remove(errors_path)
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from books.seeding import LibrarySeeder
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with synthetic students, books, loans and fines for load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=2000)
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--requests', type=int, default=50000,
+                            help='Book requests to generate; transactions and fines follow from them.')
+        parser.add_argument('--days', type=int, default=365,
+                            help='Spread activity over this many past days (default: 365).')
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Zipf exponent for book popularity; 0 is uniform (default: 1.1).')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Rows written per statement (default: 5000).')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42).')
+        parser.add_argument('--skip-search-index', action='store_true',
+                            help="Don't rebuild the search index afterwards.")
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+
+        def progress(message):
+            if verbosity > 1:
+                self.stdout.write(message)
+
+        stats = LibrarySeeder(
+            students=options['students'], books=options['books'], requests=options['requests'],
+            days=options['days'], skew=options['skew'], batch_size=options['batch_size'],
+            seed=options['seed'], progress=progress,
+        ).run(index=not options['skip_search_index'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {stats['students']} students, {stats['books']} books, {stats['requests']} "
+            f"requests, {stats['transactions']} transactions and {stats['fines']} fines "
+            f"in {stats['elapsed']:.2f}s."
+        ))
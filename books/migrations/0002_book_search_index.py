@@ -0,0 +1,55 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE books_book_fts USING fts5("
+            "title, author, isbn, category, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+        schema_editor.execute(
+            "INSERT INTO books_book_fts (rowid, title, author, isbn, category) "
+            "SELECT b.id, b.title, b.author, b.isbn, c.name "
+            "FROM books_book b JOIN books_category c ON c.id = b.category_id"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE TABLE books_book_search ("
+            "book_id bigint PRIMARY KEY REFERENCES books_book (id) "
+            "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            "CREATE INDEX books_book_search_document_gin "
+            "ON books_book_search USING GIN (document)"
+        )
+        schema_editor.execute(
+            "INSERT INTO books_book_search (book_id, document) "
+            "SELECT b.id, "
+            "setweight(to_tsvector('simple', b.title), 'A') || "
+            "setweight(to_tsvector('simple', b.author), 'B') || "
+            "setweight(to_tsvector('simple', c.name), 'C') || "
+            "setweight(to_tsvector('simple', b.isbn), 'D') "
+            "FROM books_book b JOIN books_category c ON c.id = b.category_id"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS books_book_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS books_book_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_loan_due_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticket', models.PositiveBigIntegerField()),
+                ('status', models.CharField(choices=[('waiting', 'Waiting'), ('fulfilled', 'Fulfilled'), ('cancelled', 'Cancelled')], default='waiting', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('fulfilled_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['queue', 'ticket'],
+            },
+        ),
+        migrations.CreateModel(
+            name='HoldQueue',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='hold_queue', serialize=False, to='books.book')),
+                ('head', models.PositiveBigIntegerField(default=1)),
+                ('tail', models.PositiveBigIntegerField(default=1)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-created_at'], name='book_recent_idx'),
+        ),
+        migrations.AddField(
+            model_name='bookhold',
+            name='loan',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='hold', to='books.bookrequest'),
+        ),
+        migrations.AddField(
+            model_name='bookhold',
+            name='student',
+            field=models.ForeignKey(limit_choices_to={'user_type': 'student'}, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='bookhold',
+            name='queue',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='books.holdqueue'),
+        ),
+        migrations.AddIndex(
+            model_name='bookhold',
+            index=models.Index(condition=models.Q(('status', 'waiting')), fields=['queue', 'ticket'], name='bookhold_waiting_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookhold',
+            index=models.Index(fields=['student', 'status'], name='bookhold_student_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookhold',
+            constraint=models.UniqueConstraint(fields=('queue', 'ticket'), name='bookhold_queue_ticket_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookhold',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'waiting')), fields=('queue', 'student'), name='bookhold_one_waiting_per_student'),
+        ),
+    ]
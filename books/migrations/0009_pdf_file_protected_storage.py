@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:06
+
+import books.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0008_book_recommendations'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='pdf_file',
+            field=models.FileField(blank=True, null=True, storage=books.storage.ProtectedStorage(), upload_to='book_pdfs/'),
+        ),
+    ]
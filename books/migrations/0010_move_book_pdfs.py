@@ -0,0 +1,35 @@
+import os
+import shutil
+
+from django.conf import settings
+from django.db import migrations
+
+
+def move_pdfs(apps, source, target):
+    # Only files the catalogue points at; anything else in the directory is left alone.
+    Book = apps.get_model('books', 'Book')
+    names = Book.objects.exclude(pdf_file='').exclude(pdf_file__isnull=True).values_list('pdf_file', flat=True)
+    for name in names.iterator():
+        old, new = os.path.join(source, name), os.path.join(target, name)
+        if os.path.isfile(old) and not os.path.exists(new):
+            os.makedirs(os.path.dirname(new), exist_ok=True)
+            shutil.move(old, new)
+
+
+def protect_pdfs(apps, schema_editor):
+    move_pdfs(apps, settings.MEDIA_ROOT, settings.PROTECTED_MEDIA_ROOT)
+
+
+def expose_pdfs(apps, schema_editor):
+    move_pdfs(apps, settings.PROTECTED_MEDIA_ROOT, settings.MEDIA_ROOT)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_pdf_file_protected_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(protect_pdfs, expose_pdfs, elidable=True),
+    ]
@@ -1,5 +1,10 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from datetime import timedelta
+
+from .storage import protected_storage
 
 User = get_user_model()
 
@@ -14,6 +19,31 @@ class Category(models.Model):
     class Meta:
         verbose_name_plural = "Categories"
 
+class BookManager(models.Manager):
+    
+    def reserve_copies(self, book_id, wanted, available=None, now=None):
+        """
+        Take up to ``wanted`` copies of a book out of stock with one
+        conditional UPDATE. ``available`` is the caller's last known stock
+        level, if any. Returns the number of copies actually taken.
+        """
+        from .fragments import invalidate_books_on_commit
+        
+        now = now or timezone.now()
+        while True:
+            if available is None:
+                available = self.filter(pk=book_id).values_list('available_copies', flat=True).first()
+            granted = min(max(available or 0, 0), wanted)
+            if not granted:
+                return 0
+            if self.filter(pk=book_id, available_copies__gte=granted).update(
+                available_copies=F('available_copies') - granted, updated_at=now,
+            ):
+                invalidate_books_on_commit([book_id])
+                return granted
+            # Stock changed under us; re-read it and try again.
+            available = None
+
 class Book(models.Model):
     title = models.CharField(max_length=200)
     author = models.CharField(max_length=200)
@@ -24,13 +54,18 @@ class Book(models.Model):
     publication_date = models.DateField()
     publisher = models.CharField(max_length=200)
     cover_image = models.ImageField(upload_to='book_covers/', blank=True, null=True)
-    pdf_file = models.FileField(upload_to='book_pdfs/', blank=True, null=True)
+    # {format: {width: path}} of the generated derivatives; see books.covers.
+    cover_thumbnails = models.JSONField(default=dict, blank=True, editable=False)
+    # Not under MEDIA_ROOT: PDFs are only served by BookPDFView.
+    pdf_file = models.FileField(upload_to='book_pdfs/', storage=protected_storage, blank=True, null=True)
     total_copies = models.IntegerField(default=1)
     available_copies = models.IntegerField(default=1)
     added_by = models.ForeignKey(User, on_delete=models.CASCADE, limit_choices_to={'user_type': 'admin'})
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = BookManager()
+    
     def __str__(self):
         return f"{self.title} by {self.author}"
     
@@ -38,12 +73,33 @@ class Book(models.Model):
     def is_available(self):
         return self.available_copies > 0
     
+    @property
+    def cover_sources(self):
+        """``(mime type, srcset)`` pairs for the cover thumbnails, best format first."""
+        from django.core.files.storage import default_storage
+        
+        return [
+            (f'image/{extension}', ', '.join(
+                f'{default_storage.url(path)} {width}w' for width, path in paths.items()
+            ))
+            for extension, paths in self.cover_thumbnails.items()
+        ]
+    
     def get_absolute_url(self):
         from django.urls import reverse
         return reverse('books:detail', kwargs={'pk': self.pk})
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Catalogue listing: available books, newest first.
+            models.Index(fields=['-created_at'], condition=models.Q(available_copies__gt=0),
+                         name='book_available_recent_idx'),
+            # Full catalogue listing, including checked-out books.
+            models.Index(fields=['-created_at'], name='book_recent_idx'),
+            # MAX(updated_at) for the catalogue's ETag/Last-Modified.
+            models.Index(fields=['-updated_at'], name='book_updated_idx'),
+        ]
 
 class BookRequest(models.Model):
     STATUS_CHOICES = (
@@ -64,9 +120,516 @@ class BookRequest(models.Model):
     return_date = models.DateTimeField(null=True, blank=True)
     notes = models.TextField(blank=True, null=True)
     
+    LOAN_PERIOD = timedelta(days=14)
+    
     def __str__(self):
         return f"{self.student.full_name} - {self.book.title} ({self.status})"
     
+    def approve(self, approved_by):
+        """
+        Issue a copy of the book for this request.
+        
+        The request is claimed and the copy counter decremented with
+        conditional UPDATEs inside one transaction, so concurrent approvals
+        can neither approve the same request twice nor oversell copies.
+        Returns 'approved', 'insufficient_copies' or 'already_processed'.
+        """
+        from accounts.counters import record_request_status_changes
+        from transactions.models import Transaction
+        from .fragments import invalidate_books_on_commit
+        
+        now = timezone.now()
+        due_date = now + self.LOAN_PERIOD
+        with transaction.atomic():
+            claimed = BookRequest.objects.filter(pk=self.pk, status='pending').update(
+                status='approved', approved_by=approved_by,
+                approval_date=now, due_date=due_date,
+            )
+            if not claimed:
+                return 'already_processed'
+            
+            issued = Book.objects.filter(pk=self.book_id, available_copies__gt=0).update(
+                available_copies=F('available_copies') - 1, updated_at=now,
+            )
+            if not issued:
+                transaction.set_rollback(True)
+                return 'insufficient_copies'
+            invalidate_books_on_commit([self.book_id])
+            
+            Transaction.objects.create(
+                student_id=self.student_id,
+                book_id=self.book_id,
+                loan_id=self.pk,
+                transaction_type='issue',
+                due_date=due_date,
+                processed_by=approved_by,
+            )
+            record_request_status_changes([(self.student_id, 'pending', 'approved')])
+        
+        # Counted above, so a later save() must not count it again.
+        self.status = self._counted_status = 'approved'
+        self.approved_by = approved_by
+        self.approval_date = now
+        self.due_date = due_date
+        return 'approved'
+    
+    def reject(self, rejected_by):
+        """Reject a pending request. Returns False if it was already processed."""
+        from accounts.counters import record_request_status_changes
+        
+        now = timezone.now()
+        with transaction.atomic():
+            rejected = BookRequest.objects.filter(pk=self.pk, status='pending').update(
+                status='rejected', approved_by=rejected_by, approval_date=now,
+            )
+            if rejected:
+                record_request_status_changes([(self.student_id, 'pending', 'rejected')])
+        if rejected:
+            self.status = self._counted_status = 'rejected'
+            self.approved_by = rejected_by
+            self.approval_date = now
+        return bool(rejected)
+    
+    @classmethod
+    def bulk_approve(cls, request_ids, approved_by):
+        """
+        Approve many requests in one transaction.
+        
+        Copies are handed out per book in request order, with a single
+        conditional decrement per book. Returns a dict mapping each request
+        id to 'approved', 'insufficient_copies', 'already_processed' or
+        'not_found'.
+        """
+        from accounts.counters import record_request_status_changes
+        from transactions.models import Transaction
+        
+        request_ids = list(dict.fromkeys(int(pk) for pk in request_ids))
+        outcomes = dict.fromkeys(request_ids, 'not_found')
+        now = timezone.now()
+        due_date = now + cls.LOAN_PERIOD
+        
+        with transaction.atomic():
+            requests = list(
+                cls.objects.select_for_update()
+                .filter(pk__in=request_ids)
+                .only('pk', 'status', 'student_id', 'book_id')
+                .order_by('request_date', 'pk')
+            )
+            
+            pending_by_book = {}
+            for book_request in requests:
+                if book_request.status == 'pending':
+                    pending_by_book.setdefault(book_request.book_id, []).append(book_request)
+                else:
+                    outcomes[book_request.pk] = 'already_processed'
+            
+            stock = dict(
+                Book.objects.filter(pk__in=pending_by_book)
+                .order_by()
+                .values_list('pk', 'available_copies')
+            )
+            approved = []
+            for book_id, book_requests in pending_by_book.items():
+                granted = Book.objects.reserve_copies(
+                    book_id, len(book_requests), available=stock.get(book_id), now=now,
+                )
+                approved.extend(book_requests[:granted])
+                for book_request in book_requests[granted:]:
+                    outcomes[book_request.pk] = 'insufficient_copies'
+            
+            for book_request in approved:
+                book_request.status = 'approved'
+                book_request.approved_by = approved_by
+                book_request.approval_date = now
+                book_request.due_date = due_date
+                outcomes[book_request.pk] = 'approved'
+            cls.objects.bulk_update(
+                approved, ['status', 'approved_by', 'approval_date', 'due_date'], batch_size=500,
+            )
+            Transaction.objects.bulk_create([
+                Transaction(
+                    student_id=book_request.student_id,
+                    book_id=book_request.book_id,
+                    loan_id=book_request.pk,
+                    transaction_type='issue',
+                    due_date=due_date,
+                    processed_by=approved_by,
+                )
+                for book_request in approved
+            ], batch_size=500)
+            record_request_status_changes(
+                (book_request.student_id, 'pending', 'approved') for book_request in approved
+            )
+        
+        return outcomes
+    
+    @classmethod
+    def bulk_reject(cls, request_ids, rejected_by):
+        """
+        Reject many requests in one transaction. Returns a dict mapping each
+        request id to 'rejected', 'already_processed' or 'not_found'.
+        """
+        from accounts.counters import record_request_status_changes
+        
+        request_ids = list(dict.fromkeys(int(pk) for pk in request_ids))
+        outcomes = dict.fromkeys(request_ids, 'not_found')
+        now = timezone.now()
+        
+        with transaction.atomic():
+            requests = list(
+                cls.objects.select_for_update()
+                .filter(pk__in=request_ids)
+                .only('pk', 'status', 'student_id')
+            )
+            rejected = []
+            for book_request in requests:
+                if book_request.status == 'pending':
+                    book_request.status = 'rejected'
+                    book_request.approved_by = rejected_by
+                    book_request.approval_date = now
+                    rejected.append(book_request)
+                    outcomes[book_request.pk] = 'rejected'
+                else:
+                    outcomes[book_request.pk] = 'already_processed'
+            cls.objects.bulk_update(
+                rejected, ['status', 'approved_by', 'approval_date'], batch_size=500,
+            )
+            record_request_status_changes(
+                (book_request.student_id, 'pending', 'rejected') for book_request in rejected
+            )
+        
+        return outcomes
+    
+    @classmethod
+    def bulk_request(cls, book_ids, student):
+        """
+        Request many books for one student. Checked-out books put the
+        student on their waitlist instead. Returns a dict mapping each book
+        id to 'requested', 'waitlisted', 'already_requested',
+        'already_waitlisted' or 'not_found'.
+        """
+        from accounts.counters import record_request_status_changes
+        
+        book_ids = list(dict.fromkeys(int(pk) for pk in book_ids))
+        outcomes = dict.fromkeys(book_ids, 'not_found')
+        
+        with transaction.atomic():
+            books = Book.objects.only('pk', 'available_copies').in_bulk(book_ids)
+            open_requests = set(
+                cls.objects.filter(student=student, book_id__in=books, status__in=['pending', 'approved'])
+                .values_list('book_id', flat=True)
+            )
+            requested = []
+            for book_id, book in books.items():
+                if book_id in open_requests:
+                    outcomes[book_id] = 'already_requested'
+                elif not book.is_available:
+                    _, created = BookHold.objects.place(book, student)
+                    outcomes[book_id] = 'waitlisted' if created else 'already_waitlisted'
+                else:
+                    requested.append(cls(student=student, book_id=book_id))
+                    outcomes[book_id] = 'requested'
+            try:
+                with transaction.atomic():
+                    cls.objects.bulk_create(requested, batch_size=500)
+            except IntegrityError:
+                # Another request for one of the books got in after the check;
+                # file the rest one at a time.
+                filed = []
+                for book_request in requested:
+                    try:
+                        with transaction.atomic():
+                            cls.objects.bulk_create([book_request])
+                    except IntegrityError:
+                        outcomes[book_request.book_id] = 'already_requested'
+                    else:
+                        filed.append(book_request)
+                requested = filed
+            BookHold.objects.withdraw([book_request.book_id for book_request in requested], student)
+            # bulk_create skips the post_save signal that counts new requests.
+            record_request_status_changes((student.pk, None, 'pending') for _ in requested)
+        
+        return outcomes
+    
+    @classmethod
+    def bulk_return(cls, request_ids, student):
+        """
+        Return many of a student's loans. Returns a dict mapping each
+        request id to 'returned', 'already_returned' or 'not_found'.
+        """
+        request_ids = list(dict.fromkeys(int(pk) for pk in request_ids))
+        outcomes = dict.fromkeys(request_ids, 'not_found')
+        loans = cls.objects.filter(pk__in=request_ids, student=student, status__in=['approved', 'returned'])
+        for loan in loans.only('pk', 'status', 'student_id', 'book_id'):
+            if loan.status == 'approved' and loan.mark_returned(processed_by=student):
+                outcomes[loan.pk] = 'returned'
+            else:
+                outcomes[loan.pk] = 'already_returned'
+        return outcomes
+    
+    def mark_returned(self, processed_by):
+        """
+        Return the borrowed copy, either to the next student on the book's
+        waitlist or to stock. Returns False if the loan had already been
+        returned.
+        """
+        from accounts.counters import record_request_status_changes
+        from transactions.models import Transaction
+        from .fragments import invalidate_books_on_commit
+        
+        now = timezone.now()
+        with transaction.atomic():
+            claimed = BookRequest.objects.filter(pk=self.pk, status='approved').update(
+                status='returned', return_date=now,
+            )
+            if not claimed:
+                return False
+            
+            Transaction.objects.create(
+                student_id=self.student_id,
+                book_id=self.book_id,
+                loan_id=self.pk,
+                transaction_type='return',
+                return_date=now,
+                processed_by=processed_by,
+            )
+            record_request_status_changes([(self.student_id, 'approved', 'returned')])
+            
+            # The copy goes to the head of the waitlist, if anyone is waiting.
+            if BookHold.objects.fulfil_next(self.book_id, processed_by, now) is None:
+                Book.objects.filter(pk=self.book_id).update(
+                    available_copies=F('available_copies') + 1, updated_at=now,
+                )
+                invalidate_books_on_commit([self.book_id])
+        
+        self.status = self._counted_status = 'returned'
+        self.return_date = now
+        return True
+    
     class Meta:
         ordering = ['-request_date']
-        unique_together = ['student', 'book', 'status']
\ No newline at end of file
+        unique_together = ['student', 'book', 'status']
+        # (student, book, status) lookups are already served by unique_together.
+        indexes = [
+            # Admin queue: pending requests, newest first.
+            models.Index(fields=['-request_date'], condition=models.Q(status='pending'),
+                         name='bookrequest_pending_idx'),
+            # Student dashboard counters.
+            models.Index(fields=['student', 'status'], name='bookrequest_student_status_idx'),
+            # "My requests", newest first.
+            models.Index(fields=['student', '-request_date'], name='bookrequest_student_date_idx'),
+            # Fine assessment: active loans by due date, late returns by return date.
+            models.Index(fields=['due_date'], condition=models.Q(status='approved'),
+                         name='bookrequest_active_due_idx'),
+            models.Index(fields=['return_date'], condition=models.Q(status='returned'),
+                         name='bookrequest_returned_idx'),
+        ]
+
+class HoldQueue(models.Model):
+    """
+    The waitlist for one book. Holds are numbered with tickets taken from
+    ``tail``; ``head`` is the lowest ticket that may still be waiting, so a
+    student's place in line is ``ticket - head + 1`` with no counting.
+    """
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True,
+                                related_name='hold_queue')
+    head = models.PositiveBigIntegerField(default=1)
+    tail = models.PositiveBigIntegerField(default=1)
+    
+    def __str__(self):
+        return f"Waitlist for {self.book}"
+
+class BookHoldManager(models.Manager):
+    
+    def place(self, book, student):
+        """
+        Put ``student`` at the back of the book's waitlist. Returns
+        ``(hold, created)``; a student already waiting keeps their place.
+        """
+        existing = self.filter(queue_id=book.pk, student=student, status='waiting').first()
+        if existing:
+            return existing, False
+        HoldQueue.objects.get_or_create(book=book)
+        try:
+            with transaction.atomic():
+                # Taking the ticket locks the queue row until the hold is saved.
+                HoldQueue.objects.filter(pk=book.pk).update(tail=F('tail') + 1)
+                ticket = HoldQueue.objects.filter(pk=book.pk).values_list('tail', flat=True).get() - 1
+                return self.create(queue_id=book.pk, student=student, ticket=ticket), True
+        except IntegrityError:
+            return self.get(queue_id=book.pk, student=student, status='waiting'), False
+    
+    def withdraw(self, book_ids, student):
+        """Take ``student`` off the waitlists of ``book_ids``, e.g. once they file a request."""
+        return self.filter(queue_id__in=book_ids, student=student, status='waiting').update(status='cancelled')
+    
+    def fulfil_next(self, book_id, processed_by, now=None):
+        """
+        Issue a returned copy of the book to the first student still waiting.
+        Must run inside the transaction that returned the copy. Returns the
+        fulfilled hold, or ``None`` if nobody is waiting.
+        """
+        from transactions.models import Transaction
+        
+        now = now or timezone.now()
+        queue = HoldQueue.objects.select_for_update().filter(pk=book_id).first()
+        if queue is None or queue.head >= queue.tail:
+            return None
+        
+        waiting = self.filter(queue=queue, status='waiting').order_by('ticket')
+        while True:
+            # Cancelled holds are skipped here rather than compacted on cancel.
+            hold = waiting.filter(ticket__gte=queue.head).first()
+            if hold is None:
+                break
+            queue.head = hold.ticket + 1
+            if BookRequest.objects.filter(student_id=hold.student_id, book_id=book_id,
+                                          status__in=['pending', 'approved']).exists():
+                # The student requested the book directly or already has it out;
+                # a second loan would clash with that request when it is approved.
+                hold.status = 'cancelled'
+                hold.save(update_fields=['status'])
+                continue
+            try:
+                with transaction.atomic():
+                    loan = BookRequest.objects.create(
+                        student_id=hold.student_id, book_id=book_id, status='approved',
+                        approval_date=now, due_date=now + BookRequest.LOAN_PERIOD,
+                        notes='Issued from the waitlist.',
+                    )
+            except IntegrityError:
+                # The student already has this book out; they no longer need the hold.
+                hold.status = 'cancelled'
+                hold.save(update_fields=['status'])
+                continue
+            Transaction.objects.create(
+                student_id=hold.student_id,
+                book_id=book_id,
+                loan_id=loan.pk,
+                transaction_type='issue',
+                due_date=loan.due_date,
+                processed_by=processed_by,
+            )
+            hold.status = 'fulfilled'
+            hold.loan = loan
+            hold.fulfilled_at = now
+            hold.save(update_fields=['status', 'loan', 'fulfilled_at'])
+            queue.save(update_fields=['head'])
+            return hold
+        
+        queue.head = queue.tail
+        queue.save(update_fields=['head'])
+        return None
+    
+    def fulfil_available(self, book_id, processed_by, now=None):
+        """
+        Issue copies in stock to the students waiting for the book, for when
+        copies are added other than by a return. Returns the fulfilled holds.
+        """
+        from .fragments import invalidate_books_on_commit
+        
+        now = now or timezone.now()
+        if not HoldQueue.objects.filter(pk=book_id, head__lt=F('tail')).exists():
+            return []
+        fulfilled = []
+        with transaction.atomic():
+            while Book.objects.reserve_copies(book_id, 1, now=now):
+                hold = self.fulfil_next(book_id, processed_by, now)
+                if hold is None:
+                    # Nobody left waiting; the copy goes back to stock.
+                    Book.objects.filter(pk=book_id).update(
+                        available_copies=F('available_copies') + 1, updated_at=now,
+                    )
+                    invalidate_books_on_commit([book_id])
+                    break
+                fulfilled.append(hold)
+        return fulfilled
+
+class BookHold(models.Model):
+    STATUS_CHOICES = (
+        ('waiting', 'Waiting'),
+        ('fulfilled', 'Fulfilled'),
+        ('cancelled', 'Cancelled'),
+    )
+    
+    queue = models.ForeignKey(HoldQueue, on_delete=models.CASCADE, related_name='holds')
+    student = models.ForeignKey(User, on_delete=models.CASCADE, limit_choices_to={'user_type': 'student'})
+    ticket = models.PositiveBigIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='waiting')
+    created_at = models.DateTimeField(auto_now_add=True)
+    fulfilled_at = models.DateTimeField(null=True, blank=True)
+    loan = models.OneToOneField(BookRequest, on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name='hold')
+    
+    objects = BookHoldManager()
+    
+    def __str__(self):
+        return f"{self.student} waiting for {self.queue.book} (#{self.ticket})"
+    
+    @property
+    def position(self):
+        """
+        Place in line, 1 being next. Holds cancelled further up the line are
+        only skipped once they reach the front, so this may overstate it.
+        """
+        return max(self.ticket - self.queue.head + 1, 1)
+    
+    def cancel(self):
+        """Leave the waitlist. Returns False if the hold was no longer waiting."""
+        cancelled = BookHold.objects.filter(pk=self.pk, status='waiting').update(status='cancelled')
+        if cancelled:
+            self.status = 'cancelled'
+        return bool(cancelled)
+    
+    class Meta:
+        ordering = ['queue', 'ticket']
+        constraints = [
+            models.UniqueConstraint(fields=['queue', 'ticket'], name='bookhold_queue_ticket_uniq'),
+            models.UniqueConstraint(fields=['queue', 'student'], condition=models.Q(status='waiting'),
+                                    name='bookhold_one_waiting_per_student'),
+        ]
+        indexes = [
+            # Dequeue: the lowest waiting ticket for a book.
+            models.Index(fields=['queue', 'ticket'], condition=models.Q(status='waiting'),
+                         name='bookhold_waiting_idx'),
+            # "My holds".
+            models.Index(fields=['student', 'status'], name='bookhold_student_status_idx'),
+        ]
+
+class BookRecommendation(models.Model):
+    """
+    "Borrowed together": the books most often borrowed by the same students,
+    best first. Written by ``books.recommendations``; read as-is.
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    # Students who borrowed both books, and that count over sqrt(borrowers of each).
+    borrowers = models.PositiveIntegerField()
+    score = models.FloatField()
+    
+    def __str__(self):
+        return f"{self.book} -> {self.recommended} (#{self.rank})"
+    
+    class Meta:
+        ordering = ['rank']
+        constraints = [
+            # Also the index the detail page reads a book's list through.
+            models.UniqueConstraint(fields=['book', 'rank'], name='bookrecommendation_book_rank_uniq'),
+        ]
+
+class RecommendationRun(models.Model):
+    """One run of ``manage.py build_recommendations``; the last finished run is the checkpoint."""
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+    full_build = models.BooleanField(default=False)
+    # Issue transactions up to this id are reflected in the recommendations.
+    last_transaction_id = models.PositiveBigIntegerField(default=0)
+    books_updated = models.PositiveIntegerField(default=0)
+    recommendations = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"Recommendation build at {self.started_at:%Y-%m-%d %H:%M}"
+    
+    class Meta:
+        ordering = ['-started_at']
@@ -0,0 +1,165 @@
+"""
+"Borrowed together" recommendations.
+
+Every issue transaction is a (student, book) pair. The pairs make a
+sparse 0/1 students × books matrix ``B``, and ``Bᵀ·B`` counts, for each
+two books, the students who borrowed both. Each book keeps its
+``RECOMMENDATIONS_PER_BOOK`` best neighbours with at least
+``RECOMMENDATION_MIN_BORROWERS`` students in common. Neighbours are
+ranked by cosine similarity, the shared count over the square root of
+both books' borrower counts, so bestsellers don't top every list. The
+product is computed with scipy a block of books at a time, and the top
+neighbours are picked with one sort per block, so memory stays bounded
+and there is no Python loop over pairs.
+
+Runs are checkpointed in ``RecommendationRun`` by the last transaction
+id they saw. An incremental run finds the students with new issues since
+then and recomputes only the books those students have borrowed. Their
+lists are rebuilt from the histories of those books' borrowers only.
+Other books' scores for a neighbour that gained borrowers drift slightly
+until the next ``--full`` build. The results are stored in
+``BookRecommendation`` rows, so the detail page reads a book's list with
+one indexed query.
+"""
+import itertools
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+from scipy import sparse
+
+from transactions.models import Transaction
+from .models import BookRecommendation, RecommendationRun
+
+# Books whose neighbours are computed per sparse product.
+BLOCK_SIZE = 512
+
+
+def recommendation_policy():
+    per_book = int(getattr(settings, 'RECOMMENDATIONS_PER_BOOK', 5))
+    min_borrowers = int(getattr(settings, 'RECOMMENDATION_MIN_BORROWERS', 2))
+    return per_book, min_borrowers
+
+
+def read_pairs(issues, batch_size, stats, progress=None):
+    """``(student_id, book_id)`` of every issue in ``issues``, as an ``(n, 2)`` array."""
+    rows = issues.order_by().values_list('student_id', 'book_id').iterator(chunk_size=batch_size)
+    chunks = []
+    while True:
+        chunk = np.array(list(itertools.islice(rows, batch_size)), dtype=np.int64).reshape(-1, 2)
+        if not len(chunk):
+            break
+        chunks.append(chunk)
+        stats['transactions'] += len(chunk)
+        if progress:
+            progress(stats)
+    return np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+
+
+def top_neighbours(pairs, books, borrower_counts, rows, per_book, min_borrowers):
+    """
+    Yield ``(book_ids, recommended_ids, ranks, borrowers, scores)`` arrays
+    for the books at the ``rows`` indices of ``books``, one block at a
+    time. ``pairs`` holds the (student, book index) pairs to count from;
+    ``borrower_counts`` the total borrowers of each book in ``books``.
+    """
+    students, student_index = np.unique(pairs[:, 0], return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.int32), (student_index, pairs[:, 1])),
+        shape=(len(students), len(books)),
+    )
+    # A student who borrowed a book twice still counts once.
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    by_book = matrix.T.tocsr()
+    norms = np.sqrt(borrower_counts.astype(np.float64))
+
+    for start in range(0, len(rows), BLOCK_SIZE):
+        block = rows[start:start + BLOCK_SIZE]
+        shared = (by_book[block] @ matrix).tocoo()
+        row, column, count = shared.row, shared.col, shared.data
+        keep = (block[row] != column) & (count >= min_borrowers)
+        row, column, count = row[keep], column[keep], count[keep]
+        score = count / (norms[block[row]] * norms[column])
+        # Per book: best score first, then most borrowers, then the lower id.
+        order = np.lexsort((books[column], -count, -score, row))
+        row, column, count, score = row[order], column[order], count[order], score[order]
+        rank = np.arange(len(row)) - np.searchsorted(row, row)
+        keep = rank < per_book
+        yield books[block[row[keep]]], books[column[keep]], rank[keep] + 1, count[keep], score[keep]
+
+
+def save_neighbours(neighbours, stats, progress=None):
+    for book_ids, recommended_ids, ranks, borrowers, scores in neighbours:
+        BookRecommendation.objects.bulk_create([
+            BookRecommendation(book_id=book_id, recommended_id=recommended_id, rank=rank,
+                               borrowers=count, score=score)
+            for book_id, recommended_id, rank, count, score in zip(
+                book_ids.tolist(), recommended_ids.tolist(), ranks.tolist(),
+                borrowers.tolist(), scores.tolist(),
+            )
+        ], batch_size=1000)
+        stats['recommendations'] += len(book_ids)
+        if progress:
+            progress(stats)
+
+
+def build_recommendations(batch_size=10000, full=False, progress=None):
+    """
+    Bring ``BookRecommendation`` up to date with the issue transactions.
+    Returns a dict of run statistics; calls ``progress(stats)`` as
+    transactions are read and lists written.
+    """
+    per_book, min_borrowers = recommendation_policy()
+    last_run = RecommendationRun.objects.filter(finished_at__isnull=False).first()
+    issues = Transaction.objects.filter(transaction_type='issue')
+    # Transactions issued while this runs are left for the next one.
+    high = issues.aggregate(high=Max('pk'))['high'] or 0
+    issues = issues.filter(pk__lte=high)
+    full = full or last_run is None
+    run = RecommendationRun.objects.create(started_at=timezone.now(), full_build=full)
+    stats = {'transactions': 0, 'books': 0, 'recommendations': 0}
+    started = time.monotonic()
+
+    if full:
+        pairs = read_pairs(issues, batch_size, stats, progress)
+        books, pairs[:, 1] = np.unique(pairs[:, 1], return_inverse=True)
+        # Every borrower is in the pairs, so they give the totals directly.
+        distinct = np.unique(pairs[:, 0] * len(books) + pairs[:, 1]) % max(len(books), 1)
+        borrower_counts = np.bincount(distinct, minlength=len(books))
+        rows = np.arange(len(books))
+        with transaction.atomic():
+            BookRecommendation.objects.all().delete()
+            save_neighbours(top_neighbours(pairs, books, borrower_counts, rows, per_book, min_borrowers),
+                            stats, progress)
+    else:
+        new_students = issues.filter(pk__gt=last_run.last_transaction_id).values('student_id')
+        affected = issues.filter(student_id__in=new_students).values('book_id')
+        # Everyone who shares a book with the affected ones holds a count they need.
+        related = issues.filter(student_id__in=issues.filter(book_id__in=affected).values('student_id'))
+        pairs = read_pairs(related, batch_size, stats, progress)
+        books, pairs[:, 1] = np.unique(pairs[:, 1], return_inverse=True)
+        totals = dict(
+            issues.filter(book_id__in=related.values('book_id'))
+            .order_by().values('book_id').annotate(borrowers=Count('student_id', distinct=True))
+            .values_list('book_id', 'borrowers')
+        )
+        borrower_counts = np.array([totals.get(book_id, 0) for book_id in books.tolist()], dtype=np.int64)
+        affected_ids = np.array(sorted(set(affected.values_list('book_id', flat=True))), dtype=np.int64)
+        rows = np.searchsorted(books, affected_ids)
+        with transaction.atomic():
+            BookRecommendation.objects.filter(book_id__in=affected).delete()
+            save_neighbours(top_neighbours(pairs, books, borrower_counts, rows, per_book, min_borrowers),
+                            stats, progress)
+
+    stats['books'] = len(rows)
+    stats['elapsed'] = time.monotonic() - started
+    run.finished_at = timezone.now()
+    run.last_transaction_id = high
+    run.books_updated = stats['books']
+    run.recommendations = stats['recommendations']
+    run.save(update_fields=['finished_at', 'last_transaction_id', 'books_updated', 'recommendations'])
+    return stats
@@ -0,0 +1,255 @@
+"""
+Full-text search over the book catalogue.
+
+Each database engine keeps its own inverted index next to ``books_book``:
+SQLite uses an FTS5 virtual table, PostgreSQL a side table of weighted
+``tsvector`` documents with a GIN index. The index is maintained by the signal handlers in
+``books.signals`` and can be rebuilt with ``manage.py rebuild_search_index``.
+"""
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import Book
+
+SQLITE_TABLE = 'books_book_fts'
+POSTGRES_TABLE = 'books_book_search'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+ISBN_RE = re.compile(r'^(\d{9}[\dX]|\d{13})$')
+
+
+def normalize_isbn(query):
+    """Return ``query`` as a bare ISBN-10/13, or ``None`` if it isn't one."""
+    candidate = re.sub(r'[\s-]', '', query).upper()
+    return candidate if ISBN_RE.match(candidate) else None
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query.lower())
+
+
+class SearchBackend:
+    """Fallback for engines without a native index: plain ``icontains``."""
+
+    def search(self, query, limit):
+        return list(
+            Book.objects.filter(
+                Q(title__icontains=query) |
+                Q(author__icontains=query) |
+                Q(isbn__icontains=query) |
+                Q(category__name__icontains=query)
+            ).values_list('pk', flat=True)[:limit]
+        )
+
+    def index_books(self, book_ids):
+        pass
+
+    def remove_books(self, book_ids):
+        pass
+
+    def clear(self):
+        pass
+
+
+class SQLiteSearchBackend(SearchBackend):
+    # bm25() weights for the title, author, isbn and category columns.
+    WEIGHTS = (10.0, 5.0, 1.0, 2.0)
+
+    def search(self, query, limit):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        # Every token must match; each is treated as a prefix.
+        match = ' '.join('"%s"*' % token for token in tokens)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid FROM {table} WHERE {table} MATCH %s '
+                'ORDER BY bm25({table}, {weights}) LIMIT %s'.format(
+                    table=SQLITE_TABLE,
+                    weights=', '.join(str(w) for w in self.WEIGHTS),
+                ),
+                [match, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def index_books(self, book_ids):
+        book_ids = list(book_ids)
+        if not book_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(book_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {SQLITE_TABLE} WHERE rowid IN ({placeholders})',
+                book_ids,
+            )
+            cursor.execute(
+                f'INSERT INTO {SQLITE_TABLE} (rowid, title, author, isbn, category) '
+                'SELECT b.id, b.title, b.author, b.isbn, c.name '
+                'FROM books_book b JOIN books_category c ON c.id = b.category_id '
+                f'WHERE b.id IN ({placeholders})',
+                book_ids,
+            )
+
+    def remove_books(self, book_ids):
+        book_ids = list(book_ids)
+        if not book_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(book_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {SQLITE_TABLE} WHERE rowid IN ({placeholders})',
+                book_ids,
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE}')
+
+
+class PostgresSearchBackend(SearchBackend):
+    DOCUMENT = (
+        "setweight(to_tsvector('simple', b.title), 'A') || "
+        "setweight(to_tsvector('simple', b.author), 'B') || "
+        "setweight(to_tsvector('simple', c.name), 'C') || "
+        "setweight(to_tsvector('simple', b.isbn), 'D')"
+    )
+
+    def search(self, query, limit):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        # Tokens are plain word characters, so they are safe inside to_tsquery.
+        tsquery = ' & '.join('%s:*' % token for token in tokens)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT book_id FROM {POSTGRES_TABLE}, '
+                "to_tsquery('simple', %s) AS query "
+                'WHERE document @@ query '
+                'ORDER BY ts_rank(document, query) DESC, book_id LIMIT %s',
+                [tsquery, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def index_books(self, book_ids):
+        book_ids = list(book_ids)
+        if not book_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {POSTGRES_TABLE} (book_id, document) '
+                f'SELECT b.id, {self.DOCUMENT} '
+                'FROM books_book b JOIN books_category c ON c.id = b.category_id '
+                'WHERE b.id = ANY(%s) '
+                'ON CONFLICT (book_id) DO UPDATE SET document = EXCLUDED.document',
+                [book_ids],
+            )
+
+    def remove_books(self, book_ids):
+        book_ids = list(book_ids)
+        if not book_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {POSTGRES_TABLE} WHERE book_id = ANY(%s)', [book_ids])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {POSTGRES_TABLE}')
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend():
+    return BACKENDS.get(connection.vendor, SearchBackend)()
+
+
+class SearchResults:
+    """
+    Ranked search hits that only load the ``Book`` rows of the page being
+    displayed. Works with Django's ``Paginator`` like a queryset does.
+    """
+
+    def __init__(self, book_ids, queryset=None):
+        self.book_ids = book_ids
+        self.queryset = queryset if queryset is not None else Book.objects.all()
+
+    def __len__(self):
+        return len(self.book_ids)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            ids = self.book_ids[index]
+            books = self.queryset.in_bulk(ids)
+            return [books[pk] for pk in ids if pk in books]
+        return self[index:index + 1][0]
+
+    async def aload(self, book_ids):
+        """The books for ``book_ids`` (a page of ``self.book_ids``), in rank order."""
+        books = await self.queryset.ain_bulk(book_ids)
+        return [books[pk] for pk in book_ids if pk in books]
+
+
+def search_books(query, queryset=None):
+    """
+    Look ``query`` up in the catalogue. An exact ISBN goes straight to the
+    unique index on ``Book.isbn``; anything else is a ranked prefix search.
+    """
+    query = query.strip()
+    if not query:
+        return SearchResults([], queryset)
+
+    isbn = normalize_isbn(query)
+    if isbn:
+        book_ids = list(Book.objects.filter(isbn=isbn).values_list('pk', flat=True))
+        if book_ids:
+            return SearchResults(book_ids, queryset)
+
+    limit = getattr(settings, 'BOOK_SEARCH_MAX_RESULTS', 1000)
+    return SearchResults(get_backend().search(query, limit), queryset)
+
+
+async def asearch_books(query, queryset=None):
+    """``search_books`` for async views."""
+    query = query.strip()
+    if not query:
+        return SearchResults([], queryset)
+
+    isbn = normalize_isbn(query)
+    if isbn:
+        book_ids = [pk async for pk in Book.objects.filter(isbn=isbn).values_list('pk', flat=True)]
+        if book_ids:
+            return SearchResults(book_ids, queryset)
+
+    # The index is queried with raw SQL, which has no async form.
+    limit = getattr(settings, 'BOOK_SEARCH_MAX_RESULTS', 1000)
+    return SearchResults(await sync_to_async(get_backend().search)(query, limit), queryset)
+
+
+def rebuild_index(batch_size=1000):
+    """Drop and repopulate the search index. Returns the number of books indexed."""
+    backend = get_backend()
+    backend.clear()
+    indexed = 0
+    last_pk = 0
+    while True:
+        book_ids = list(
+            Book.objects.filter(pk__gt=last_pk)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not book_ids:
+            break
+        backend.index_books(book_ids)
+        indexed += len(book_ids)
+        last_pk = book_ids[-1]
+    return indexed
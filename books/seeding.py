@@ -0,0 +1,264 @@
+"""
+Synthetic library data for load tests and benchmarks.
+
+``seed_library`` writes students, books, requests, transactions and
+fines with ``bulk_create`` in fixed-size batches, so memory stays flat up
+to millions of rows. Book popularity follows a Zipf-like curve: a few
+titles get most of the loans, as in a real catalogue. Dates are spread
+over the last ``days`` days. Everything is drawn from a seeded
+``random.Random``, so the same arguments give the same library.
+"""
+import itertools
+import random
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from accounts.models import Counter, User
+from transactions.fines import compute_fine, fine_policy
+from transactions.models import Fine, Transaction
+from .models import Book, BookRequest, Category
+from .search import rebuild_index
+
+CATEGORIES = (
+    'Fiction', 'Science', 'History', 'Mathematics', 'Computer Science', 'Engineering',
+    'Philosophy', 'Poetry', 'Biography', 'Economics', 'Law', 'Medicine', 'Art',
+    'Music', 'Psychology', 'Sociology', 'Languages', 'Reference', 'Travel', 'Children',
+)
+
+WORDS = (
+    'silent', 'river', 'empire', 'theory', 'garden', 'night', 'modern', 'ancient',
+    'introduction', 'principles', 'history', 'shadow', 'light', 'city', 'data',
+    'structures', 'algorithms', 'ocean', 'mountain', 'letters', 'quantum', 'journey',
+    'world', 'systems', 'design', 'secret', 'winter', 'summer', 'machine', 'mind',
+)
+
+FIRST_NAMES = ('Asha', 'Ravi', 'Maria', 'Chen', 'Fatima', 'Liam', 'Noah', 'Priya', 'Omar', 'Yuki')
+LAST_NAMES = ('Rao', 'Smith', 'Garcia', 'Wang', 'Khan', 'Okafor', 'Muller', 'Silva', 'Kim', 'Das')
+
+# Request outcomes, by weight.
+STATUSES = (('returned', 70), ('approved', 10), ('pending', 10), ('rejected', 10))
+
+SEED_PREFIX = 'seed'
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """
+    Let bulk_create write historical dates into ``auto_now``/``auto_now_add``
+    fields of ``models`` instead of stamping them with the current time.
+    """
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def zipf_weights(n, skew):
+    """Cumulative weights giving item ``i`` a share proportional to ``1 / (i + 1) ** skew``."""
+    return list(itertools.accumulate(1 / (rank ** skew) for rank in range(1, n + 1)))
+
+
+class LibrarySeeder:
+
+    def __init__(self, students=2000, books=10000, requests=50000, days=365,
+                 skew=1.1, batch_size=5000, seed=42, progress=None):
+        self.counts = {'students': students, 'books': books, 'requests': requests}
+        self.days = days
+        self.skew = skew
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.progress = progress or (lambda message: None)
+        self.now = timezone.now()
+        self.stats = dict.fromkeys(('students', 'books', 'requests', 'transactions', 'fines'), 0)
+
+    def run(self, index=True):
+        started = time.monotonic()
+        with explicit_timestamps(User, Book, BookRequest, Transaction, Fine):
+            self.admin = self.seed_admin()
+            self.categories = self.seed_categories()
+            student_ids = self.seed_students()
+            book_ids = self.seed_books()
+            self.seed_requests(student_ids, book_ids)
+        self.settle_stock()
+        # bulk_create skips the signals that keep these in step; let them rebuild.
+        Counter.objects.all().delete()
+        if index:
+            self.progress('Rebuilding the search index...')
+            rebuild_index()
+        self.stats['elapsed'] = time.monotonic() - started
+        return self.stats
+
+    def random_past(self, days=None):
+        return self.now - timedelta(seconds=self.random.uniform(0, (days or self.days) * 86400))
+
+    def batches(self, total):
+        for start in range(0, total, self.batch_size):
+            yield start, min(self.batch_size, total - start)
+
+    def seed_admin(self):
+        admin, _ = User.objects.get_or_create(username=f'{SEED_PREFIX}-admin', defaults={
+            'user_type': 'admin', 'full_name': 'Seed Librarian', 'mobile_number': '0000000000',
+            'is_staff': True, 'password': make_password(None), 'created_at': self.now,
+        })
+        return admin
+
+    def seed_categories(self):
+        Category.objects.bulk_create([Category(name=name) for name in CATEGORIES], ignore_conflicts=True)
+        return list(Category.objects.filter(name__in=CATEGORIES).values_list('pk', flat=True))
+
+    def seed_students(self):
+        offset = User.objects.filter(username__startswith=f'{SEED_PREFIX}-student-').count()
+        # One unusable password hash shared by every seeded student; hashing per row would dominate.
+        password = make_password(None)
+        for start, size in self.batches(self.counts['students']):
+            students = []
+            for n in range(offset + start, offset + start + size):
+                first, last = self.random.choice(FIRST_NAMES), self.random.choice(LAST_NAMES)
+                students.append(User(
+                    username=f'{SEED_PREFIX}-student-{n}', password=password, user_type='student',
+                    full_name=f'{first} {last}', first_name=first, last_name=last,
+                    mobile_number=f'1{n:09d}', student_id=f'SEED{n:09d}',
+                    email=f'{SEED_PREFIX}.student.{n}@example.edu',
+                    date_joined=self.now, created_at=self.random_past(),
+                ))
+            with transaction.atomic():
+                User.objects.bulk_create(students)
+            self.stats['students'] += size
+            self.progress(f"  {self.stats['students']} students")
+        return list(
+            User.objects.filter(username__startswith=f'{SEED_PREFIX}-student-')
+            .order_by('pk').values_list('pk', flat=True)
+        )
+
+    def seed_books(self):
+        offset = Book.objects.filter(isbn__startswith='9799').count()
+        for start, size in self.batches(self.counts['books']):
+            books = []
+            for n in range(offset + start, offset + start + size):
+                title = ' '.join(self.random.sample(WORDS, self.random.randint(2, 5))).title()
+                copies = self.random.choice((1, 1, 2, 3, 5))
+                created = self.random_past(self.days * 3)
+                books.append(Book(
+                    title=title, author=f'{self.random.choice(FIRST_NAMES)} {self.random.choice(LAST_NAMES)}',
+                    isbn=f'9799{n:09d}', category_id=self.random.choice(self.categories),
+                    description=f'A seeded book about {title.lower()}.',
+                    pages=self.random.randint(48, 1200),
+                    publication_date=date(self.random.randint(1950, 2025), self.random.randint(1, 12), 1),
+                    publisher=f'{self.random.choice(LAST_NAMES)} Press',
+                    total_copies=copies, available_copies=copies, added_by=self.admin,
+                    created_at=created, updated_at=created,
+                ))
+            with transaction.atomic():
+                Book.objects.bulk_create(books)
+            self.stats['books'] += size
+            self.progress(f"  {self.stats['books']} books")
+        return list(Book.objects.filter(isbn__startswith='9799').order_by('pk').values_list('pk', flat=True))
+
+    def seed_requests(self, student_ids, book_ids):
+        # Shuffle so popularity isn't correlated with insertion order.
+        popular = book_ids[:]
+        self.random.shuffle(popular)
+        book_weights = zipf_weights(len(popular), self.skew)
+        student_weights = zipf_weights(len(student_ids), self.skew / 2)
+        statuses, status_weights = zip(*STATUSES)
+        rate, cap, grace = fine_policy()
+
+        for _, size in self.batches(self.counts['requests']):
+            seen = set()
+            loans = []
+            for book_id, student_id, status in zip(
+                self.random.choices(popular, cum_weights=book_weights, k=size),
+                self.random.choices(student_ids, cum_weights=student_weights, k=size),
+                self.random.choices(statuses, weights=status_weights, k=size),
+            ):
+                # (student, book, status) is unique; drop repeats within the batch.
+                if (student_id, book_id, status) in seen:
+                    continue
+                seen.add((student_id, book_id, status))
+                loans.append(self.make_request(student_id, book_id, status))
+
+            with transaction.atomic():
+                last_pk = BookRequest.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+                BookRequest.objects.bulk_create(loans, ignore_conflicts=True)
+                # Read back what was inserted; conflicts with earlier batches were skipped.
+                created = list(BookRequest.objects.filter(pk__gt=last_pk).values_list(
+                    'pk', 'student_id', 'book_id', 'status', 'approval_date', 'due_date', 'return_date',
+                ))
+                self.seed_ledger(created, rate, cap, grace)
+            self.stats['requests'] += len(created)
+            self.progress(f"  {self.stats['requests']} requests, {self.stats['transactions']} "
+                          f"transactions, {self.stats['fines']} fines")
+
+    def make_request(self, student_id, book_id, status):
+        requested = self.random_past()
+        book_request = BookRequest(student_id=student_id, book_id=book_id, status=status,
+                                   request_date=requested)
+        if status == 'pending':
+            return book_request
+        decided = requested + timedelta(hours=self.random.uniform(1, 72))
+        book_request.approved_by = self.admin
+        book_request.approval_date = decided
+        if status == 'rejected':
+            return book_request
+        book_request.due_date = decided + BookRequest.LOAN_PERIOD
+        if status == 'returned':
+            # Most loans come back on time; a tail comes back late.
+            held = self.random.expovariate(1 / 12)
+            book_request.return_date = min(decided + timedelta(days=held), self.now)
+        return book_request
+
+    def seed_ledger(self, loans, rate, cap, grace):
+        issues, returns, fines = [], [], []
+        for pk, student_id, book_id, status, approved, due, returned in loans:
+            if status not in ('approved', 'returned'):
+                continue
+            fine = compute_fine(due, returned or self.now, rate, cap, grace)
+            issues.append(Transaction(
+                student_id=student_id, book_id=book_id, loan_id=pk, transaction_type='issue',
+                transaction_date=approved, due_date=due, fine_amount=fine, processed_by=self.admin,
+            ))
+            if returned:
+                returns.append(Transaction(
+                    student_id=student_id, book_id=book_id, loan_id=pk, transaction_type='return',
+                    transaction_date=returned, return_date=returned, processed_by=self.admin,
+                ))
+        Transaction.objects.bulk_create(issues)
+        Transaction.objects.bulk_create(returns)
+        for issue in issues:
+            if issue.fine_amount:
+                paid = self.random.random() < 0.6
+                created = issue.due_date + timedelta(days=1)
+                fines.append(Fine(
+                    student_id=issue.student_id, transaction_id=issue.pk, amount=issue.fine_amount,
+                    reason=Fine.OVERDUE_REASON, is_paid=paid, created_at=created,
+                    paid_date=created + timedelta(days=self.random.randint(1, 30)) if paid else None,
+                ))
+        Fine.objects.bulk_create(fines)
+        self.stats['transactions'] += len(issues) + len(returns)
+        self.stats['fines'] += len(fines)
+
+    def settle_stock(self):
+        """Make copy counts agree with the seeded loans still out."""
+        out = (
+            BookRequest.objects.filter(book=OuterRef('pk'), status='approved')
+            .order_by().values('book').annotate(n=Count('pk')).values('n')
+        )
+        on_loan = Coalesce(Subquery(out), Value(0))
+        seeded = Book.objects.filter(isbn__startswith='9799')
+        seeded.update(total_copies=Greatest(F('total_copies'), on_loan))
+        seeded.update(available_copies=F('total_copies') - on_loan)
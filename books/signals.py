@@ -0,0 +1,72 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .covers import queue_cover_thumbnails
+from .fragments import invalidate_books
+from .models import Book, Category
+from .search import get_backend
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    get_backend().index_books([instance.pk])
+
+
+@receiver(post_init, sender=Book)
+def remember_cover(sender, instance, **kwargs):
+    # Read from __dict__ so a deferred cover is never loaded just for this.
+    cover = instance.__dict__.get('cover_image')
+    instance._saved_cover = getattr(cover, 'name', cover)
+
+
+@receiver(post_save, sender=Book)
+def process_cover(sender, instance, created=False, raw=False, **kwargs):
+    if raw or 'cover_image' not in instance.__dict__:
+        return
+    cover = instance.cover_image.name or None
+    if cover == instance._saved_cover:
+        return
+    instance._saved_cover = cover
+    # Thumbnails of the previous cover must not be served for the new one.
+    if not created:
+        Book.objects.filter(pk=instance.pk).update(cover_thumbnails={})
+        instance.cover_thumbnails = {}
+    if cover:
+        queue_cover_thumbnails(instance.pk)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+    get_backend().remove_books([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def reindex_category(sender, instance, created=False, raw=False, **kwargs):
+    # A new category has no books yet; a renamed one changes every book's document.
+    if created or raw:
+        return
+    book_ids = list(Book.objects.filter(category=instance).values_list('pk', flat=True))
+    backend = get_backend()
+    for start in range(0, len(book_ids), 1000):
+        backend.index_books(book_ids[start:start + 1000])
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_book_fragments(sender, instance, **kwargs):
+    invalidate_books([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_fragments(sender, instance, created=False, raw=False, **kwargs):
+    # Cards show the category name; a new category has no books yet.
+    if created or raw:
+        return
+    books = Book.objects.filter(category=instance)
+    # Also moves the catalogue's Last-Modified/ETag (books.conditional).
+    books.update(updated_at=timezone.now())
+    invalidate_books(books.values_list('pk', flat=True).iterator())
\ No newline at end of file
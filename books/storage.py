@@ -0,0 +1,35 @@
+"""
+Storage for files that are only served by views that check permissions.
+
+Book PDFs are kept under ``PROTECTED_MEDIA_ROOT`` instead of
+``MEDIA_ROOT``, so neither ``static(MEDIA_URL)`` in development nor the
+web server's ``/media/`` location can hand them out. They have no URL;
+``BookPDFView`` serves them, directly or through the front proxy's
+internal location (see ``PDF_SENDFILE_HEADER``).
+"""
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import cached_property
+
+
+@deconstructible(path='books.storage.ProtectedStorage')
+class ProtectedStorage(FileSystemStorage):
+
+    @cached_property
+    def base_location(self):
+        return self._value_or_setting(self._location, settings.PROTECTED_MEDIA_ROOT)
+
+    @cached_property
+    def base_url(self):
+        # FileSystemStorage.url() refuses to build a URL without one.
+        return None
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting == 'PROTECTED_MEDIA_ROOT':
+            self.__dict__.pop('base_location', None)
+            self.__dict__.pop('location', None)
+
+
+protected_storage = ProtectedStorage()
@@ -0,0 +1,37 @@
+from django import template
+
+from books.fragments import get_fragment, set_fragment
+
+register = template.Library()
+
+
+class BookFragmentNode(template.Node):
+
+    def __init__(self, nodelist, kind, book):
+        self.nodelist = nodelist
+        self.kind = kind
+        self.book = book
+
+    def render(self, context):
+        kind = self.kind.resolve(context)
+        book = self.book.resolve(context)
+        html = get_fragment(kind, book)
+        if html is None:
+            html = self.nodelist.render(context)
+            set_fragment(kind, book, html)
+        return html
+
+
+@register.tag
+def bookfragment(parser, token):
+    """
+    {% bookfragment 'card' book %}...{% endbookfragment %}
+
+    Cache the enclosed per-book markup until the book changes; see books.fragments.
+    """
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a fragment kind and a book.")
+    nodelist = parser.parse(('endbookfragment',))
+    parser.delete_first_token()
+    return BookFragmentNode(nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]))
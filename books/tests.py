@@ -1,3 +1,1141 @@
-from django.test import TestCase
+import os
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from importlib import import_module
+from unittest import skipUnless
+from io import BytesIO, StringIO
+from itertools import count
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.models import Count
+from django.core.files.storage import default_storage
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.counters import TOTAL_BOOKS, get_counters
+from accounts.models import User
+from PIL import Image
+
+from .covers import available_formats
+from .importer import BookImporter
+from .models import Book, BookHold, BookRecommendation, BookRequest, Category, HoldQueue, RecommendationRun
+from .recommendations import build_recommendations
+from .search import normalize_isbn, search_books
+from .seeding import LibrarySeeder
+from .views import BookListView
+from transactions.models import Fine, Transaction
+
+
+mobile_numbers = count(9000000000)
+
+
+def make_admin(username='librarian'):
+    return User.objects.create_user(
+        username=username, password='pass12345', user_type='admin',
+        full_name='Head Librarian', mobile_number=str(next(mobile_numbers)),
+    )
+
+
+def make_student(username='student'):
+    return User.objects.create_user(
+        username=username, password='pass12345', user_type='student',
+        full_name=f'Student {username}', mobile_number=str(next(mobile_numbers)),
+    )
+
+
+def make_reader(username):
+    """A student with no password to hash, for tests that need many accounts."""
+    return User.objects.create_user(
+        username=username, user_type='student',
+        full_name=f'Student {username}', mobile_number=str(next(mobile_numbers)),
+    )
+
+
+def make_book(category, added_by, **kwargs):
+    defaults = {
+        'title': 'Untitled', 'author': 'Anonymous', 'isbn': '0000000000000',
+        'description': 'A book.', 'pages': 100, 'publication_date': date(2020, 1, 1),
+        'publisher': 'Campus Press', 'total_copies': 1, 'available_copies': 1,
+    }
+    defaults.update(kwargs)
+    return Book.objects.create(category=category, added_by=added_by, **defaults)
+
+
+class BookSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        cls.fiction = Category.objects.create(name='Fiction')
+        cls.science = Category.objects.create(name='Science')
+        cls.dune = make_book(cls.fiction, cls.admin, title='Dune', author='Frank Herbert',
+                             isbn='9780441013593')
+        cls.cosmos = make_book(cls.science, cls.admin, title='Cosmos', author='Carl Sagan',
+                               isbn='9780345539434')
+        cls.dunes = make_book(cls.science, cls.admin, title='Coastal Dune Ecology',
+                              author='Ken Pye', isbn='9781108470599')
+
+    def search_ids(self, query):
+        return [book.pk for book in search_books(query)]
+
+    def test_normalize_isbn(self):
+        self.assertEqual(normalize_isbn('978-0-441-01359-3'), '9780441013593')
+        self.assertEqual(normalize_isbn('0-306-40615-x'), '030640615X')
+        self.assertIsNone(normalize_isbn('dune'))
+
+    def test_prefix_match(self):
+        self.assertEqual(set(self.search_ids('cosm')), {self.cosmos.pk})
+        self.assertEqual(set(self.search_ids('herb')), {self.dune.pk})
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.search_ids('dune herbert'), [self.dune.pk])
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(self.search_ids('dune')[0], self.dune.pk)
+
+    def test_exact_isbn_lookup(self):
+        self.assertEqual(self.search_ids('978-0-345-53943-4'), [self.cosmos.pk])
+
+    def test_category_search(self):
+        self.assertEqual(set(self.search_ids('science')), {self.cosmos.pk, self.dunes.pk})
+
+    def test_index_follows_book_updates_and_deletes(self):
+        self.cosmos.title = 'Pale Blue Dot'
+        self.cosmos.save()
+        self.assertEqual(self.search_ids('cosmos'), [])
+        self.assertEqual(self.search_ids('pale blue'), [self.cosmos.pk])
+
+        self.cosmos.delete()
+        self.assertEqual(self.search_ids('pale'), [])
+
+    def test_category_rename_reindexes_books(self):
+        self.fiction.name = 'Speculative'
+        self.fiction.save()
+        self.assertEqual(self.search_ids('speculative'), [self.dune.pk])
+
+    def test_rebuild_command(self):
+        call_command('rebuild_search_index', batch_size=2, stdout=StringIO())
+        self.assertEqual(set(self.search_ids('dune')), {self.dune.pk, self.dunes.pk})
+
+    def test_search_view_paginates_ranked_results(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('books:search'), {'q': 'dune'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([book.pk for book in response.context['books']][0], self.dune.pk)
+
+
+class BookViewQueryCountTests(TestCase):
+    """Lock the number of queries per page so N+1 regressions fail the suite."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        cls.student = make_student()
+        for i in range(25):
+            category = Category.objects.create(name=f'Category {i}')
+            book = make_book(category, cls.admin, title=f'Book {i}', isbn=f'{i:013d}')
+            student = make_reader(f'reader{i}')
+            BookRequest.objects.create(student=student, book=book)
+            BookRequest.objects.create(student=cls.student, book=book)
+        get_counters([TOTAL_BOOKS])
+
+    def test_book_list(self):
+        self.client.force_login(self.student)
+        # session, user, catalogue validators, count, page
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('books:list'))
+        self.assertEqual(len(response.context['books']), 12)
+
+    def test_book_search(self):
+        self.client.force_login(self.student)
+        # session, user, catalogue validators, full-text lookup, page
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('books:search'), {'q': 'book'})
+        self.assertEqual(len(response.context['books']), 12)
+
+    def test_book_detail(self):
+        self.client.force_login(self.student)
+        book = Book.objects.first()
+        # session, user, book with category, recommendations, existing request
+        with self.assertNumQueries(5):
+            self.client.get(reverse('books:detail', args=[book.pk]))
+
+    def test_pending_requests(self):
+        self.client.force_login(self.admin)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('books:requests'))
+        self.assertEqual(len(response.context['requests']), 20)
+
+    def test_my_requests(self):
+        self.client.force_login(self.student)
+        # session, user, count, page, waitlists
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('books:my_requests'))
+        self.assertEqual(len(response.context['requests']), 20)
+
+
+class CirculationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        cls.student = make_student()
+        cls.book = make_book(Category.objects.create(name='Fiction'), cls.admin,
+                             total_copies=1, available_copies=1)
+
+    def test_approve_issues_copy(self):
+        book_request = BookRequest.objects.create(student=self.student, book=self.book)
+        self.client.force_login(self.admin)
+        self.client.post(reverse('books:approve_request', args=[book_request.pk]))
+
+        book_request.refresh_from_db()
+        self.book.refresh_from_db()
+        self.assertEqual(book_request.status, 'approved')
+        self.assertIsNotNone(book_request.due_date)
+        self.assertEqual(self.book.available_copies, 0)
+        self.assertTrue(Transaction.objects.filter(
+            book=self.book, student=self.student, transaction_type='issue').exists())
+
+    def test_approve_twice_issues_one_copy(self):
+        self.book.available_copies = 2
+        self.book.save()
+        book_request = BookRequest.objects.create(student=self.student, book=self.book)
+
+        self.assertEqual(book_request.approve(self.admin), 'approved')
+        self.assertEqual(book_request.approve(self.admin), 'already_processed')
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 1)
+
+    def test_approve_without_copies_leaves_request_pending(self):
+        self.book.available_copies = 0
+        self.book.save()
+        book_request = BookRequest.objects.create(student=self.student, book=self.book)
+
+        self.assertEqual(book_request.approve(self.admin), 'insufficient_copies')
+        book_request.refresh_from_db()
+        self.assertEqual(book_request.status, 'pending')
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_return_restores_copy(self):
+        book_request = BookRequest.objects.create(student=self.student, book=self.book)
+        book_request.approve(self.admin)
+        self.client.force_login(self.student)
+        self.client.post(reverse('books:return', args=[book_request.pk]))
+
+        book_request.refresh_from_db()
+        self.book.refresh_from_db()
+        self.assertEqual(book_request.status, 'returned')
+        self.assertEqual(self.book.available_copies, 1)
+        self.assertFalse(book_request.mark_returned(self.student))
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 1)
+
+
+class WaitlistTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        cls.borrower = make_student('borrower')
+        cls.waiting = [make_student(f'waiting{i}') for i in range(3)]
+        cls.book = make_book(Category.objects.create(name='Fiction'), cls.admin)
+
+    def setUp(self):
+        self.loan = BookRequest.objects.create(student=self.borrower, book=self.book)
+        self.loan.approve(self.admin)
+
+    def test_request_for_checked_out_book_joins_waitlist(self):
+        for student in self.waiting:
+            self.client.force_login(student)
+            self.client.post(reverse('books:request', args=[self.book.pk]))
+        holds = list(BookHold.objects.select_related('queue'))
+        self.assertEqual([hold.student for hold in holds], self.waiting)
+        self.assertEqual([hold.position for hold in holds], [1, 2, 3])
+        self.assertFalse(BookRequest.objects.filter(student__in=self.waiting).exists())
+
+    def test_placing_twice_keeps_place(self):
+        first, created = BookHold.objects.place(self.book, self.waiting[0])
+        again, created_again = BookHold.objects.place(self.book, self.waiting[0])
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(first.pk, again.pk)
+
+    def test_return_issues_copy_to_head_of_queue(self):
+        for student in self.waiting:
+            BookHold.objects.place(self.book, student)
+        self.loan.mark_returned(self.borrower)
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 0)
+        first = BookHold.objects.get(student=self.waiting[0])
+        self.assertEqual(first.status, 'fulfilled')
+        self.assertEqual(first.loan.status, 'approved')
+        self.assertEqual(first.loan.student, self.waiting[0])
+        self.assertTrue(Transaction.objects.filter(
+            loan=first.loan, transaction_type='issue', student=self.waiting[0]).exists())
+        second = BookHold.objects.select_related('queue').get(student=self.waiting[1])
+        self.assertEqual(second.position, 1)
+
+    def test_cancelled_holds_are_skipped(self):
+        holds = [BookHold.objects.place(self.book, student)[0] for student in self.waiting]
+        holds[0].cancel()
+        holds[1].cancel()
+        self.loan.mark_returned(self.borrower)
+
+        holds[2].refresh_from_db()
+        self.assertEqual(holds[2].status, 'fulfilled')
+        self.assertEqual(HoldQueue.objects.get(pk=self.book.pk).head, holds[2].ticket + 1)
+
+    def test_request_replaces_hold(self):
+        hold, _ = BookHold.objects.place(self.book, self.waiting[0])
+        Book.objects.filter(pk=self.book.pk).update(available_copies=1)
+        self.client.force_login(self.waiting[0])
+        self.client.post(reverse('books:request', args=[self.book.pk]))
+
+        hold.refresh_from_db()
+        self.assertEqual(hold.status, 'cancelled')
+        self.assertEqual(BookRequest.objects.get(student=self.waiting[0]).status, 'pending')
+
+    def test_students_with_a_pending_request_are_skipped(self):
+        holds = [BookHold.objects.place(self.book, student)[0] for student in self.waiting[:2]]
+        # A request filed alongside the hold, as before requests withdrew holds.
+        pending = BookRequest.objects.create(student=self.waiting[0], book=self.book)
+        self.loan.mark_returned(self.borrower)
+
+        for hold in holds:
+            hold.refresh_from_db()
+        self.assertEqual([hold.status for hold in holds], ['cancelled', 'fulfilled'])
+        self.assertEqual(pending.approve(self.admin), 'insufficient_copies')
+        Book.objects.filter(pk=self.book.pk).update(available_copies=1)
+        self.assertEqual(pending.approve(self.admin), 'approved')
+
+    def test_added_copies_go_to_the_waitlist(self):
+        for student in self.waiting[:2]:
+            BookHold.objects.place(self.book, student)
+        superuser = User.objects.create_superuser(
+            username='root', password=None, user_type='admin',
+            full_name='Root', mobile_number=str(next(mobile_numbers)),
+        )
+        self.client.force_login(superuser)
+        book = self.book
+        response = self.client.post(reverse('admin:books_book_change', args=[book.pk]), {
+            'title': book.title, 'author': book.author, 'isbn': book.isbn, 'category': book.category_id,
+            'description': book.description, 'publisher': book.publisher,
+            'publication_date': book.publication_date.isoformat(), 'pages': book.pages,
+            'total_copies': 4, 'available_copies': 3, 'added_by': self.admin.pk,
+        })
+        self.assertEqual(response.status_code, 302)
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 1)
+        self.assertEqual(set(BookHold.objects.values_list('status', flat=True)), {'fulfilled'})
+        self.assertEqual(BookRequest.objects.filter(student__in=self.waiting[:2], status='approved').count(), 2)
+        self.assertEqual(BookHold.objects.fulfil_available(self.book.pk, self.admin), [])
+
+    def test_return_with_empty_queue_restocks(self):
+        hold, _ = BookHold.objects.place(self.book, self.waiting[0])
+        self.client.force_login(self.waiting[0])
+        self.client.post(reverse('books:cancel_hold', args=[hold.pk]))
+        self.loan.mark_returned(self.borrower)
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 1)
+        self.assertEqual(BookRequest.objects.filter(status='approved').count(), 0)
+
+    def test_position_lookup_does_not_scan_queue(self):
+        BookHold.objects.bulk_create([
+            BookHold(queue=HoldQueue.objects.get_or_create(book=self.book)[0],
+                     student=self.borrower, ticket=ticket, status='cancelled')
+            for ticket in range(1, 501)
+        ])
+        HoldQueue.objects.filter(pk=self.book.pk).update(tail=501)
+        hold, _ = BookHold.objects.place(self.book, self.waiting[0])
+        self.client.force_login(self.waiting[0])
+        # session, user, book with category, recommendations, existing request, hold with queue
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('books:detail', args=[self.book.pk]))
+        self.assertEqual(response.context['hold'].position, 501)
+
+
+class BulkRequestActionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        category = Category.objects.create(name='Fiction')
+        cls.popular = make_book(category, cls.admin, title='Popular', isbn='1',
+                                total_copies=2, available_copies=2)
+        cls.spare = make_book(category, cls.admin, title='Spare', isbn='2',
+                              total_copies=5, available_copies=5)
+        cls.students = [make_reader(f'reader{i}') for i in range(4)]
+
+    def test_bulk_approve_allocates_copies_in_request_order(self):
+        popular = [BookRequest.objects.create(student=s, book=self.popular) for s in self.students[:3]]
+        spare = BookRequest.objects.create(student=self.students[3], book=self.spare)
+        done = BookRequest.objects.create(student=self.students[0], book=self.spare, status='rejected')
+
+        ids = [r.pk for r in popular] + [spare.pk, done.pk, 999999]
+        with self.assertNumQueries(9):
+            outcomes = BookRequest.bulk_approve(ids, self.admin)
+
+        self.assertEqual(outcomes, {
+            popular[0].pk: 'approved',
+            popular[1].pk: 'approved',
+            popular[2].pk: 'insufficient_copies',
+            spare.pk: 'approved',
+            done.pk: 'already_processed',
+            999999: 'not_found',
+        })
+        self.popular.refresh_from_db()
+        self.spare.refresh_from_db()
+        self.assertEqual(self.popular.available_copies, 0)
+        self.assertEqual(self.spare.available_copies, 4)
+        self.assertEqual(Transaction.objects.filter(transaction_type='issue').count(), 3)
+        self.assertEqual(BookRequest.objects.get(pk=popular[2].pk).status, 'pending')
+
+    def test_bulk_view_rejects_selected_requests(self):
+        requests = [BookRequest.objects.create(student=s, book=self.spare) for s in self.students]
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse('books:bulk_requests'), {
+            'action': 'reject',
+            'request_ids': [r.pk for r in requests[:3]],
+        })
+        self.assertRedirects(response, reverse('books:requests'))
+        self.assertEqual(BookRequest.objects.filter(status='rejected').count(), 3)
+        self.assertEqual(BookRequest.objects.filter(status='pending').count(), 1)
+
+    def test_bulk_view_is_admin_only(self):
+        request = BookRequest.objects.create(student=self.students[0], book=self.spare)
+        self.client.force_login(self.students[0])
+        response = self.client.post(reverse('books:bulk_requests'), {
+            'action': 'approve', 'request_ids': [request.pk],
+        })
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(BookRequest.objects.get(pk=request.pk).status, 'pending')
+
+
+CATALOGUE_CSV = """isbn,title,author,category,description,pages,publication_date,publisher,total_copies
+978-0-441-01359-3,Dune,Frank Herbert,Fiction,Desert planet.,412,1965-08-01,Chilton,3
+9780345539434,Cosmos,Carl Sagan,Science,,365,1980,Random House,
+not-an-isbn,Broken,Nobody,Fiction,,10,2001-01-01,Nowhere,1
+9781108470599,Coastal Dune Ecology,Ken Pye,Science,,300,2019-05-01,CUP,2
+9780441013593,Dune (reissue),Frank Herbert,Fiction,,412,2005-08-02,Ace,1
+"""
+
+
+def marc_record(fields):
+    """Encode ``{tag: [(code, value), ...]}`` as one ISO 2709 record."""
+    directory, data = b'', b''
+    for tag, subfields in fields.items():
+        field = b'  ' + b''.join(b'\x1f' + code.encode() + value.encode() for code, value in subfields) + b'\x1e'
+        directory += f'{tag}{len(field):04d}{len(data):05d}'.encode()
+        data += field
+    base = 24 + len(directory) + 1
+    length = base + len(data) + 1
+    leader = f'{length:05d}nam a22{base:05d} a 4500'.encode()
+    return leader + directory + b'\x1e' + data + b'\x1d'
+
+
+ONIX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<ONIXMessage xmlns="http://ns.editeur.org/onix/3.0/reference" release="3.0">
+  <Header><Sender><SenderName>Campus Press</SenderName></Sender></Header>
+  <Product>
+    <RecordReference>1</RecordReference>
+    <ProductIdentifier><ProductIDType>15</ProductIDType><IDValue>9780131103627</IDValue></ProductIdentifier>
+    <DescriptiveDetail>
+      <TitleDetail><TitleType>01</TitleType><TitleElement><TitleElementLevel>01</TitleElementLevel>
+        <TitleText>The C Programming Language</TitleText></TitleElement></TitleDetail>
+      <Contributor><ContributorRole>A01</ContributorRole><PersonName>Brian Kernighan</PersonName></Contributor>
+      <Extent><ExtentType>00</ExtentType><ExtentValue>272</ExtentValue></Extent>
+      <Subject><SubjectHeadingText>Computing</SubjectHeadingText></Subject>
+    </DescriptiveDetail>
+    <PublishingDetail>
+      <Publisher><PublisherName>Prentice Hall</PublisherName></Publisher>
+      <PublishingDate><PublishingDateRole>01</PublishingDateRole><Date>19880322</Date></PublishingDate>
+    </PublishingDetail>
+  </Product>
+  <Product>
+    <RecordReference>2</RecordReference>
+    <DescriptiveDetail><TitleDetail><TitleElement><TitleText>No ISBN</TitleText></TitleElement></TitleDetail></DescriptiveDetail>
+  </Product>
+</ONIXMessage>
+"""
+
+
+class BookImportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        Category.objects.create(name='Fiction')
+
+    def run_import(self, data, format='csv', **kwargs):
+        errors = StringIO()
+        stats = BookImporter(self.admin, errors=errors, **kwargs).run(BytesIO(data), format)
+        return stats, errors.getvalue().splitlines()
+
+    def test_csv_import(self):
+        stats, errors = self.run_import(CATALOGUE_CSV.encode(), batch_size=2)
+        self.assertEqual((stats['records'], stats['created'], stats['errors']), (5, 3, 1))
+        self.assertEqual(stats['skipped'], 1)
+        self.assertEqual(errors[1], "3,not-an-isbn,invalid ISBN 'not-an-isbn'")
+        dune = Book.objects.get(isbn='9780441013593')
+        self.assertEqual((dune.title, dune.total_copies, dune.available_copies), ('Dune', 3, 3))
+        self.assertEqual(Book.objects.get(isbn='9780345539434').publication_date, date(1980, 1, 1))
+        self.assertEqual(set(Category.objects.values_list('name', flat=True)), {'Fiction', 'Science'})
+        # Imported books are searchable straight away.
+        self.assertEqual([book.title for book in search_books('sagan')], ['Cosmos'])
+
+    def test_update_existing_refreshes_details_but_not_copies(self):
+        self.run_import(CATALOGUE_CSV.encode())
+        Book.objects.filter(isbn='9780441013593').update(available_copies=1)
+        stats, _ = self.run_import(CATALOGUE_CSV.encode(), update_existing=True)
+        self.assertEqual((stats['created'], stats['updated']), (0, 3))
+        dune = Book.objects.get(isbn='9780441013593')
+        # The last record for an ISBN wins.
+        self.assertEqual((dune.title, dune.publisher), ('Dune (reissue)', 'Ace'))
+        self.assertEqual((dune.total_copies, dune.available_copies), (3, 1))
+
+    def test_marc_import(self):
+        data = marc_record({
+            '001': [],
+            '020': [('a', '9780262033848 (hardcover)')],
+            '100': [('a', 'Cormen, Thomas H.,')],
+            '245': [('a', 'Introduction to algorithms /'), ('c', 'Thomas H. Cormen.')],
+            '264': [('b', 'MIT Press,'), ('c', '[2009]')],
+            '300': [('a', 'xix, 1292 pages')],
+            '650': [('a', 'Computer algorithms.')],
+        }) + marc_record({'245': [('a', 'Missing ISBN')]})
+        stats, errors = self.run_import(data, 'marc')
+        self.assertEqual((stats['created'], stats['errors']), (1, 1))
+        book = Book.objects.get(isbn='9780262033848')
+        self.assertEqual((book.title, book.author, book.publisher), (
+            'Introduction to algorithms', 'Cormen, Thomas H.', 'MIT Press'))
+        self.assertEqual((book.pages, book.publication_date, book.category.name),
+                         (1292, date(2009, 1, 1), 'Computer algorithms'))
+
+    def test_corrupt_marc_record_is_rejected_alone(self):
+        def book(isbn, title):
+            return marc_record({
+                '020': [('a', isbn)], '100': [('a', 'Anonymous')], '245': [('a', title)], '264': [('c', '2001')],
+            })
+
+        short = book('9780262033848', 'Wrong length')
+        data = (book('9780131103627', 'First') + b'abcde' + short[5:]
+                + b'00099' + short[5:] + book('9780345539434', 'Last'))
+        stats, errors = self.run_import(data, 'marc')
+        self.assertEqual((stats['records'], stats['created'], stats['errors']), (4, 2, 2))
+        self.assertEqual([row.split(',')[0] for row in errors[1:]], ['2', '3'])
+        self.assertIn('corrupt MARC record length', errors[1])
+        self.assertEqual(set(Book.objects.values_list('title', flat=True)), {'First', 'Last'})
+
+    def test_unreadable_file_stops_without_promising_a_resume(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalogue.xml')
+            with open(path, 'wb') as catalogue:
+                catalogue.write(ONIX.replace(b'</ONIXMessage>', b'<Product>'))
+            with self.assertRaisesMessage(CommandError, 'could not be read after record 2') as raised:
+                call_command('import_books', path, stdout=StringIO())
+            self.assertNotIn('resume', str(raised.exception))
+
+    def test_onix_import(self):
+        stats, _ = self.run_import(ONIX, 'onix')
+        self.assertEqual((stats['created'], stats['errors']), (1, 1))
+        book = Book.objects.get(isbn='9780131103627')
+        self.assertEqual((book.author, book.pages, book.publication_date, book.category.name),
+                         ('Brian Kernighan', 272, date(1988, 3, 22), 'Computing'))
+
+    def test_interrupted_import_resumes_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'checkpoint.json')
+
+            def interrupt(stats):
+                raise KeyboardInterrupt
+
+            with self.assertRaises(KeyboardInterrupt):
+                BookImporter(self.admin, batch_size=2, checkpoint=checkpoint, progress=interrupt).run(
+                    BytesIO(CATALOGUE_CSV.encode()), 'csv', source='catalogue.csv')
+            self.assertEqual(Book.objects.count(), 2)
+
+            stats = BookImporter(self.admin, batch_size=2, checkpoint=checkpoint).run(
+                BytesIO(CATALOGUE_CSV.encode()), 'csv', source='catalogue.csv')
+            self.assertEqual((stats['records'], stats['created'], stats['errors']), (5, 3, 1))
+            self.assertFalse(os.path.exists(checkpoint))
+
+    def test_command_writes_error_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalogue.csv')
+            with open(path, 'w') as catalogue:
+                catalogue.write(CATALOGUE_CSV)
+            out = StringIO()
+            call_command('import_books', path, batch_size=2, stdout=out)
+            self.assertIn('3 created', out.getvalue())
+            with open(f'{path}.errors.csv') as errors:
+                self.assertEqual(len(errors.readlines()), 2)
+
+    def test_admin_upload(self):
+        superuser = User.objects.create_superuser(
+            username='root', password=None, user_type='admin',
+            full_name='Root', mobile_number=str(next(mobile_numbers)),
+        )
+        self.client.force_login(superuser)
+        changelist = self.client.get(reverse('admin:books_book_changelist'))
+        self.assertContains(changelist, reverse('admin:books_book_import'))
+        response = self.client.post(reverse('admin:books_book_import'), {
+            'file': SimpleUploadedFile('catalogue.csv', CATALOGUE_CSV.encode()),
+        })
+        self.assertEqual(response.context['stats']['created'], 3)
+        self.assertEqual(len(response.context['error_rows']), 1)
+
+
+def cover_upload(name='cover.png', size=(600, 900), color='navy'):
+    output = BytesIO()
+    Image.new('RGB', size, color).save(output, 'PNG')
+    return SimpleUploadedFile(name, output.getvalue(), content_type='image/png')
+
+
+@override_settings(COVER_THUMBNAIL_WORKERS=0)
+class CoverThumbnailTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        cls.category = Category.objects.create(name='Fiction')
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def add_book(self, isbn, cover):
+        with self.captureOnCommitCallbacks(execute=True):
+            book = make_book(self.category, self.admin, isbn=isbn, cover_image=cover)
+        book.refresh_from_db()
+        return book
+
+    def test_upload_generates_hashed_thumbnails(self):
+        book = self.add_book('0000000000001', cover_upload())
+        formats = [extension for _, extension, _ in available_formats()]
+        self.assertEqual(list(book.cover_thumbnails), formats)
+        for paths in book.cover_thumbnails.values():
+            # 800px would upscale the 600px original.
+            self.assertEqual(list(paths), ['200', '400'])
+            for width, path in paths.items():
+                self.assertTrue(default_storage.exists(path))
+                with default_storage.open(path) as thumbnail:
+                    self.assertEqual(Image.open(thumbnail).width, int(width))
+
+        # The same image on another book reuses the same files.
+        other = self.add_book('0000000000002', cover_upload('copy.png'))
+        self.assertEqual(other.cover_thumbnails, book.cover_thumbnails)
+
+    def test_new_cover_replaces_thumbnails(self):
+        book = self.add_book('0000000000001', cover_upload())
+        old = book.cover_thumbnails
+        with self.captureOnCommitCallbacks(execute=True):
+            book.cover_image = cover_upload('new.png', color='maroon')
+            book.save()
+        book.refresh_from_db()
+        self.assertTrue(book.cover_thumbnails)
+        self.assertNotEqual(book.cover_thumbnails, old)
+
+    def test_list_emits_srcset(self):
+        self.add_book('0000000000001', cover_upload())
+        self.client.force_login(make_student())
+        response = self.client.get(reverse('books:list'))
+        self.assertContains(response, '<source type="image/webp" srcset="/media/book_covers/thumbs/')
+        self.assertContains(response, '-400.webp 400w"')
+
+    def test_backfill_command(self):
+        book = self.add_book('0000000000001', cover_upload())
+        stale = timezone.now() - timedelta(days=1)
+        Book.objects.update(cover_thumbnails={}, updated_at=stale)
+        out = StringIO()
+        call_command('generate_cover_thumbnails', workers=1, stdout=out)
+        self.assertIn('Generated thumbnails for 1 of 1 covers', out.getvalue())
+        book.refresh_from_db()
+        self.assertTrue(book.cover_thumbnails)
+        # The cards now carry new image URLs, so the catalogue's validators must change.
+        self.assertGreater(book.updated_at, stale)
+
+
+class BookPDFDownloadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        cls.student = make_student()
+        cls.category = Category.objects.create(name='Reference')
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(PROTECTED_MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.content = bytes(range(256)) * 400
+        self.book = make_book(self.category, self.admin, isbn='9780000000001',
+                              pdf_file=SimpleUploadedFile('scan.pdf', self.content))
+        self.url = reverse('books:pdf', args=[self.book.pk])
+        self.client.force_login(self.student)
+
+    def get(self, **headers):
+        response = self.client.get(self.url, headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_full_download(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+    def test_byte_ranges(self):
+        for header, start, end in (('bytes=100-199', 100, 199), ('bytes=102000-', 102000, 102399),
+                                   ('bytes=-10', 102390, 102399), ('bytes=102300-999999', 102300, 102399)):
+            response, body = self.get(Range=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(body, self.content[start:end + 1], header)
+            self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/102400')
+            self.assertEqual(response['Content-Length'], str(end - start + 1))
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.get(Range='bytes=200000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */102400')
+
+    def test_multiple_ranges_get_whole_file(self):
+        response, body = self.get(Range='bytes=0-1,5-6')
+        self.assertEqual((response.status_code, len(body)), (200, 102400))
+
+    def test_conditional_requests(self):
+        response, _ = self.get()
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.get(If_None_Match=etag)[0].status_code, 304)
+        self.assertEqual(self.get(If_Modified_Since=last_modified)[0].status_code, 304)
+        # A stale If-Range sends the whole (changed) file instead of a range.
+        self.assertEqual(self.get(Range='bytes=0-9', If_Range=etag)[0].status_code, 206)
+        self.assertEqual(self.get(Range='bytes=0-9', If_Range='"stale"')[0].status_code, 200)
+
+    @override_settings(PDF_SENDFILE_HEADER='X-Accel-Redirect', PDF_ACCEL_REDIRECT_PREFIX='/protected/')
+    def test_accel_redirect(self):
+        response, body = self.get()
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/{self.book.pdf_file.name}')
+        self.assertEqual(body, b'')
+
+    def test_pdfs_are_kept_out_of_media(self):
+        path = os.path.join(self.book.pdf_file.storage.location, self.book.pdf_file.name)
+        self.assertTrue(os.path.isfile(path))
+        self.assertFalse(path.startswith(os.path.abspath(settings.MEDIA_ROOT)))
+        with self.assertRaises(ValueError):
+            self.book.pdf_file.url
+
+    def test_migration_moves_pdfs_out_of_media(self):
+        from django.apps import apps
+        move_book_pdfs = import_module('books.migrations.0010_move_book_pdfs')
+
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        name = self.book.pdf_file.name
+        protected = self.book.pdf_file.path
+        uploaded = os.path.join(media.name, name)
+        os.makedirs(os.path.dirname(uploaded))
+        os.replace(protected, uploaded)
+        with override_settings(MEDIA_ROOT=media.name):
+            move_book_pdfs.protect_pdfs(apps, None)
+        self.assertFalse(os.path.exists(uploaded))
+        self.assertEqual(self.get()[1], self.content)
+
+    def test_missing_file_is_not_found(self):
+        self.book.pdf_file.storage.delete(self.book.pdf_file.name)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_requires_login_and_a_pdf(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+        self.client.force_login(self.student)
+        other = make_book(self.category, self.admin, isbn='9780000000002')
+        self.assertEqual(self.client.get(reverse('books:pdf', args=[other.pk])).status_code, 404)
+
+    async def test_asgi_streams_with_an_async_iterator(self):
+        await self.async_client.aforce_login(self.student)
+        for headers, status, expected in (({}, 200, self.content),
+                                          ({'Range': 'bytes=100-199'}, 206, self.content[100:200])):
+            response = await self.async_client.get(self.url, headers=headers)
+            self.assertEqual(response.status_code, status)
+            self.assertTrue(response.is_async)
+            self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), expected)
+
+
+class BookFragmentCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        cls.student = make_student()
+        cls.category = Category.objects.create(name='Reference')
+
+    def setUp(self):
+        caches['fragments'].clear()
+        self.book = make_book(self.category, self.admin, description='Original blurb.', total_copies=2,
+                              available_copies=2)
+
+    def render(self, url_name='books:list', user=None, *args):
+        self.client.force_login(user or self.student)
+        return self.client.get(reverse(url_name, args=args)).content.decode()
+
+    def test_card_is_served_from_cache_until_the_book_changes(self):
+        self.assertIn('Original blurb.', self.render())
+        # A raw UPDATE without updated_at bypasses both the version and the signals.
+        Book.objects.filter(pk=self.book.pk).update(description='Sneaky edit.')
+        self.assertIn('Original blurb.', self.render())
+
+        self.book.description = 'New blurb.'
+        self.book.save()
+        self.assertIn('New blurb.', self.render())
+
+    def test_detail_page_fragment(self):
+        self.assertIn('Original blurb.', self.render('books:detail', None, self.book.pk))
+        Book.objects.filter(pk=self.book.pk).update(description='Sneaky edit.')
+        self.assertIn('Original blurb.', self.render('books:detail', None, self.book.pk))
+        self.category.name = 'Atlases'
+        self.category.save()
+        self.assertIn('Atlases', self.render('books:detail', None, self.book.pk))
+
+    def test_copy_counts_refresh_on_approval_and_return(self):
+        self.assertIn('2 available', self.render())
+        loan = BookRequest.objects.create(student=self.student, book=self.book)
+        loan.approve(self.admin)
+        self.assertIn('1 available', self.render())
+        loan.mark_returned(self.admin)
+        self.assertIn('2 available', self.render())
+
+    def test_per_user_controls_are_not_cached(self):
+        page = self.render(user=self.admin)
+        self.assertIn('Original blurb.', page)
+        self.assertNotIn('books/{}/request/'.format(self.book.pk), page)
+        self.assertIn('books/{}/request/'.format(self.book.pk), self.render(user=self.student))
+
+    @override_settings(BOOK_FRAGMENT_CACHE=None)
+    def test_caching_can_be_disabled(self):
+        self.render()
+        Book.objects.filter(pk=self.book.pk).update(description='Direct edit.')
+        self.assertIn('Direct edit.', self.render())
+
+
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        cls.student = make_student()
+        cls.category = Category.objects.create(name='Reference')
+
+    def setUp(self):
+        self.book = make_book(self.category, self.admin, total_copies=1, available_copies=1)
+        self.client.force_login(self.student)
+
+    def revalidate(self, url, **params):
+        first = self.client.get(url, params)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('no-cache', first['Cache-Control'])
+        return first['ETag'], self.client.get(url, params, headers={'If-None-Match': first['ETag']})
+
+    def test_unchanged_pages_answer_304(self):
+        for url, params in ((reverse('books:list'), {}), (reverse('books:search'), {'q': 'django'}),
+                            (reverse('books:detail', args=[self.book.pk]), {})):
+            etag, response = self.revalidate(url, **params)
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response['ETag'], etag)
+            self.assertEqual(response.content, b'')
+
+    def test_304_skips_rendering(self):
+        etag, _ = self.revalidate(reverse('books:list'))
+        # session, user, catalogue validators
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('books:list'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_catalogue_changes_invalidate(self):
+        url = reverse('books:list')
+        etag, _ = self.revalidate(url)
+        make_book(self.category, self.admin, title='Another', isbn='9780000000002')
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+        etag, _ = self.revalidate(url)
+        Book.objects.get(isbn='9780000000002').delete()
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_detail_varies_with_the_students_request(self):
+        url = reverse('books:detail', args=[self.book.pk])
+        etag, _ = self.revalidate(url)
+        BookRequest.objects.create(student=self.student, book=self.book)
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_etag_is_per_user(self):
+        etag, _ = self.revalidate(reverse('books:list'))
+        self.client.force_login(make_student('other'))
+        response = self.client.get(reverse('books:list'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_pending_messages_are_not_swallowed(self):
+        url = reverse('books:detail', args=[self.book.pk])
+        etag, _ = self.revalidate(url)
+        self.client.post(reverse('books:request', args=[self.book.pk]))
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertContains(response, 'Book request submitted successfully!')
+
+    @override_settings(CATALOGUE_PUBLIC=True, CATALOGUE_SHARED_MAX_AGE=60)
+    def test_signed_out_pages_can_be_shared(self):
+        self.client.logout()
+        response = self.client.get(reverse('books:list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=60', response['Cache-Control'])
+        response = self.client.get(reverse('books:list'),
+                                   headers={'If-Modified-Since': response['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+        self.assertContains(self.client.get(reverse('books:detail', args=[self.book.pk])), self.book.title)
+
+    def test_signed_out_visitors_need_login_by_default(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('books:list')).status_code, 302)
+
+    async def test_async_views_under_asgi(self):
+        url = reverse('books:detail', args=[self.book.pk])
+        self.assertEqual((await self.async_client.get(url)).status_code, 302)
+        await self.async_client.aforce_login(self.student)
+        for url, params in ((reverse('books:search'), {'q': self.book.title}), (url, {})):
+            response = await self.async_client.get(url, params)
+            self.assertContains(response, self.book.title)
+            response = await self.async_client.get(url, params, headers={'If-None-Match': response['ETag']})
+            self.assertEqual(response.status_code, 304, url)
+
+
+class RecommendationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        category = Category.objects.create(name='Fiction')
+        cls.books = {
+            name: make_book(category, cls.admin, title=f'Book {name}', isbn=name)
+            for name in 'abcd'
+        }
+        cls.students = [make_reader(f'reader{i}') for i in range(5)]
+        # Borrowers: a by everyone but reader4 (reader0 twice), b by 0 and 1, c by 0 and 2, d by 3.
+        for student, names in zip(cls.students, ('aabc', 'ab', 'ac', 'ad')):
+            for name in names:
+                cls.issue(student, name)
+
+    @classmethod
+    def issue(cls, student, name):
+        Transaction.objects.create(student=student, book=cls.books[name], transaction_type='issue',
+                                   processed_by=cls.admin)
+
+    def recommended(self, name):
+        return [
+            (item.recommended.isbn, item.borrowers)
+            for item in BookRecommendation.objects.filter(book=self.books[name]).select_related('recommended')
+        ]
+
+    def test_full_build(self):
+        stats = build_recommendations()
+        self.assertEqual(stats['transactions'], 10)
+        # b and c tie with a on score and borrowers; the lower id goes first.
+        self.assertEqual(self.recommended('a'), [('b', 2), ('c', 2)])
+        self.assertEqual(self.recommended('b'), [('a', 2)])
+        self.assertEqual(self.recommended('c'), [('a', 2)])
+        # One shared borrower is below RECOMMENDATION_MIN_BORROWERS.
+        self.assertEqual(self.recommended('d'), [])
+        score = BookRecommendation.objects.get(book=self.books['a'], rank=1).score
+        self.assertAlmostEqual(score, 2 / (4 * 2) ** 0.5)
+
+    def test_incremental_refresh_recomputes_only_affected_books(self):
+        build_recommendations()
+        self.issue(self.students[4], 'b')
+        self.issue(self.students[4], 'c')
+
+        stats = build_recommendations()
+        self.assertEqual(stats['books'], 2)
+        # b and c now share two borrowers out of three each, ahead of a's two out of four.
+        self.assertEqual(self.recommended('b'), [('c', 2), ('a', 2)])
+        self.assertEqual(self.recommended('c'), [('b', 2), ('a', 2)])
+        self.assertEqual(self.recommended('a'), [('b', 2), ('c', 2)])
+        run = RecommendationRun.objects.first()
+        self.assertFalse(run.full_build)
+        self.assertEqual(run.last_transaction_id, Transaction.objects.order_by('-pk').first().pk)
+
+        self.assertEqual(build_recommendations()['books'], 0)
+        self.assertEqual(BookRecommendation.objects.count(), 6)
+
+    @override_settings(RECOMMENDATIONS_PER_BOOK=1, RECOMMENDATION_MIN_BORROWERS=1)
+    def test_policy_settings(self):
+        build_recommendations()
+        self.assertEqual(self.recommended('a'), [('b', 2)])
+        self.assertEqual(self.recommended('d'), [('a', 1)])
+
+    def test_detail_page_lists_recommendations(self):
+        call_command('build_recommendations', stdout=StringIO())
+        self.client.force_login(self.admin)
+        url = reverse('books:detail', args=[self.books['a'].pk])
+        response = self.client.get(url)
+        self.assertContains(response, 'Borrowed Together')
+        self.assertEqual([item.recommended for item in response.context['recommendations']],
+                         [self.books['b'], self.books['c']])
+
+        # A changed list changes the ETag.
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        BookRecommendation.objects.filter(book=self.books['a'], rank=2).delete()
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+
+class ConcurrentApprovalTests(TransactionTestCase):
+    COPIES = 5
+    REQUESTS = 20
+
+    def setUp(self):
+        self.admin = make_admin()
+        self.book = make_book(Category.objects.create(name='Fiction'), self.admin,
+                              total_copies=self.COPIES, available_copies=self.COPIES)
+        self.requests = [
+            BookRequest.objects.create(student=make_reader(f'reader{i}'), book=self.book)
+            for i in range(self.REQUESTS)
+        ]
+
+    def approve_in_thread(self, book_request, barrier, outcomes):
+        try:
+            barrier.wait()
+            while True:
+                try:
+                    outcomes.append(book_request.approve(self.admin))
+                    return
+                except OperationalError:
+                    # SQLite reports lock contention instead of blocking; retry.
+                    time.sleep(0.01)
+        finally:
+            connection.close()
+
+    def test_parallel_approvals_never_oversell(self):
+        # Every request is approved from two threads at once.
+        jobs = self.requests * 2
+        barrier = threading.Barrier(len(jobs))
+        outcomes = []
+        threads = [
+            threading.Thread(target=self.approve_in_thread, args=(book_request, barrier, outcomes))
+            for book_request in jobs
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.book.refresh_from_db()
+        self.assertEqual(len(outcomes), len(jobs))
+        self.assertEqual(outcomes.count('approved'), self.COPIES)
+        self.assertEqual(self.book.available_copies, 0)
+        self.assertEqual(BookRequest.objects.filter(status='approved').count(), self.COPIES)
+        self.assertEqual(Transaction.objects.filter(transaction_type='issue').count(), self.COPIES)
+
+
+def assert_uses_index(testcase, queryset, index_name):
+    """Fail unless the query plan reads ``queryset`` through ``index_name``."""
+    plan = queryset.explain()
+    testcase.assertIn(f'INDEX {index_name}', plan)
+
+
+class SeedLibraryTests(TestCase):
+
+    def seed(self, **kwargs):
+        options = {'students': 20, 'books': 30, 'requests': 200, 'batch_size': 50}
+        return LibrarySeeder(**{**options, **kwargs}).run()
+
+    def test_seeds_consistent_library(self):
+        stats = self.seed()
+        self.assertEqual(User.objects.filter(user_type='student').count(), 20)
+        self.assertEqual(Book.objects.count(), 30)
+        self.assertEqual(BookRequest.objects.count(), stats['requests'])
+        self.assertEqual(Transaction.objects.count(), stats['transactions'])
+        self.assertEqual(Fine.objects.count(), stats['fines'])
+        self.assertGreater(stats['fines'], 0)
+        # Copies on loan never exceed stock.
+        for book in Book.objects.all():
+            out = book.bookrequest_set.filter(status='approved').count()
+            self.assertEqual(book.available_copies, book.total_copies - out)
+        # Historical dates were kept rather than stamped with now().
+        oldest = BookRequest.objects.earliest('request_date').request_date
+        self.assertLess(oldest, timezone.now() - timedelta(days=30))
+        # The search index was rebuilt for the bulk-created books.
+        book = Book.objects.first()
+        self.assertIn(book, list(search_books(book.title)))
+
+    def test_popularity_is_skewed(self):
+        self.seed(skew=1.5)
+        loans = sorted(Book.objects.annotate(n=Count('bookrequest')).values_list('n', flat=True),
+                       reverse=True)
+        self.assertGreater(sum(loans[:3]), sum(loans) / 3)
+
+    def test_second_run_adds_to_the_first(self):
+        self.seed()
+        self.seed(seed=7)
+        self.assertEqual(User.objects.filter(user_type='student').count(), 40)
+        self.assertEqual(Book.objects.count(), 60)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('seed_library', students=5, books=5, requests=20, skip_search_index=True,
+                     stdout=out)
+        self.assertIn('Seeded 5 students, 5 books', out.getvalue())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked against SQLite.')
+class BookQueryPlanTests(TestCase):
+
+    def list_queryset(self, **params):
+        view = BookListView()
+        view.setup(RequestFactory().get('/books/', params))
+        return view.get_queryset()[:12]
+
+    def test_book_list_uses_available_index(self):
+        assert_uses_index(self, self.list_queryset(), 'book_available_recent_idx')
+
+    def test_full_book_list_uses_recent_index(self):
+        assert_uses_index(self, self.list_queryset(all='1'), 'book_recent_idx')
+
+    def test_catalogue_validator_uses_updated_index(self):
+        assert_uses_index(self, Book.objects.order_by('-updated_at').values('updated_at')[:1],
+                          'book_updated_idx')
+
+    def test_next_hold_uses_waiting_index(self):
+        assert_uses_index(self, BookHold.objects.filter(queue_id=1, status='waiting', ticket__gte=1)
+                          .order_by('ticket')[:1], 'bookhold_waiting_idx')
+
+    def test_pending_queue_uses_partial_index(self):
+        assert_uses_index(self, BookRequest.objects.filter(status='pending')[:20],
+                          'bookrequest_pending_idx')
+
+    def test_student_counters_use_student_status_index(self):
+        assert_uses_index(self, BookRequest.objects.filter(student_id=1, status='pending').order_by(),
+                          'bookrequest_student_status_idx')
+
+    def test_recommendations_use_book_rank_index(self):
+        plan = BookRecommendation.objects.filter(book_id=1).select_related('recommended').explain()
+        self.assertNotIn('SCAN', plan.replace('SCAN CONSTANT ROW', ''))
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_my_requests_use_student_date_index(self):
+        assert_uses_index(self, BookRequest.objects.filter(student_id=1)[:20],
+                          'bookrequest_student_date_idx')
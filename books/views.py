@@ -1,60 +1,148 @@
-from django.shortcuts import render, get_object_or_404, redirect
+from asgiref.sync import sync_to_async
+from django.http import Http404
+from django.shortcuts import aget_object_or_404, render, get_object_or_404, redirect
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.views.generic import ListView, DetailView, CreateView, View
 from django.contrib import messages
-from django.db.models import Q
-from django.utils import timezone
-from datetime import timedelta
-from .models import Book, BookRequest, Category
+from .models import Book, BookHold, BookRecommendation, BookRequest, Category
+from accounts.mixins import AsyncLoginRequiredMixin
+from .conditional import (
+    AsyncCatalogueAccessMixin, AsyncConditionalGetMixin, CatalogueAccessMixin, ConditionalGetMixin,
+)
+from .downloads import serve_file
 from .forms import BookForm, BookRequestForm
-from transactions.models import Transaction
+from .search import asearch_books
 
-class BookListView(LoginRequiredMixin, ListView):
+# Columns rendered by the book cards in books/list.html and books/search.html;
+# updated_at versions the cached card fragments.
+BOOK_CARD_FIELDS = (
+    'title', 'author', 'description', 'pages', 'cover_image', 'cover_thumbnails',
+    'available_copies', 'category__name', 'updated_at',
+)
+
+class BookListView(CatalogueAccessMixin, ConditionalGetMixin, ListView):
     model = Book
     template_name = 'books/list.html'
     context_object_name = 'books'
     paginate_by = 12
     
+    def show_all(self):
+        # Checked-out titles are listed on request so students can join their waitlists.
+        return self.request.GET.get('all') == '1'
+    
     def get_queryset(self):
-        return Book.objects.filter(available_copies__gt=0)
+        books = Book.objects.select_related('category').only(*BOOK_CARD_FIELDS)
+        if self.show_all():
+            return books
+        return books.filter(available_copies__gt=0)
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['show_all'] = self.show_all()
+        return context
 
-class BookSearchView(LoginRequiredMixin, ListView):
+class BookSearchView(AsyncCatalogueAccessMixin, AsyncConditionalGetMixin, ListView):
     model = Book
     template_name = 'books/search.html'
     context_object_name = 'books'
     paginate_by = 12
     
-    def get_queryset(self):
-        query = self.request.GET.get('q')
-        if query:
-            return Book.objects.filter(
-                Q(title__icontains=query) |
-                Q(author__icontains=query) |
-                Q(isbn__icontains=query) |
-                Q(category__name__icontains=query)
-            ).distinct()
-        return Book.objects.none()
-    
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['query'] = self.request.GET.get('q', '')
-        return context
+    async def aget_page(self, request, *args, **kwargs):
+        query = request.GET.get('q', '')
+        results = await asearch_books(
+            query, Book.objects.select_related('category').only(*BOOK_CARD_FIELDS)
+        )
+        # Page through the ranked ids; only the shown page's books are loaded.
+        paginator, page, book_ids, is_paginated = self.paginate_queryset(
+            results.book_ids, self.paginate_by,
+        )
+        page.object_list = self.object_list = await results.aload(book_ids)
+        return self.render_to_response({
+            'view': self,
+            'paginator': paginator,
+            'page_obj': page,
+            'is_paginated': is_paginated,
+            'object_list': self.object_list,
+            'books': self.object_list,
+            'query': query,
+        })
 
-class BookDetailView(LoginRequiredMixin, DetailView):
+class BookDetailView(AsyncCatalogueAccessMixin, AsyncConditionalGetMixin, DetailView):
     model = Book
     template_name = 'books/detail.html'
     context_object_name = 'book'
+    queryset = Book.objects.select_related('category')
     
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        if self.request.user.user_type == 'student':
-            existing_request = BookRequest.objects.filter(
+    def is_student(self):
+        return getattr(self.request.user, 'user_type', None) == 'student'
+    
+    async def aget_student_state(self, book):
+        """The student's open request for this book, or else their place on its waitlist."""
+        if not hasattr(self, 'student_state'):
+            existing_request = await BookRequest.objects.filter(
                 student=self.request.user,
-                book=self.object,
+                book=book,
                 status__in=['pending', 'approved']
-            ).first()
+            ).afirst()
+            hold = None
+            if not existing_request and not book.is_available:
+                hold = await BookHold.objects.select_related('queue').filter(
+                    queue_id=book.pk, student=self.request.user, status='waiting',
+                ).afirst()
+            self.student_state = existing_request, hold
+        return self.student_state
+    
+    async def aget_object(self):
+        # Fetched once for both the validators and the page.
+        if not hasattr(self, 'book'):
+            self.book = await aget_object_or_404(self.get_queryset(), pk=self.kwargs['pk'])
+        return self.book
+    
+    async def aget_recommendations(self, book):
+        """The "borrowed together" list, in one read of the ``(book, rank)`` index."""
+        if not hasattr(self, 'recommendations'):
+            self.recommendations = [
+                item async for item in
+                BookRecommendation.objects.filter(book=book).select_related('recommended')
+            ]
+        return self.recommendations
+    
+    async def aget_page_state(self):
+        book = await self.aget_object()
+        recommended = tuple(
+            (item.recommended_id, item.recommended.updated_at) for item in await self.aget_recommendations(book)
+        )
+        if not self.is_student():
+            return book.updated_at, (recommended,)
+        existing_request, hold = await self.aget_student_state(book)
+        return book.updated_at, (
+            recommended,
+            existing_request and (existing_request.pk, existing_request.status, existing_request.due_date),
+            hold and (hold.pk, hold.position),
+        )
+    
+    async def aget_page(self, request, *args, **kwargs):
+        self.object = await self.aget_object()
+        context = self.get_context_data(object=self.object)
+        context['recommendations'] = await self.aget_recommendations(self.object)
+        if self.is_student():
+            existing_request, hold = await self.aget_student_state(self.object)
             context['existing_request'] = existing_request
-        return context
+            if hold:
+                context['hold'] = hold
+        return self.render_to_response(context)
+
+class BookPDFView(AsyncLoginRequiredMixin, View):
+    """Serve a book's PDF with byte-range and conditional request support."""
+    
+    async def get(self, request, pk):
+        book = await aget_object_or_404(Book.objects.only('isbn', 'pdf_file'), pk=pk)
+        if not book.pdf_file:
+            raise Http404('This book has no PDF.')
+        # Stats the file on storage, so runs in a thread.
+        return await sync_to_async(serve_file)(
+            request, book.pdf_file, 'application/pdf', f'{book.isbn}.pdf',
+        )
 
 class AddBookView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
     model = Book
@@ -91,12 +179,19 @@ class RequestBookView(LoginRequiredMixin, UserPassesTestMixin, View):
         if existing_request:
             messages.error(request, 'You already have a request for this book.')
         elif not book.is_available:
-            messages.error(request, 'This book is not available.')
+            hold, created = BookHold.objects.place(book, request.user)
+            if created:
+                messages.success(request, f'This book is checked out. You are #{hold.position} on the '
+                                          'waitlist and will be issued the next returned copy.')
+            else:
+                messages.info(request, f'You are already on the waitlist for this book (#{hold.position}).')
         else:
             BookRequest.objects.create(
                 student=request.user,
                 book=book
             )
+            # A copy came back to stock while they were waiting; the request replaces the hold.
+            BookHold.objects.withdraw([book.pk], request.user)
             messages.success(request, 'Book request submitted successfully!')
         
         return redirect('books:detail', pk=pk)
@@ -110,8 +205,21 @@ class BookRequestListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     def test_func(self):
         return self.request.user.user_type == 'admin'
     
+    def get_paginate_by(self, queryset):
+        per_page = self.request.GET.get('per_page', '')
+        if per_page.isdigit():
+            return min(max(int(per_page), 1), 500)
+        return self.paginate_by
+    
     def get_queryset(self):
-        return BookRequest.objects.filter(status='pending')
+        return (
+            BookRequest.objects.filter(status='pending')
+            .select_related('student', 'book')
+            .only(
+                'request_date', 'student__full_name', 'student__student_id',
+                'book__title', 'book__author',
+            )
+        )
 
 class MyRequestsView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     model = BookRequest
@@ -123,7 +231,20 @@ class MyRequestsView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         return self.request.user.user_type == 'student'
     
     def get_queryset(self):
-        return BookRequest.objects.filter(student=self.request.user)
+        return (
+            BookRequest.objects.filter(student=self.request.user)
+            .select_related('book')
+            .only('request_date', 'status', 'due_date', 'book__title', 'book__author')
+        )
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['holds'] = (
+            BookHold.objects.filter(student=self.request.user, status='waiting')
+            .select_related('queue__book')
+            .only('ticket', 'queue__head', 'queue__book__title', 'queue__book__author')
+        )
+        return context
 
 class ApproveRequestView(LoginRequiredMixin, UserPassesTestMixin, View):
     
@@ -132,33 +253,55 @@ class ApproveRequestView(LoginRequiredMixin, UserPassesTestMixin, View):
     
     def post(self, request, pk):
         book_request = get_object_or_404(BookRequest, pk=pk)
+        outcome = book_request.approve(request.user)
         
-        if book_request.book.available_copies > 0:
-            book_request.status = 'approved'
-            book_request.approved_by = request.user
-            book_request.approval_date = timezone.now()
-            book_request.due_date = timezone.now() + timedelta(days=14)  # 2 weeks
-            book_request.save()
-            
-            # Decrease available copies
-            book_request.book.available_copies -= 1
-            book_request.book.save()
-            
-            # Create transaction
-            Transaction.objects.create(
-                student=book_request.student,
-                book=book_request.book,
-                transaction_type='issue',
-                due_date=book_request.due_date,
-                processed_by=request.user
-            )
-            
+        if outcome == 'approved':
             messages.success(request, 'Book request approved successfully!')
-        else:
+        elif outcome == 'insufficient_copies':
             messages.error(request, 'Book is not available.')
+        else:
+            messages.error(request, 'This request has already been processed.')
         
         return redirect('books:requests')
 
+class BulkRequestActionView(LoginRequiredMixin, UserPassesTestMixin, View):
+    OUTCOME_LABELS = {
+        'approved': 'approved',
+        'rejected': 'rejected',
+        'insufficient_copies': 'not enough copies',
+        'already_processed': 'already processed',
+        'not_found': 'not found',
+    }
+    
+    def test_func(self):
+        return self.request.user.user_type == 'admin'
+    
+    def post(self, request):
+        action = request.POST.get('action')
+        request_ids = [pk for pk in request.POST.getlist('request_ids') if pk.isdigit()]
+        
+        if action not in ('approve', 'reject') or not request_ids:
+            messages.error(request, 'Select at least one request and an action.')
+            return redirect('books:requests')
+        
+        if action == 'approve':
+            outcomes = BookRequest.bulk_approve(request_ids, request.user)
+        else:
+            outcomes = BookRequest.bulk_reject(request_ids, request.user)
+        
+        by_outcome = {}
+        for pk, outcome in outcomes.items():
+            by_outcome.setdefault(outcome, []).append(pk)
+        
+        done = by_outcome.pop('approved', []) + by_outcome.pop('rejected', [])
+        if done:
+            messages.success(request, f'{len(done)} request(s) {action}d.')
+        for outcome, pks in by_outcome.items():
+            messages.warning(request, '{} request(s) {}: #{}'.format(
+                len(pks), self.OUTCOME_LABELS[outcome], ', #'.join(str(pk) for pk in pks),
+            ))
+        return redirect('books:requests')
+
 class RejectRequestView(LoginRequiredMixin, UserPassesTestMixin, View):
     
     def test_func(self):
@@ -166,12 +309,11 @@ class RejectRequestView(LoginRequiredMixin, UserPassesTestMixin, View):
     
     def post(self, request, pk):
         book_request = get_object_or_404(BookRequest, pk=pk)
-        book_request.status = 'rejected'
-        book_request.approved_by = request.user
-        book_request.approval_date = timezone.now()
-        book_request.save()
         
-        messages.success(request, 'Book request rejected.')
+        if book_request.reject(request.user):
+            messages.success(request, 'Book request rejected.')
+        else:
+            messages.error(request, 'This request has already been processed.')
         return redirect('books:requests')
 
 class ReturnBookView(LoginRequiredMixin, UserPassesTestMixin, View):
@@ -182,22 +324,23 @@ class ReturnBookView(LoginRequiredMixin, UserPassesTestMixin, View):
     def post(self, request, pk):
         book_request = get_object_or_404(BookRequest, pk=pk, student=request.user, status='approved')
         
-        book_request.status = 'returned'
-        book_request.return_date = timezone.now()
-        book_request.save()
-        
-        # Increase available copies
-        book_request.book.available_copies += 1
-        book_request.book.save()
-        
-        # Create return transaction
-        Transaction.objects.create(
-            student=request.user,
-            book=book_request.book,
-            transaction_type='return',
-            return_date=timezone.now(),
-            processed_by=request.user  # Self-return, could be modified for admin processing
-        )
+        # Self-return, could be modified for admin processing
+        if book_request.mark_returned(processed_by=request.user):
+            messages.success(request, 'Book returned successfully!')
+        else:
+            messages.error(request, 'This book has already been returned.')
+        return redirect('books:my_requests')
+
+class CancelHoldView(LoginRequiredMixin, UserPassesTestMixin, View):
+    
+    def test_func(self):
+        return self.request.user.user_type == 'student'
+    
+    def post(self, request, pk):
+        hold = get_object_or_404(BookHold, pk=pk, student=request.user)
         
-        messages.success(request, 'Book returned successfully!')
-        return redirect('books:my_requests')
\ No newline at end of file
+        if hold.cancel():
+            messages.success(request, 'You have left the waitlist.')
+        else:
+            messages.error(request, 'This hold is no longer active.')
+        return redirect('books:detail', pk=hold.queue_id)
\ No newline at end of file
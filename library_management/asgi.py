@@ -2,6 +2,10 @@
 ASGI config for library_management project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Run it under an ASGI server (e.g. ``uvicorn library_management.asgi:application``)
+to serve the async views (search, book detail, PDF downloads, dashboard)
+on the event loop. ``manage.py benchmark --compare-servers`` compares it
+with the WSGI application.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -0,0 +1,406 @@
+"""
+Request benchmarks.
+
+``run_benchmark`` sends requests to the main pages through the Django test
+client from ``concurrency`` threads at once. Each thread has its own
+client and database connection. For every URL name it records
+throughput, latency percentiles and the number of queries per request.
+No web server is involved, so the numbers cover Django and the database
+only. ``compare`` checks a run against a stored baseline. Query counts
+should not change between runs, so any increase counts as a regression.
+Latency and throughput only count as regressions when they move by more
+than ``tolerance``. Used by ``manage.py benchmark``.
+
+``compare_servers`` measures the deployment instead of the test client.
+It sends the same requests to the project's WSGI application from a pool
+of ``concurrency`` threads, the way a threaded WSGI server would. It
+then sends them to the ASGI application as ``concurrency`` concurrent
+tasks on one event loop. Requests are built by hand and authenticated
+with a session cookie, so no server or HTTP parsing is timed. Query
+counts are not recorded here; the queries run on the handlers' own
+threads.
+
+``run_registration_benchmark`` grows the student table in steps and
+times single registrations at each size (``manage.py
+benchmark_registration``). Everything it writes is rolled back.
+"""
+import asyncio
+import io
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .profiling import percentile
+
+# URL name -> (who requests it, query string).
+TARGETS = {
+    'books:list': ('student', ''),
+    'books:search': ('student', 'q=history'),
+    'books:detail': ('student', ''),
+    'books:my_requests': ('student', ''),
+    'books:requests': ('admin', ''),
+    'dashboard': ('student', ''),
+    'transactions:my_transactions': ('student', ''),
+    'transactions:list': ('admin', ''),
+    'transactions:fines': ('admin', ''),
+}
+
+# The pages with async views, compared by ``compare_servers``.
+ASYNC_TARGETS = ('books:search', 'books:detail', 'dashboard')
+
+
+def benchmark_host():
+    """A host name the project accepts; ``testserver`` is only allowed under the test runner."""
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def pick_subjects():
+    """The busiest student, an admin and the most requested book, so pages have data on them."""
+    from accounts.models import User
+    from books.models import Book
+
+    student = (
+        User.objects.filter(user_type='student')
+        .annotate(n=Count('bookrequest')).order_by('-n', 'pk').first()
+    )
+    admin = User.objects.filter(user_type='admin').order_by('pk').first()
+    book = Book.objects.annotate(n=Count('bookrequest')).order_by('-n', 'pk').first()
+    if not (student and admin and book):
+        raise ValueError('Benchmarks need at least one student, one admin and one book; '
+                         'run seed_library first.')
+    return {'student': student, 'admin': admin}, book
+
+
+def target_url(name, book, query):
+    url = reverse(name, args=[book.pk]) if name == 'books:detail' else reverse(name)
+    return f'{url}?{query}' if query else url
+
+
+class Worker(threading.local):
+    """Per-thread test clients, one logged in as each role."""
+
+    def clients(self, users):
+        if not hasattr(self, 'by_role'):
+            self.by_role = {}
+            for role, user in users.items():
+                client = Client(HTTP_HOST=benchmark_host())
+                client.force_login(user)
+                self.by_role[role] = client
+        return self.by_role
+
+
+def timed_get(worker, users, role, url):
+    client = worker.clients(users)[role]
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        response = client.get(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        elapsed = time.perf_counter() - started
+    return elapsed, len(queries), response.status_code
+
+
+def summarize(url, samples, wall):
+    """Throughput and latency percentiles for ``(elapsed, status)`` samples."""
+    latencies = sorted(elapsed * 1000 for elapsed, status in samples)
+    return {
+        'url': url,
+        'requests': len(samples),
+        'errors': sum(1 for _, status in samples if status >= 400),
+        'throughput_rps': len(samples) / wall if wall else 0.0,
+        'mean_ms': sum(latencies) / len(latencies),
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+    }
+
+
+def run_target(pool, worker, users, role, url, requests):
+    started = time.perf_counter()
+    if pool is None:
+        samples = [timed_get(worker, users, role, url) for _ in range(requests)]
+    else:
+        samples = list(pool.map(lambda _: timed_get(worker, users, role, url), range(requests)))
+    wall = time.perf_counter() - started
+
+    queries = sorted(count for _, count, _ in samples)
+    result = summarize(url, [(elapsed, status) for elapsed, _, status in samples], wall)
+    result.update(queries=percentile(queries, 0.50), queries_max=queries[-1])
+    return result
+
+
+def run_benchmark(targets=None, requests=50, concurrency=4, warmup=5, progress=None):
+    """Benchmark ``targets`` (URL names, default ``TARGETS``) and return the results as a dict."""
+    progress = progress or (lambda message: None)
+    users, book = pick_subjects()
+    worker = Worker()
+    # With one thread, run inline on this thread's connection.
+    pool = ThreadPoolExecutor(max_workers=concurrency) if concurrency > 1 else None
+    results = {}
+    try:
+        for name in targets or TARGETS:
+            role, query = TARGETS[name]
+            url = target_url(name, book, query)
+            for _ in range(warmup):
+                timed_get(worker, users, role, url)
+            results[name] = run_target(pool, worker, users, role, url, requests)
+            progress(f"  {name}: {results[name]['throughput_rps']:.1f} req/s, "
+                     f"p95 {results[name]['p95_ms']:.1f} ms, {results[name]['queries']} queries")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return {
+        'created_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'requests': requests,
+        'concurrency': concurrency,
+        'targets': results,
+    }
+
+
+def compare(results, baseline, tolerance=0.25):
+    """Return a message for every target that regressed against ``baseline``."""
+    regressions = []
+    for name, current in results['targets'].items():
+        before = baseline.get('targets', {}).get(name)
+        if before is None:
+            continue
+        if current['queries'] > before['queries']:
+            regressions.append(f"{name}: {current['queries']} queries per request, "
+                               f"was {before['queries']}")
+        if current['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']:.1f} ms, was {before['p95_ms']:.1f} ms")
+        if current['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: {current['throughput_rps']:.1f} req/s, "
+                               f"was {before['throughput_rps']:.1f} req/s")
+        if current['errors'] > before['errors']:
+            regressions.append(f"{name}: {current['errors']} error responses, was {before['errors']}")
+    return regressions
+
+
+def session_cookies(users):
+    """A ``Cookie`` header per role, for requests that don't go through the test client."""
+    cookies = {}
+    for role, user in users.items():
+        client = Client()
+        client.force_login(user)
+        cookies[role] = '; '.join(f'{name}={morsel.value}' for name, morsel in client.cookies.items())
+    return cookies
+
+
+def wsgi_get(app, url, cookie):
+    path, _, query = url.partition('?')
+    host = benchmark_host()
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'SERVER_NAME': host,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_HOST': host,
+        'HTTP_COOKIE': cookie,
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    status = []
+
+    def start_response(line, headers, exc_info=None):
+        status.append(int(line.split(' ', 1)[0]))
+
+    started = time.perf_counter()
+    body = app(environ, start_response)
+    try:
+        for _ in body:
+            pass
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return time.perf_counter() - started, status[0]
+
+
+async def asgi_get(app, url, cookie):
+    path, _, query = url.partition('?')
+    host = benchmark_host()
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': [(b'host', host.encode()), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': (host, 80),
+    }
+    done = asyncio.Event()
+    received = False
+    status = []
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Django listens for a disconnect while the view runs; the client stays.
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    started = time.perf_counter()
+    try:
+        await app(scope, receive, send)
+    finally:
+        done.set()
+    return time.perf_counter() - started, status[0]
+
+
+def run_wsgi(urls, requests, concurrency, warmup, progress):
+    app = get_wsgi_application()
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for name, (cookie, url) in urls.items():
+            for _ in range(warmup):
+                wsgi_get(app, url, cookie)
+            started = time.perf_counter()
+            samples = list(pool.map(lambda _: wsgi_get(app, url, cookie), range(requests)))
+            results[name] = summarize(url, samples, time.perf_counter() - started)
+            progress(f"  wsgi {name}: {results[name]['throughput_rps']:.1f} req/s, "
+                     f"p95 {results[name]['p95_ms']:.1f} ms")
+    return results
+
+
+async def run_asgi(urls, requests, concurrency, warmup, progress):
+    app = get_asgi_application()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def client(url, cookie):
+        async with slots:
+            return await asgi_get(app, url, cookie)
+
+    results = {}
+    for name, (cookie, url) in urls.items():
+        for _ in range(warmup):
+            await asgi_get(app, url, cookie)
+        started = time.perf_counter()
+        samples = await asyncio.gather(*(client(url, cookie) for _ in range(requests)))
+        results[name] = summarize(url, samples, time.perf_counter() - started)
+        progress(f"  asgi {name}: {results[name]['throughput_rps']:.1f} req/s, "
+                 f"p95 {results[name]['p95_ms']:.1f} ms")
+    return results
+
+
+def compare_servers(targets=None, requests=2000, concurrency=1000, warmup=5, progress=None):
+    """
+    Benchmark ``targets`` (default ``ASYNC_TARGETS``) under WSGI and then
+    ASGI with ``concurrency`` clients. ``speedup`` is ASGI throughput over
+    WSGI throughput per URL name.
+    """
+    progress = progress or (lambda message: None)
+    users, book = pick_subjects()
+    cookies = session_cookies(users)
+    urls = {}
+    for name in targets or ASYNC_TARGETS:
+        role, query = TARGETS[name]
+        urls[name] = cookies[role], target_url(name, book, query)
+
+    wsgi = run_wsgi(urls, requests, concurrency, warmup, progress)
+    asgi = asyncio.run(run_asgi(urls, requests, concurrency, warmup, progress))
+    return {
+        'created_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'requests': requests,
+        'concurrency': concurrency,
+        'servers': {'wsgi': wsgi, 'asgi': asgi},
+        'speedup': {
+            name: asgi[name]['throughput_rps'] / wsgi[name]['throughput_rps']
+            if wsgi[name]['throughput_rps'] else None
+            for name in urls
+        },
+    }
+
+
+def run_registration_benchmark(students=500000, steps=5, sample=200, batch_size=5000, progress=None):
+    """
+    Grow the student table to ``students`` in ``steps`` equal steps. After
+    each, time ``sample`` single registrations (``User.save`` of a new
+    student; password hashing left out). All rows are rolled back.
+    """
+    from accounts.models import User
+
+    progress = progress or (lambda message: None)
+    password = make_password(None)
+    executed = 0
+
+    def count_queries(execute, sql, params, many, context):
+        # CaptureQueriesContext's log is capped and would miscount a long run.
+        nonlocal executed
+        executed += 1
+        return execute(sql, params, many, context)
+
+    results = []
+    with transaction.atomic():
+        filled = User.objects.filter(user_type='student').count()
+        added = 0
+        for step in range(1, steps + 1):
+            target = students * step // steps
+            while filled < target:
+                size = min(batch_size, target - filled)
+                User.objects.bulk_create([
+                    User(username=f'bench-filler-{n}', mobile_number=f'+1{n:011d}', password=password,
+                         full_name=f'Filler {n}', user_type='student')
+                    for n in range(added, added + size)
+                ])
+                filled += size
+                added += size
+
+            latencies, queries = [], []
+            for n in range(sample):
+                user = User(username=f'bench-student-{step}-{n}', mobile_number=f'+2{step:03d}{n:08d}',
+                            password=password, full_name=f'Student {n}', user_type='student')
+                executed = 0
+                with connection.execute_wrapper(count_queries):
+                    started = time.perf_counter()
+                    user.save()
+                    latencies.append((time.perf_counter() - started) * 1000)
+                queries.append(executed)
+            filled += sample
+            latencies.sort()
+            results.append({
+                'students': filled,
+                'mean_ms': sum(latencies) / len(latencies),
+                'p95_ms': percentile(latencies, 0.95),
+                'queries': max(queries),
+            })
+            progress(f"  {filled} students: {results[-1]['mean_ms']:.2f} ms mean, "
+                     f"p95 {results[-1]['p95_ms']:.2f} ms, {results[-1]['queries']} queries per registration")
+        transaction.set_rollback(True)
+    return results
@@ -0,0 +1,101 @@
+"""
+Database profiles read from the environment.
+
+``DATABASE_ENGINE`` picks the profile: ``sqlite`` (the default) or
+``postgresql``. Both profiles keep connections open between requests.
+
+The SQLite profile sets ``synchronous=NORMAL``, memory-mapped reads, and
+a busy timeout so concurrent writers wait instead of failing with
+"database is locked". Write transactions start ``IMMEDIATE``: they take
+the write lock up front, so two approvals never deadlock upgrading from
+a read lock. ``SQLITE_JOURNAL_MODE=WAL`` turns on WAL journaling, so
+readers don't block the writer; use it in deployments. The journal mode
+is stored in the database file itself, so it is left alone by default and
+commands run against the checked-in development database don't rewrite
+it.
+
+The PostgreSQL profile uses persistent connections with health checks.
+With ``DATABASE_POOL_MAX_SIZE`` set, it uses psycopg's built-in pool
+instead (needs ``psycopg[pool]``). Setting ``DATABASE_REPLICA_HOST`` adds
+a ``replica`` alias, used by ``routers.ReplicaRouter``.
+
+Variables:
+    DATABASE_ENGINE, DATABASE_NAME, DATABASE_USER, DATABASE_PASSWORD,
+    DATABASE_HOST, DATABASE_PORT, DATABASE_CONN_MAX_AGE,
+    DATABASE_POOL_MIN_SIZE, DATABASE_POOL_MAX_SIZE, DATABASE_REPLICA_HOST,
+    DATABASE_REPLICA_PORT, SQLITE_BUSY_TIMEOUT, SQLITE_JOURNAL_MODE,
+    SQLITE_MMAP_SIZE
+"""
+import os
+
+SQLITE_PRAGMAS = (
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA mmap_size={mmap_size}',
+    'PRAGMA temp_store=MEMORY',
+)
+
+
+def sqlite_profile(env, base_dir):
+    mmap_size = int(env.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    pragmas = list(SQLITE_PRAGMAS)
+    journal_mode = env.get('SQLITE_JOURNAL_MODE', '').strip()
+    if journal_mode:
+        if not journal_mode.isalpha():
+            raise ValueError(f'Invalid SQLITE_JOURNAL_MODE {journal_mode!r}.')
+        pragmas.insert(0, f'PRAGMA journal_mode={journal_mode}')
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': env.get('DATABASE_NAME') or base_dir / 'db.sqlite3',
+        'CONN_MAX_AGE': int(env.get('DATABASE_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': ';'.join(pragmas).format(mmap_size=mmap_size),
+            # Seconds to wait on a locked database; sqlite3 sets busy_timeout from it.
+            'timeout': float(env.get('SQLITE_BUSY_TIMEOUT', 20)),
+            'transaction_mode': 'IMMEDIATE',
+        },
+    }
+
+
+def postgresql_profile(env):
+    database = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': env.get('DATABASE_NAME', 'library_management'),
+        'USER': env.get('DATABASE_USER', ''),
+        'PASSWORD': env.get('DATABASE_PASSWORD', ''),
+        'HOST': env.get('DATABASE_HOST', ''),
+        'PORT': env.get('DATABASE_PORT', ''),
+        'CONN_MAX_AGE': int(env.get('DATABASE_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
+    }
+    if env.get('DATABASE_POOL_MAX_SIZE'):
+        # The pool owns connection lifetimes; Django refuses CONN_MAX_AGE alongside it.
+        database['CONN_MAX_AGE'] = 0
+        database['OPTIONS']['pool'] = {
+            'min_size': int(env.get('DATABASE_POOL_MIN_SIZE', 2)),
+            'max_size': int(env['DATABASE_POOL_MAX_SIZE']),
+            'timeout': 10,
+        }
+    return database
+
+
+def database_config(base_dir, env=os.environ):
+    """Build ``DATABASES`` for the profile selected by the environment."""
+    engine = env.get('DATABASE_ENGINE', 'sqlite')
+    if engine == 'sqlite':
+        default = sqlite_profile(env, base_dir)
+    elif engine == 'postgresql':
+        default = postgresql_profile(env)
+    else:
+        raise ValueError(f"DATABASE_ENGINE must be 'sqlite' or 'postgresql', not {engine!r}.")
+
+    databases = {'default': default}
+    if engine == 'postgresql' and env.get('DATABASE_REPLICA_HOST'):
+        replica = {**default, 'OPTIONS': dict(default['OPTIONS'])}
+        replica['HOST'] = env['DATABASE_REPLICA_HOST']
+        replica['PORT'] = env.get('DATABASE_REPLICA_PORT', default.get('PORT', ''))
+        # Tests read the replica through the default connection.
+        replica['TEST'] = {'MIRROR': 'default'}
+        databases['replica'] = replica
+    return databases
@@ -0,0 +1,177 @@
+"""
+Opt-in request profiling.
+
+``ProfilingMiddleware`` samples a fraction of requests (``PROFILING_SAMPLE_RATE``)
+and records, per request, the URL name, wall time, query count, time spent
+in the database and any SQL statement that ran more than once. Records go
+into an in-process ring buffer of ``PROFILING_BUFFER_SIZE`` entries, so
+memory is bounded and nothing is written anywhere. A statement repeated
+``PROFILING_N_PLUS_ONE_THRESHOLD`` times or more in one request is flagged
+as a likely N+1 query and logged.
+
+The middleware removes itself unless ``PROFILING_ENABLED`` is set.
+``ProfilingReportView`` shows p50/p95/p99 per URL name for the process
+that serves it.
+"""
+import logging
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.views.generic import TemplateView
+
+logger = logging.getLogger(__name__)
+
+IN_LIST_RE = re.compile(r'IN \((?:%s|\?)(?:, (?:%s|\?))*\)')
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def fingerprint(sql):
+    """Reduce a statement to its shape: literals and IN lists collapsed."""
+    return LITERAL_RE.sub('?', IN_LIST_RE.sub('IN (...)', sql))
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class ProfileStore:
+    """A thread-safe ring buffer of request profiles."""
+
+    def __init__(self, size):
+        self.records = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        with self.lock:
+            self.records.append(record)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.records)
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+
+    def summary(self):
+        """Per-URL-name statistics, slowest p95 first."""
+        by_view = {}
+        for record in self.snapshot():
+            by_view.setdefault(record['view'], []).append(record)
+
+        rows = []
+        for view, records in by_view.items():
+            wall = sorted(record['wall_ms'] for record in records)
+            queries = sorted(record['queries'] for record in records)
+            n_plus_one = Counter()
+            for record in records:
+                for sql, count in record['n_plus_one']:
+                    n_plus_one[sql] = max(n_plus_one[sql], count)
+            rows.append({
+                'view': view,
+                'requests': len(records),
+                'p50_ms': percentile(wall, 0.50),
+                'p95_ms': percentile(wall, 0.95),
+                'p99_ms': percentile(wall, 0.99),
+                'queries_p50': percentile(queries, 0.50),
+                'queries_max': queries[-1],
+                'db_ms_avg': sum(record['db_ms'] for record in records) / len(records),
+                'duplicate_queries_avg': sum(record['duplicates'] for record in records) / len(records),
+                'n_plus_one': n_plus_one.most_common(),
+            })
+        rows.sort(key=lambda row: row['p95_ms'], reverse=True)
+        return rows
+
+
+store = ProfileStore(getattr(settings, 'PROFILING_BUFFER_SIZE', 5000))
+
+
+class QueryCollector:
+    """A ``connection.execute_wrapper`` that times and fingerprints queries."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+
+class ProfilingMiddleware:
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.1)
+        self.threshold = getattr(settings, 'PROFILING_N_PLUS_ONE_THRESHOLD', 5)
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        collector = QueryCollector()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(collector))
+            response = self.get_response(request)
+        wall = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        repeated = [(sql, count) for sql, count in collector.fingerprints.most_common() if count > 1]
+        n_plus_one = [(sql, count) for sql, count in repeated if count >= self.threshold]
+        for sql, count in n_plus_one:
+            logger.warning('Possible N+1 in %s: %d x %s', view, count, sql)
+        store.add({
+            'view': view,
+            'method': request.method,
+            'status': response.status_code,
+            'wall_ms': wall * 1000,
+            'queries': collector.count,
+            'db_ms': collector.duration * 1000,
+            'duplicates': sum(count - 1 for _, count in repeated),
+            'n_plus_one': n_plus_one,
+        })
+        return response
+
+
+class ProfilingReportView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    template_name = 'profiling/report.html'
+
+    def test_func(self):
+        return self.request.user.user_type == 'admin'
+
+    def post(self, request):
+        store.clear()
+        return self.get(request)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update({
+            'enabled': getattr(settings, 'PROFILING_ENABLED', False),
+            'sample_rate': getattr(settings, 'PROFILING_SAMPLE_RATE', 0.1),
+            'sampled': len(store.records),
+            'rows': store.summary(),
+        })
+        return context
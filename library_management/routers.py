@@ -0,0 +1,84 @@
+"""
+Read-replica routing.
+
+``ReplicaRoutingMiddleware`` marks GET and HEAD requests handled by a
+``ListView`` as safe to read from the ``replica`` database. While a
+request is marked, ``ReplicaRouter`` sends its reads to the replica and
+its writes to the primary. Three things send reads back to the primary
+for the rest of the request: any write, an open transaction, or a
+session flagged by ``pin_to_primary``. The last one lets a user who just
+changed something see the change even when the replica lags. Everything
+else reads and writes the primary. Without a ``replica`` database the
+middleware removes itself and the router sends everything to the
+primary.
+"""
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.views.generic import ListView
+
+REPLICA = 'replica'
+
+# Seconds after a write during which the writer's reads stay on the primary.
+PIN_SECONDS = 5
+PIN_SESSION_KEY = '_db_primary_until'
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+def pin_to_primary(request):
+    request.session[PIN_SESSION_KEY] = time.time() + PIN_SECONDS
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if not _use_replica.get() or connections['default'].in_atomic_block:
+            return 'default'
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        # Read your own writes for the rest of the request.
+        _use_replica.set(False)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
+
+
+class ReplicaRoutingMiddleware:
+
+    def __init__(self, get_response):
+        if not replica_configured():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _use_replica.set(False)
+        try:
+            response = self.get_response(request)
+        finally:
+            _use_replica.reset(token)
+        if request.method not in ('GET', 'HEAD') and request.user.is_authenticated:
+            pin_to_primary(request)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None)
+        if (
+            request.method in ('GET', 'HEAD')
+            and view_class is not None and issubclass(view_class, ListView)
+            and request.session.get(PIN_SESSION_KEY, 0) < time.time()
+        ):
+            _use_replica.set(True)
@@ -5,6 +5,8 @@ Django settings for library_management project.
 from pathlib import Path
 import os
 
+from .database import database_config
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -29,6 +31,7 @@ INSTALLED_APPS = [
     'accounts',
     'books',
     'transactions',
+    'api',
 ]
 
 MIDDLEWARE = [
@@ -36,9 +39,14 @@ MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # AuthenticationMiddleware with the signed-in user cached (USER_CACHE).
+    'accounts.middleware.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Removes itself unless a replica database is configured.
+    'library_management.routers.ReplicaRoutingMiddleware',
+    # Removes itself unless PROFILING_ENABLED is set.
+    'library_management.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'library_management.urls'
@@ -61,13 +69,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'library_management.wsgi.application'
 
-# Database
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
-}
+# Database: profile chosen by DATABASE_ENGINE and friends, see database.py.
+DATABASES = database_config(BASE_DIR)
+DATABASE_ROUTERS = ['library_management.routers.ReplicaRouter']
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -100,6 +104,8 @@ STATICFILES_DIRS = [
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Book PDFs, served only by BookPDFView; never expose this directory directly.
+PROTECTED_MEDIA_ROOT = BASE_DIR / 'protected_media'
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -108,6 +114,92 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap4"
 CRISPY_TEMPLATE_PACK = "bootstrap4"
 
+# Book search
+BOOK_SEARCH_MAX_RESULTS = 1000
+
+# Use cursor (keyset) pagination instead of page numbers for the
+# transaction and fine ledgers.
+LEDGER_KEYSET_PAGINATION = False
+
+# Overdue fines (manage.py assess_fines)
+FINE_RATE_PER_DAY = '0.50'
+FINE_MAX_AMOUNT = '20.00'
+FINE_GRACE_DAYS = 0
+
+# Threads generating cover thumbnails after uploads (0 = inline).
+COVER_THUMBNAIL_WORKERS = 2
+
+# Leave PDF downloads to the front proxy: 'X-Accel-Redirect' (nginx) or
+# 'X-Sendfile' (Apache/lighttpd). For nginx, PDF_ACCEL_REDIRECT_PREFIX must
+# be an internal location aliased to PROTECTED_MEDIA_ROOT, so only
+# responses from BookPDFView can reach the files:
+#
+#     location /protected-media/ {
+#         internal;
+#         alias /srv/library/protected_media/;
+#     }
+PDF_SENDFILE_HEADER = None
+PDF_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# Request profiling (report at /profiling/). Records wall time, query count,
+# DB time and repeated queries for a sample of requests.
+PROFILING_ENABLED = False
+PROFILING_SAMPLE_RATE = 0.1
+PROFILING_BUFFER_SIZE = 5000
+# A statement repeated this many times in one request is flagged as N+1.
+PROFILING_N_PLUS_ONE_THRESHOLD = 5
+
+# Caches. 'fragments' holds pre-rendered book cards and detail pages
+# (books.fragments); with several server processes use a shared backend,
+# e.g. 'django.core.cache.backends.redis.RedisCache' or FileBasedCache, so
+# invalidation reaches all of them. Set BOOK_FRAGMENT_CACHE = None to
+# disable fragment caching.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'book-fragments',
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+BOOK_FRAGMENT_CACHE = 'fragments'
+
+# Let signed-out visitors (e.g. kiosks) browse the catalogue pages, and let a
+# shared proxy cache those signed-out pages for this many seconds (0 = don't).
+CATALOGUE_PUBLIC = False
+CATALOGUE_SHARED_MAX_AGE = 0
+
+# Sessions. 'cached_db' reads sessions from the default cache and writes
+# them through to the database. 'signed_cookies' keeps them in the
+# client's cookie, with no server-side storage; a copied cookie then stays
+# valid until it expires, even after logout. 'db' reads the database on
+# every request.
+#
+# Keep signed-in users in USER_CACHE for USER_CACHE_TIMEOUT seconds instead
+# of loading the row on every request (accounts.middleware). None disables.
+#
+# Both need a cache every server process shares (Redis, Memcached, or
+# FileBasedCache on a single host). LocMemCache is private to a process, so
+# a logout or deactivation would only reach the process that handled it;
+# while the default cache is LocMemCache, sessions use 'db' and the user
+# cache is off.
+SHARED_DEFAULT_CACHE = CACHES['default']['BACKEND'] != 'django.core.cache.backends.locmem.LocMemCache'
+SESSION_ENGINE = 'django.contrib.sessions.backends.' + ('cached_db' if SHARED_DEFAULT_CACHE else 'db')
+USER_CACHE = 'default' if SHARED_DEFAULT_CACHE else None
+USER_CACHE_TIMEOUT = 60
+
+# "Borrowed together" lists (manage.py build_recommendations): neighbours
+# kept per book, and the fewest students two books must share to be listed.
+RECOMMENDATIONS_PER_BOOK = 5
+RECOMMENDATION_MIN_BORROWERS = 2
+
+# Days before the last circulation rollup's final day that the next run
+# (manage.py rollup_circulation) rebuilds, to pick up late corrections.
+ROLLUP_LOOKBACK_DAYS = 1
+
 # Login/Logout URLs
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
@@ -0,0 +1,236 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import resolve, reverse
+
+from books.models import Book, BookRequest, Category
+from books.search import get_backend
+from books.tests import make_admin, make_book, make_student
+from books.views import BookDetailView, BookListView
+from . import benchmark, profiling, routers
+from .database import database_config
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0, PROFILING_N_PLUS_ONE_THRESHOLD=5)
+class ProfilingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        category = Category.objects.create(name='Reference')
+        for i in range(6):
+            make_book(category, cls.admin, title=f'Book {i}', isbn=f'{i:013d}')
+
+    def setUp(self):
+        profiling.store.clear()
+        self.addCleanup(profiling.store.clear)
+
+    def profile(self, view):
+        request = RequestFactory().get(reverse('books:list'))
+        request.resolver_match = resolve(reverse('books:list'))
+        return profiling.ProfilingMiddleware(view)(request)
+
+    def test_flags_repeated_queries_as_n_plus_one(self):
+        def n_plus_one(request):
+            for book in Book.objects.all():
+                book.category.name
+            return HttpResponse()
+
+        with self.assertLogs('library_management.profiling', 'WARNING'):
+            self.profile(n_plus_one)
+        [record] = profiling.store.snapshot()
+        self.assertEqual(record['view'], 'books:list')
+        self.assertEqual(record['queries'], 7)
+        self.assertEqual(record['duplicates'], 5)
+        [(sql, count)] = record['n_plus_one']
+        self.assertEqual(count, 6)
+        self.assertIn('"books_category"', sql)
+
+    def test_summary_percentiles(self):
+        for wall in range(1, 101):
+            profiling.store.add({
+                'view': 'books:search', 'method': 'GET', 'status': 200, 'wall_ms': float(wall),
+                'queries': 4, 'db_ms': 1.0, 'duplicates': 0, 'n_plus_one': [],
+            })
+        [row] = profiling.store.summary()
+        self.assertEqual((row['p50_ms'], row['p95_ms'], row['p99_ms']), (50.0, 95.0, 99.0))
+        self.assertEqual(row['requests'], 100)
+
+    def test_requests_are_sampled_and_reported(self):
+        self.client.force_login(self.admin)
+        self.client.get(reverse('books:list'))
+        response = self.client.get(reverse('profiling_report'))
+        self.assertContains(response, '<code>books:list</code>')
+        self.assertNotContains(response, 'N+1</span>')
+
+    @override_settings(PROFILING_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_are_not_recorded(self):
+        self.client.force_login(self.admin)
+        self.client.get(reverse('books:list'))
+        self.assertEqual(profiling.store.snapshot(), [])
+
+    def test_fingerprint_collapses_literals_and_in_lists(self):
+        self.assertEqual(
+            profiling.fingerprint("SELECT * FROM t WHERE a = 5 AND b = 'x' AND c IN (%s, %s, %s)"),
+            "SELECT * FROM t WHERE a = ? AND b = ? AND c IN (...)",
+        )
+
+
+class BenchmarkTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        cls.student = make_student()
+        book = make_book(Category.objects.create(name='History'), cls.admin, title='A history')
+        BookRequest.objects.create(student=cls.student, book=book)
+
+    def test_run_records_every_target(self):
+        results = benchmark.run_benchmark(requests=3, concurrency=1, warmup=0)
+        self.assertEqual(set(results['targets']), set(benchmark.TARGETS))
+        for name, target in results['targets'].items():
+            self.assertEqual(target['errors'], 0, name)
+            self.assertGreater(target['queries'], 0)
+            self.assertLessEqual(target['p50_ms'], target['p99_ms'])
+
+    def test_compare_flags_regressions(self):
+        before = {'targets': {'books:list': {
+            'queries': 4, 'p95_ms': 10.0, 'throughput_rps': 100.0, 'errors': 0,
+        }}}
+        same = {'targets': {'books:list': dict(before['targets']['books:list'], p95_ms=12.0)}}
+        self.assertEqual(benchmark.compare(same, before), [])
+        worse = {'targets': {'books:list': {
+            'queries': 5, 'p95_ms': 20.0, 'throughput_rps': 50.0, 'errors': 0,
+        }}}
+        self.assertEqual(len(benchmark.compare(worse, before)), 3)
+
+    def test_command_fails_on_regression(self):
+        baseline = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+        self.addCleanup(os.remove, baseline.name)
+        with baseline:
+            json.dump({'targets': {'books:list': {
+                'queries': 1, 'p95_ms': 1000.0, 'throughput_rps': 0.0, 'errors': 0,
+            }}}, baseline)
+        with self.assertRaisesMessage(CommandError, '1 regression(s)'):
+            call_command('benchmark', 'books:list', requests=2, concurrency=1, warmup=0,
+                         baseline=baseline.name, stdout=StringIO(), stderr=StringIO())
+
+
+class ServerBenchmarkTests(TransactionTestCase):
+
+    def setUp(self):
+        admin = make_admin()
+        student = make_student()
+        book = make_book(Category.objects.create(name='History'), admin, title='A history')
+        BookRequest.objects.create(student=student, book=book)
+        # Flushing the tables leaves the search index behind.
+        self.addCleanup(get_backend().clear)
+
+    def test_compare_servers(self):
+        # Warm up so cold dashboard counters are seeded (under a write lock) before the
+        # concurrent run; the in-memory test database fails lock waits instead of blocking.
+        results = benchmark.compare_servers(requests=4, concurrency=4, warmup=1)
+        for server in ('wsgi', 'asgi'):
+            self.assertEqual(set(results['servers'][server]), set(benchmark.ASYNC_TARGETS))
+            for name, target in results['servers'][server].items():
+                self.assertEqual(target['errors'], 0, f'{server} {name}')
+        self.assertEqual(set(results['speedup']), set(benchmark.ASYNC_TARGETS))
+
+
+class DatabaseProfileTests(TestCase):
+
+    def test_sqlite_profile_is_the_default(self):
+        default = database_config(Path('/srv'), env={})['default']
+        self.assertEqual(default['NAME'], Path('/srv/db.sqlite3'))
+        # The journal mode is written into the file, so it is opt-in.
+        self.assertNotIn('journal_mode', default['OPTIONS']['init_command'])
+        self.assertEqual(default['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertGreater(default['CONN_MAX_AGE'], 0)
+
+    def test_wal_is_opt_in(self):
+        default = database_config(Path('/srv'), env={'SQLITE_JOURNAL_MODE': 'WAL'})['default']
+        self.assertTrue(default['OPTIONS']['init_command'].startswith('PRAGMA journal_mode=WAL;'))
+        with self.assertRaises(ValueError):
+            database_config(Path('/srv'), env={'SQLITE_JOURNAL_MODE': 'WAL; DROP'})
+
+    def test_sqlite_pragmas_are_applied_on_connect(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only.')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+
+    def test_postgresql_pool_and_replica(self):
+        databases = database_config(Path('/srv'), env={
+            'DATABASE_ENGINE': 'postgresql', 'DATABASE_HOST': 'primary',
+            'DATABASE_POOL_MAX_SIZE': '20', 'DATABASE_REPLICA_HOST': 'replica.internal',
+        })
+        self.assertEqual(databases['default']['OPTIONS']['pool']['max_size'], 20)
+        self.assertEqual(databases['default']['CONN_MAX_AGE'], 0)
+        self.assertTrue(databases['default']['CONN_HEALTH_CHECKS'])
+        self.assertEqual(databases['replica']['HOST'], 'replica.internal')
+        self.assertEqual(databases['replica']['TEST'], {'MIRROR': 'default'})
+        self.assertNotIn('TEST', databases['default'])
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            database_config(Path('/srv'), env={'DATABASE_ENGINE': 'oracle'})
+
+
+class ReplicaRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        self.seen = []
+
+    def handle(self, view_class, method='get', user=None):
+        def get_response(request):
+            middleware.process_view(request, view_class.as_view(), (), {})
+            self.seen.append(self.router.db_for_read(Book))
+            self.router.db_for_write(Book)
+            self.seen.append(self.router.db_for_read(Book))
+            return HttpResponse()
+
+        with mock.patch.object(routers, 'replica_configured', return_value=True):
+            middleware = routers.ReplicaRoutingMiddleware(get_response)
+        request = getattr(RequestFactory(), method)('/')
+        request.session = SessionStore()
+        request.user = user or AnonymousUser()
+        middleware(request)
+        return request
+
+    def test_list_reads_go_to_replica_until_a_write(self):
+        self.handle(BookListView)
+        self.assertEqual(self.seen, ['replica', 'default'])
+        self.assertEqual(self.router.db_for_read(Book), 'default')
+
+    def test_other_views_and_methods_use_primary(self):
+        self.handle(BookDetailView)
+        self.handle(BookListView, method='post')
+        self.assertEqual(self.seen, ['default'] * 4)
+
+    def test_writer_is_pinned_to_primary(self):
+        user = mock.Mock(is_authenticated=True)
+        request = self.handle(BookListView, method='post', user=user)
+        self.assertIn(routers.PIN_SESSION_KEY, request.session)
+
+    def test_middleware_unused_without_replica(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            routers.ReplicaRoutingMiddleware(lambda request: HttpResponse())
+
+    def test_replica_is_never_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica', 'books'))
+        self.assertTrue(self.router.allow_migrate('default', 'books'))
@@ -6,6 +6,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.views.generic import TemplateView
+from .profiling import ProfilingReportView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -13,6 +14,8 @@ urlpatterns = [
     path('accounts/', include('accounts.urls')),
     path('books/', include('books.urls')),
     path('transactions/', include('transactions.urls')),
+    path('api/v1/', include('api.urls')),
+    path('profiling/', ProfilingReportView.as_view(), name='profiling_report'),
 ]
 
 if settings.DEBUG:
@@ -21,6 +21,16 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
 
+    // "Select all" checkboxes for bulk actions
+    document.querySelectorAll('[data-select-all]').forEach(function(toggle) {
+        toggle.addEventListener('change', function() {
+            const name = this.getAttribute('data-select-all');
+            document.querySelectorAll('input[type="checkbox"][name="' + name + '"]').forEach(function(box) {
+                box.checked = toggle.checked;
+            });
+        });
+    });
+
     // Search functionality
     const searchInput = document.getElementById('searchInput');
     if (searchInput) {
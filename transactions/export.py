@@ -0,0 +1,153 @@
+"""
+Streaming ledger exports.
+
+Rows are read with ``values_list(...).iterator()`` in primary-key order and
+written straight out as CSV or JSON, a chunk at a time, so no model
+instances are built and memory stays flat however large the ledger is.
+Used by ``ExportView`` and ``manage.py export_ledger``.
+"""
+import csv
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Fine, Transaction
+
+CHUNK_SIZE = 2000
+
+FORMATS = ('csv', 'json')
+
+EXPORTS = {
+    'transactions': {
+        'model': Transaction,
+        'date_field': 'transaction_date',
+        'columns': (
+            ('id', 'pk'),
+            ('date', 'transaction_date'),
+            ('type', 'transaction_type'),
+            ('student', 'student__username'),
+            ('student_id', 'student__student_id'),
+            ('book_isbn', 'book__isbn'),
+            ('book_title', 'book__title'),
+            ('due_date', 'due_date'),
+            ('return_date', 'return_date'),
+            ('fine_amount', 'fine_amount'),
+            ('processed_by', 'processed_by__username'),
+        ),
+        'types': {value: Q(transaction_type=value) for value, _ in Transaction.TRANSACTION_TYPE_CHOICES},
+    },
+    'fines': {
+        'model': Fine,
+        'date_field': 'created_at',
+        'columns': (
+            ('id', 'pk'),
+            ('date', 'created_at'),
+            ('student', 'student__username'),
+            ('student_id', 'student__student_id'),
+            ('transaction_id', 'transaction_id'),
+            ('book_isbn', 'transaction__book__isbn'),
+            ('amount', 'amount'),
+            ('reason', 'reason'),
+            ('is_paid', 'is_paid'),
+            ('paid_date', 'paid_date'),
+        ),
+        'types': {'paid': Q(is_paid=True), 'unpaid': Q(is_paid=False)},
+    },
+}
+
+
+def parse_day(value, name):
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValueError(f'{name} must be a date in YYYY-MM-DD format.')
+    return day
+
+
+def export_queryset(kind, start=None, end=None, student=None, type=None):
+    """
+    Return ``(header, queryset)`` for one ledger. ``start`` and ``end`` are
+    inclusive ``YYYY-MM-DD`` days, ``student`` a username or student ID.
+    Raises ``ValueError`` for a bad filter.
+    """
+    if kind not in EXPORTS:
+        raise ValueError(f"Unknown export '{kind}'; choose from {', '.join(EXPORTS)}.")
+    spec = EXPORTS[kind]
+    date_field = spec['date_field']
+    queryset = spec['model'].objects.all()
+
+    start = parse_day(start, 'start')
+    end = parse_day(end, 'end')
+    if start:
+        queryset = queryset.filter(**{
+            f'{date_field}__gte': timezone.make_aware(datetime.combine(start, time.min)),
+        })
+    if end:
+        queryset = queryset.filter(**{
+            f'{date_field}__lt': timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)),
+        })
+    if student:
+        queryset = queryset.filter(Q(student__username=student) | Q(student__student_id=student))
+    if type:
+        if type not in spec['types']:
+            raise ValueError(f"Unknown {kind} type '{type}'; choose from {', '.join(spec['types'])}.")
+        queryset = queryset.filter(spec['types'][type])
+
+    header = [name for name, _ in spec['columns']]
+    lookups = [lookup for _, lookup in spec['columns']]
+    return header, queryset.order_by('pk').values_list(*lookups)
+
+
+class Echo:
+    """A file-like object whose ``write`` just returns what it was given."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(header, rows, chunk_size=CHUNK_SIZE):
+    """Yield the export as CSV text, ``chunk_size`` rows per chunk."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    chunk = []
+    for row in rows:
+        chunk.append(writer.writerow(row))
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def render_json(header, rows, chunk_size=CHUNK_SIZE):
+    """Yield the export as a JSON array of objects, ``chunk_size`` rows per chunk."""
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    yield '['
+    chunk = []
+    separator = '\n'
+    for row in rows:
+        chunk.append(separator + encoder.encode(dict(zip(header, row))))
+        separator = ',\n'
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append('\n]\n')
+    yield ''.join(chunk)
+
+
+RENDERERS = {'csv': render_csv, 'json': render_json}
+
+
+def export(kind, format='csv', chunk_size=CHUNK_SIZE, **filters):
+    """Yield the whole export as text chunks. Raises ``ValueError`` for bad arguments."""
+    if format not in RENDERERS:
+        raise ValueError(f"Unknown format '{format}'; choose from {', '.join(FORMATS)}.")
+    header, queryset = export_queryset(kind, **filters)
+    return RENDERERS[format](header, queryset.iterator(chunk_size=chunk_size), chunk_size)
@@ -0,0 +1,145 @@
+"""
+Overdue fine assessment.
+
+Fines are charged per day a loan is past its due date (after
+``FINE_GRACE_DAYS``) at ``FINE_RATE_PER_DAY``, capped at
+``FINE_MAX_AMOUNT``. Each issued loan has at most one overdue ``Fine``,
+which is created or updated in place, so running the assessment twice
+changes nothing.
+
+Runs are checkpointed in ``FineAssessmentRun``. An incremental run only
+looks at loans whose fine can still have changed since the last finished
+run: loans still out and not yet at the cap, and loans returned late since
+the checkpoint. Loans are read in primary-key batches of plain tuples, so
+memory stays flat however many there are.
+"""
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from books.models import BookRequest
+from .models import Fine, FineAssessmentRun, Transaction
+
+
+def fine_policy():
+    rate = Decimal(str(getattr(settings, 'FINE_RATE_PER_DAY', '0.50')))
+    cap = Decimal(str(getattr(settings, 'FINE_MAX_AMOUNT', '20.00')))
+    grace = int(getattr(settings, 'FINE_GRACE_DAYS', 0))
+    return rate, cap, grace
+
+
+def compute_fine(due_date, until, rate, cap, grace):
+    """Fine for a loan due at ``due_date`` and returned (or still out) at ``until``."""
+    days = (until - due_date).days - grace
+    if days <= 0:
+        return Decimal('0.00')
+    return min(rate * days, cap).quantize(Decimal('0.01'))
+
+
+def loans_to_assess(now, checkpoint, rate, cap, grace):
+    """The loans whose fine may have changed since ``checkpoint``."""
+    overdue = Q(status='approved', due_date__lt=now - timedelta(days=grace))
+    returned_late = Q(status='returned', return_date__gt=F('due_date') + timedelta(days=grace))
+
+    if checkpoint is not None:
+        # A loan that had already reached the cap at the last run can't change.
+        if rate > 0:
+            days_to_cap = int(cap / rate) + 1
+            overdue &= Q(due_date__gte=checkpoint - timedelta(days=grace + days_to_cap))
+        returned_late &= Q(return_date__gte=checkpoint)
+    return BookRequest.objects.filter(overdue | returned_late)
+
+
+def assess_overdue_fines(now=None, batch_size=1000, full=False, progress=None):
+    """
+    Create or update overdue fines. Returns a dict of run statistics; calls
+    ``progress(stats)`` after every batch if given.
+    """
+    now = now or timezone.now()
+    rate, cap, grace = fine_policy()
+    last_run = FineAssessmentRun.objects.filter(finished_at__isnull=False).first()
+    checkpoint = None if full or last_run is None else last_run.started_at
+    run = FineAssessmentRun.objects.create(started_at=now, full_scan=checkpoint is None)
+
+    loans = loans_to_assess(now, checkpoint, rate, cap, grace)
+    stats = {'scanned': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'unlinked': 0}
+    started = time.monotonic()
+    last_pk = 0
+
+    while True:
+        batch = list(
+            loans.filter(pk__gt=last_pk)
+            .order_by('pk')
+            .values_list('pk', 'student_id', 'status', 'due_date', 'return_date')[:batch_size]
+        )
+        if not batch:
+            break
+        last_pk = batch[-1][0]
+        with transaction.atomic():
+            assess_batch(batch, now, rate, cap, grace, stats)
+        stats['scanned'] += len(batch)
+        stats['elapsed'] = time.monotonic() - started
+        stats['rate'] = stats['scanned'] / stats['elapsed'] if stats['elapsed'] else 0.0
+        if progress:
+            progress(stats)
+
+    stats.setdefault('elapsed', time.monotonic() - started)
+    stats.setdefault('rate', 0.0)
+    run.finished_at = timezone.now()
+    run.loans_scanned = stats['scanned']
+    run.fines_created = stats['created']
+    run.fines_updated = stats['updated']
+    run.save(update_fields=['finished_at', 'loans_scanned', 'fines_created', 'fines_updated'])
+    return stats
+
+
+def assess_batch(batch, now, rate, cap, grace, stats):
+    loan_ids = [row[0] for row in batch]
+    issue_ids = dict(
+        Transaction.objects.filter(loan_id__in=loan_ids, transaction_type='issue')
+        .order_by()
+        .values_list('loan_id', 'pk')
+    )
+    existing = {
+        transaction_id: (fine_id, amount, is_paid)
+        for fine_id, transaction_id, amount, is_paid in Fine.objects.filter(
+            transaction_id__in=issue_ids.values(), reason=Fine.OVERDUE_REASON,
+        ).order_by().values_list('pk', 'transaction_id', 'amount', 'is_paid')
+    }
+
+    new_fines, changed_fines, changed_transactions = [], [], []
+    for loan_id, student_id, status, due_date, return_date in batch:
+        transaction_id = issue_ids.get(loan_id)
+        if transaction_id is None:
+            stats['unlinked'] += 1
+            continue
+        until = return_date if status == 'returned' else now
+        amount = compute_fine(due_date, until, rate, cap, grace)
+        current = existing.get(transaction_id)
+
+        if current is None:
+            if amount > 0:
+                new_fines.append(Fine(
+                    student_id=student_id, transaction_id=transaction_id,
+                    amount=amount, reason=Fine.OVERDUE_REASON,
+                ))
+                changed_transactions.append(Transaction(pk=transaction_id, fine_amount=amount))
+            else:
+                stats['unchanged'] += 1
+        elif current[2] or current[1] == amount:
+            # Paid fines are settled and never re-assessed.
+            stats['unchanged'] += 1
+        else:
+            changed_fines.append(Fine(pk=current[0], amount=amount))
+            changed_transactions.append(Transaction(pk=transaction_id, fine_amount=amount))
+
+    Fine.objects.bulk_create(new_fines, batch_size=500, ignore_conflicts=True)
+    Fine.objects.bulk_update(changed_fines, ['amount'], batch_size=500)
+    Transaction.objects.bulk_update(changed_transactions, ['fine_amount'], batch_size=500)
+    stats['created'] += len(new_fines)
+    stats['updated'] += len(changed_fines)
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from transactions.fines import assess_overdue_fines
+
+
+class Command(BaseCommand):
+    help = 'Assess overdue fines for loans that changed since the last run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Loans processed per transaction (default: 1000).')
+        parser.add_argument('--full', action='store_true',
+                            help='Ignore the checkpoint and re-assess every overdue loan.')
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+
+        def progress(stats):
+            if verbosity > 1:
+                self.stdout.write(
+                    f"  {stats['scanned']} loans scanned ({stats['rate']:.0f} loans/s)"
+                )
+
+        stats = assess_overdue_fines(
+            batch_size=options['batch_size'], full=options['full'], progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {stats['scanned']} loans in {stats['elapsed']:.2f}s "
+            f"({stats['rate']:.0f} loans/s): {stats['created']} fines created, "
+            f"{stats['updated']} updated, {stats['unchanged']} unchanged, "
+            f"{stats['unlinked']} without an issue transaction."
+        ))
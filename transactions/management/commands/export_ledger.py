@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions.export import CHUNK_SIZE, EXPORTS, FORMATS, export
+
+
+class Command(BaseCommand):
+    help = 'Stream the transaction or fine ledger as CSV or JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS))
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--start', help='First day to include (YYYY-MM-DD).')
+        parser.add_argument('--end', help='Last day to include (YYYY-MM-DD).')
+        parser.add_argument('--student', help='Username or student ID.')
+        parser.add_argument('--type', help='Transaction type, or paid/unpaid for fines.')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help=f'Rows fetched and written at a time (default: {CHUNK_SIZE}).')
+        parser.add_argument('-o', '--output', help='File to write to (default: stdout).')
+
+    def handle(self, *args, **options):
+        try:
+            chunks = export(
+                options['kind'], format=options['format'], chunk_size=options['chunk_size'],
+                start=options['start'], end=options['end'],
+                student=options['student'], type=options['type'],
+            )
+        except ValueError as error:
+            raise CommandError(error)
+
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
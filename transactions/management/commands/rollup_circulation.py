@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from transactions.rollups import rollup_circulation
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily circulation rollups from the last run through today.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days-per-batch', type=int, default=31,
+                            help='Days rebuilt per transaction (default: 31).')
+        parser.add_argument('--full', action='store_true',
+                            help='Ignore the checkpoint and backfill from the oldest transaction.')
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+
+        def progress(stats):
+            if verbosity > 1:
+                self.stdout.write(f"  {stats['days']} days, {stats['rows']} rows")
+
+        stats = rollup_circulation(
+            days_per_batch=options['days_per_batch'], full=options['full'], progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up {stats['days']} days into {stats['rows']} rows in {stats['elapsed']:.2f}s."
+        ))
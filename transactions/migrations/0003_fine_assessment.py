@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def link_issue_transactions(apps, schema_editor):
+    # Issue transactions created before the loan link existed are matched to
+    # their request by the fields they were copied from.
+    Transaction = apps.get_model('transactions', 'Transaction')
+    BookRequest = apps.get_model('books', 'BookRequest')
+    Transaction.objects.filter(transaction_type='issue', loan__isnull=True).update(
+        loan=Subquery(
+            BookRequest.objects.filter(
+                student=OuterRef('student'),
+                book=OuterRef('book'),
+                due_date=OuterRef('due_date'),
+            ).order_by('-request_date').values('pk')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_loan_due_indexes'),
+        ('transactions', '0002_access_path_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FineAssessmentRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('full_scan', models.BooleanField(default=False)),
+                ('loans_scanned', models.PositiveIntegerField(default=0)),
+                ('fines_created', models.PositiveIntegerField(default=0)),
+                ('fines_updated', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='loan',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='books.bookrequest'),
+        ),
+        migrations.RunPython(link_issue_transactions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='fine',
+            constraint=models.UniqueConstraint(condition=models.Q(('reason', 'Overdue return')), fields=('transaction',), name='fine_one_overdue_per_transaction'),
+        ),
+    ]
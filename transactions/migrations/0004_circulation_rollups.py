@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0008_book_recommendations'),
+        ('transactions', '0003_fine_assessment'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CirculationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('issues', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('overdue', models.PositiveIntegerField(default=0)),
+                ('loan_days', models.FloatField(default=0)),
+                ('fines_charged', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('fines_paid', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+            options={
+                'ordering': ['-day', 'book_id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('full_build', models.BooleanField(default=False)),
+                ('first_day', models.DateField(blank=True, null=True)),
+                ('last_day', models.DateField(blank=True, null=True)),
+                ('rows_written', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='fine',
+            index=models.Index(condition=models.Q(('is_paid', True)), fields=['paid_date'], name='fine_paid_idx'),
+        ),
+        migrations.AddField(
+            model_name='circulationrollup',
+            name='book',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='books.book'),
+        ),
+        migrations.AddField(
+            model_name='circulationrollup',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='books.category'),
+        ),
+        migrations.AddIndex(
+            model_name='circulationrollup',
+            index=models.Index(fields=['category', 'day'], name='rollup_category_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='circulationrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'book'), name='circulationrollup_day_book_uniq'),
+        ),
+    ]
@@ -1,9 +1,11 @@
 from django.db import models
 from django.contrib.auth import get_user_model
-from books.models import Book
+from books.models import Book, BookRequest, Category
 
 User = get_user_model()
 
+OVERDUE_FINE_REASON = 'Overdue return'
+
 class Transaction(models.Model):
     TRANSACTION_TYPE_CHOICES = (
         ('issue', 'Issue'),
@@ -13,6 +15,8 @@ class Transaction(models.Model):
     
     student = models.ForeignKey(User, on_delete=models.CASCADE, limit_choices_to={'user_type': 'student'})
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    loan = models.ForeignKey(BookRequest, on_delete=models.SET_NULL, null=True, blank=True,
+                             related_name='transactions')
     transaction_type = models.CharField(max_length=10, choices=TRANSACTION_TYPE_CHOICES)
     transaction_date = models.DateTimeField(auto_now_add=True)
     due_date = models.DateTimeField(null=True, blank=True)
@@ -27,8 +31,14 @@ class Transaction(models.Model):
     
     class Meta:
         ordering = ['-transaction_date']
+        indexes = [
+            models.Index(fields=['-transaction_date'], name='transaction_date_idx'),
+            models.Index(fields=['student', '-transaction_date'], name='transaction_student_date_idx'),
+        ]
 
 class Fine(models.Model):
+    OVERDUE_REASON = OVERDUE_FINE_REASON
+    
     student = models.ForeignKey(User, on_delete=models.CASCADE, limit_choices_to={'user_type': 'student'})
     transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
@@ -41,4 +51,79 @@ class Fine(models.Model):
         return f"Fine - {self.student.full_name} - ${self.amount}"
     
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='fine_created_idx'),
+            models.Index(fields=['student', '-created_at'], name='fine_student_created_idx'),
+            # Fines paid per day, for the circulation rollups.
+            models.Index(fields=['paid_date'], condition=models.Q(is_paid=True), name='fine_paid_idx'),
+        ]
+        constraints = [
+            # The fine engine keeps exactly one overdue fine per issued loan.
+            models.UniqueConstraint(fields=['transaction'], condition=models.Q(reason=OVERDUE_FINE_REASON),
+                                    name='fine_one_overdue_per_transaction'),
+        ]
+
+class FineAssessmentRun(models.Model):
+    """One run of ``manage.py assess_fines``; the last finished run is the checkpoint."""
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+    full_scan = models.BooleanField(default=False)
+    loans_scanned = models.PositiveIntegerField(default=0)
+    fines_created = models.PositiveIntegerField(default=0)
+    fines_updated = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"Fine assessment at {self.started_at:%Y-%m-%d %H:%M}"
+    
+    class Meta:
+        ordering = ['-started_at']
+
+class CirculationRollup(models.Model):
+    """
+    One book's circulation on one day, written by ``transactions.rollups``.
+    The category is copied from the book so reports group without a join.
+    """
+    day = models.DateField()
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    issues = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+    # Loans past their due date and still out at the end of the day.
+    overdue = models.PositiveIntegerField(default=0)
+    # Total length of the loans returned that day, for averaging over ``returns``.
+    loan_days = models.FloatField(default=0)
+    # Final fines on the loans returned that day, and fines paid that day.
+    fines_charged = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    fines_paid = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    
+    def __str__(self):
+        return f"{self.book} on {self.day}"
+    
+    @property
+    def average_loan_days(self):
+        return self.loan_days / self.returns if self.returns else None
+    
+    class Meta:
+        ordering = ['-day', 'book_id']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'book'], name='circulationrollup_day_book_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['category', 'day'], name='rollup_category_day_idx'),
+        ]
+
+class RollupRun(models.Model):
+    """One run of ``manage.py rollup_circulation``; the last finished run is the checkpoint."""
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+    full_build = models.BooleanField(default=False)
+    first_day = models.DateField(null=True, blank=True)
+    last_day = models.DateField(null=True, blank=True)
+    rows_written = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"Circulation rollup at {self.started_at:%Y-%m-%d %H:%M}"
+    
+    class Meta:
+        ordering = ['-started_at']
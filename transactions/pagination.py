@@ -0,0 +1,124 @@
+"""
+Keyset (cursor) pagination for the ledger views.
+
+Offset pagination needs a COUNT(*) over the whole table and an OFFSET scan
+that grows with the page number. Keyset pagination instead remembers the
+(timestamp, id) of the first/last row on the page and asks for the rows
+just before or after it, which is an index range scan on every page.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+
+def encode_cursor(value, pk, direction):
+    payload = json.dumps([value.isoformat(), pk, direction], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return ``(value, pk, direction)``, or ``None`` for a malformed token."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        value, pk, direction = json.loads(base64.urlsafe_b64decode(padded))
+        if direction not in ('next', 'prev'):
+            return None
+        return datetime.fromisoformat(value), int(pk), direction
+    except (binascii.Error, ValueError, TypeError):
+        return None
+
+
+class KeysetPage:
+    """One page of rows ordered newest first by ``(field, id)``."""
+
+    def __init__(self, queryset, field, page_size, cursor=None, start=None):
+        newest_first = queryset.order_by(f'-{field}', '-pk')
+
+        if cursor and cursor[2] == 'prev':
+            value, pk, _ = cursor
+            rows = list(
+                queryset.filter(**{f'{field}__gte': value})
+                .filter(Q(**{f'{field}__gt': value}) | Q(pk__gt=pk))
+                .order_by(field, 'pk')[:page_size + 1]
+            )
+            self.has_previous = len(rows) > page_size
+            self.has_next = True
+            rows = rows[:page_size][::-1]
+        elif cursor:
+            value, pk, _ = cursor
+            rows = list(
+                newest_first.filter(**{f'{field}__lte': value})
+                .filter(Q(**{f'{field}__lt': value}) | Q(pk__lt=pk))[:page_size + 1]
+            )
+            self.has_previous = True
+            self.has_next = len(rows) > page_size
+            rows = rows[:page_size]
+        elif start:
+            rows = list(newest_first.filter(**{f'{field}__lt': start})[:page_size + 1])
+            self.has_previous = queryset.filter(**{f'{field}__gte': start}).exists()
+            self.has_next = len(rows) > page_size
+            rows = rows[:page_size]
+        else:
+            rows = list(newest_first[:page_size + 1])
+            self.has_previous = False
+            self.has_next = len(rows) > page_size
+            rows = rows[:page_size]
+
+        self.object_list = rows
+        self.field = field
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            last = self.object_list[-1]
+            return encode_cursor(getattr(last, self.field), last.pk, 'next')
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            first = self.object_list[0]
+            return encode_cursor(getattr(first, self.field), first.pk, 'prev')
+
+
+class KeysetPaginationMixin:
+    """
+    Opt-in keyset pagination for a ``ListView``, enabled with the
+    ``LEDGER_KEYSET_PAGINATION`` setting. Pages are addressed by an opaque
+    ``?cursor=`` token; ``?date=YYYY-MM-DD`` jumps to the newest rows on or
+    before that day. No total count is computed.
+    """
+    keyset_field = None
+
+    def use_keyset_pagination(self):
+        return getattr(settings, 'LEDGER_KEYSET_PAGINATION', False)
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.use_keyset_pagination():
+            return super().paginate_queryset(queryset, page_size)
+
+        cursor = decode_cursor(self.request.GET.get('cursor', ''))
+        start = day = None
+        if not cursor:
+            try:
+                day = parse_date(self.request.GET.get('date', ''))
+            except ValueError:
+                pass
+        if day:
+            start = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+        page = KeysetPage(queryset, self.keyset_field, page_size, cursor=cursor, start=start)
+        return (None, page, page.object_list, page.has_other_pages())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['keyset_pagination'] = self.use_keyset_pagination()
+        context['jump_date'] = self.request.GET.get('date', '')
+        return context
@@ -0,0 +1,214 @@
+"""
+Daily circulation rollups.
+
+``CirculationRollup`` has one row per book per day with any activity:
+issue transactions, loans returned and their total length, loans overdue
+at the end of the day, the final fines on the loans returned that day,
+and the fines paid that day. The analytics page reads only these rows,
+so its cost depends on the number of books and days shown, not on the
+size of the ledger.
+
+Days are rebuilt ``days_per_batch`` at a time. Each metric is one
+indexed range query per batch, read as plain tuples and grouped by
+(book, day) with numpy. An overdue loan counts on every day from its due
+date to its return. The late loans for the whole run are read once, and
+each batch expands their spans into days with array arithmetic. A
+batch's rows are replaced in one transaction.
+
+The first run backfills from the oldest transaction. Later runs are
+checkpointed in ``RollupRun`` and start from the last run's final day,
+which was still in progress then. ``ROLLUP_LOOKBACK_DAYS`` more days are
+also rebuilt to pick up late corrections. Run it after ``assess_fines``
+so returned loans carry their final fines.
+"""
+import time
+from datetime import datetime, time as midnight, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DurationField, ExpressionWrapper, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from books.models import BookRequest
+from .models import CirculationRollup, Fine, RollupRun, Transaction
+
+COUNTS = ('issues', 'returns', 'overdue')
+CENTS = ('fines_charged', 'fines_paid')
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, midnight.min))
+
+
+def columns(queryset, *fields):
+    """``values_list(*fields)`` as one list per field."""
+    rows = list(queryset.order_by().values_list(*fields))
+    return [list(column) for column in zip(*rows)] if rows else [[] for _ in fields]
+
+
+def day_offsets(days, first, missing=0):
+    """Days since ``first`` for a list of dates, with ``missing`` for None."""
+    days = np.array(days, dtype='datetime64[D]').reshape(-1)
+    offsets = (days - np.datetime64(first, 'D')).astype(np.int64)
+    offsets[np.isnat(days)] = missing
+    return offsets
+
+
+def to_cents(amounts):
+    return np.rint(np.array(amounts, dtype=np.float64) * 100).astype(np.int64)
+
+
+def late_loans(first, last):
+    """
+    ``(book_ids, category_ids, due days, return days)`` of the loans overdue
+    at some point from ``first`` to ``last``, as days since ``first``.
+    """
+    start, end = day_start(first), day_start(last + timedelta(days=1))
+    out = BookRequest.objects.filter(status='approved', due_date__lt=end)
+    returned = BookRequest.objects.filter(status='returned', return_date__gte=start,
+                                          return_date__gt=F('due_date'), due_date__lt=end)
+    book_ids, category_ids, due, returned_on = [], [], [], []
+    for loans in (out, returned):
+        values = columns(loans, 'book_id', 'book__category_id', TruncDate('due_date'), TruncDate('return_date'))
+        book_ids += values[0]
+        category_ids += values[1]
+        due += values[2]
+        returned_on += values[3]
+    return (
+        np.array(book_ids, dtype=np.int64), np.array(category_ids, dtype=np.int64),
+        day_offsets(due, first),
+        # Loans still out are overdue through the last day.
+        day_offsets(returned_on, first, missing=(last - first).days + 1),
+    )
+
+
+def overdue_days(loans, offset, span):
+    """``(book_ids, category_ids, days)``, one entry per loan per day it was overdue in the batch."""
+    book_ids, category_ids, due, returned_on = loans
+    # Overdue at the end of every day from the due date up to the day before the return.
+    begin = np.clip(due - offset, 0, span)
+    end = np.clip(returned_on - offset, 0, span)
+    keep = end > begin
+    book_ids, category_ids, begin, lengths = book_ids[keep], category_ids[keep], begin[keep], (end - begin)[keep]
+    firsts = np.cumsum(lengths) - lengths
+    days = np.arange(lengths.sum()) - np.repeat(firsts - begin, lengths)
+    return np.repeat(book_ids, lengths), np.repeat(category_ids, lengths), days
+
+
+def rollup_days(first, last, loans, run_first):
+    """Unsaved ``CirculationRollup`` rows for ``first`` to ``last`` inclusive."""
+    start, end = day_start(first), day_start(last + timedelta(days=1))
+    span = (last - first).days + 1
+    # name: (book ids, category ids, days since first, values)
+    metrics = {}
+
+    book_ids, category_ids, days = columns(
+        Transaction.objects.filter(transaction_type='issue', transaction_date__gte=start,
+                                   transaction_date__lt=end),
+        'book_id', 'book__category_id', TruncDate('transaction_date'),
+    )
+    metrics['issues'] = book_ids, category_ids, day_offsets(days, first), np.ones(len(book_ids))
+
+    book_ids, category_ids, days, lengths = columns(
+        BookRequest.objects.filter(status='returned', return_date__gte=start, return_date__lt=end,
+                                   approval_date__isnull=False),
+        'book_id', 'book__category_id', TruncDate('return_date'),
+        ExpressionWrapper(F('return_date') - F('approval_date'), output_field=DurationField()),
+    )
+    days = day_offsets(days, first)
+    metrics['returns'] = book_ids, category_ids, days, np.ones(len(book_ids))
+    lengths = np.array(lengths, dtype='timedelta64[us]').reshape(-1)
+    metrics['loan_days'] = book_ids, category_ids, days, lengths / np.timedelta64(1, 'D')
+
+    book_ids, category_ids, days = overdue_days(loans, (first - run_first).days, span)
+    metrics['overdue'] = book_ids, category_ids, days, np.ones(len(book_ids))
+
+    book_ids, category_ids, days, amounts = columns(
+        Fine.objects.filter(transaction__loan__status='returned', transaction__loan__return_date__gte=start,
+                            transaction__loan__return_date__lt=end),
+        'transaction__book_id', 'transaction__book__category_id',
+        TruncDate('transaction__loan__return_date'), 'amount',
+    )
+    metrics['fines_charged'] = book_ids, category_ids, day_offsets(days, first), to_cents(amounts)
+
+    book_ids, category_ids, days, amounts = columns(
+        Fine.objects.filter(is_paid=True, paid_date__gte=start, paid_date__lt=end),
+        'transaction__book_id', 'transaction__book__category_id', TruncDate('paid_date'), 'amount',
+    )
+    metrics['fines_paid'] = book_ids, category_ids, day_offsets(days, first), to_cents(amounts)
+
+    # Group every metric by (book, day) at once.
+    keys = np.concatenate([np.asarray(book_ids, dtype=np.int64) * span + days
+                           for book_ids, _, days, _ in metrics.values()])
+    groups, inverse = np.unique(keys, return_inverse=True)
+    category_ids = np.zeros(len(groups), dtype=np.int64)
+    totals, position = {}, 0
+    for name, (book_ids, categories, _, values) in metrics.items():
+        segment = inverse[position:position + len(book_ids)]
+        totals[name] = np.bincount(segment, weights=values, minlength=len(groups))
+        category_ids[segment] = categories
+        position += len(book_ids)
+
+    book_ids, days = groups // span, groups % span
+    return [
+        CirculationRollup(
+            day=first + timedelta(days=day), book_id=book_id, category_id=category_id,
+            issues=issues, returns=returns, overdue=overdue, loan_days=loan_days,
+            fines_charged=Decimal(charged).scaleb(-2), fines_paid=Decimal(paid).scaleb(-2),
+        )
+        for book_id, day, category_id, issues, returns, overdue, loan_days, charged, paid in zip(
+            book_ids.tolist(), days.tolist(), category_ids.tolist(),
+            *(totals[name].astype(np.int64).tolist() for name in COUNTS),
+            totals['loan_days'].tolist(),
+            *(totals[name].astype(np.int64).tolist() for name in CENTS),
+        )
+    ]
+
+
+def rollup_circulation(days_per_batch=31, full=False, progress=None):
+    """
+    Rebuild the rollups from the checkpoint (or from the start of the
+    ledger) through today. Returns a dict of run statistics; calls
+    ``progress(stats)`` after every batch if given.
+    """
+    today = timezone.localdate()
+    last_run = RollupRun.objects.filter(finished_at__isnull=False).first()
+    if full or last_run is None:
+        earliest = Transaction.objects.order_by('transaction_date').values_list(
+            'transaction_date', flat=True).first()
+        first = timezone.localdate(earliest) if earliest else today
+        full = True
+    else:
+        lookback = int(getattr(settings, 'ROLLUP_LOOKBACK_DAYS', 1))
+        first = min(last_run.last_day - timedelta(days=lookback), today)
+    run = RollupRun.objects.create(started_at=timezone.now(), full_build=full, first_day=first, last_day=today)
+
+    loans = late_loans(first, today)
+    stats = {'days': 0, 'rows': 0}
+    started = time.monotonic()
+
+    day = first
+    while day <= today:
+        last = min(day + timedelta(days=days_per_batch - 1), today)
+        rows = rollup_days(day, last, loans, first)
+        with transaction.atomic():
+            CirculationRollup.objects.filter(day__gte=day, day__lte=last).delete()
+            CirculationRollup.objects.bulk_create(rows, batch_size=1000)
+        stats['days'] += (last - day).days + 1
+        stats['rows'] += len(rows)
+        stats['elapsed'] = time.monotonic() - started
+        if progress:
+            progress(stats)
+        day = last + timedelta(days=1)
+
+    if full:
+        # Rows for days before the oldest remaining transaction.
+        CirculationRollup.objects.filter(day__lt=first).delete()
+    stats.setdefault('elapsed', time.monotonic() - started)
+    run.finished_at = timezone.now()
+    run.rows_written = stats['rows']
+    run.save(update_fields=['finished_at', 'rows_written'])
+    return stats
@@ -1,3 +1,395 @@
-from django.test import TestCase
+import csv
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import skipUnless
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from books.models import BookRequest, Category
+from books.tests import assert_uses_index, make_admin, make_book, make_reader, make_student
+from .fines import assess_overdue_fines
+from .models import CirculationRollup, Fine, FineAssessmentRun, RollupRun, Transaction
+from .rollups import day_start, rollup_circulation
+from .views import FineListView, TransactionListView
+
+
+class TransactionViewQueryCountTests(TestCase):
+    """Lock the number of queries per page so N+1 regressions fail the suite."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        cls.student = make_student()
+        category = Category.objects.create(name='Reference')
+        for i in range(25):
+            book = make_book(category, cls.admin, title=f'Book {i}', isbn=f'{i:013d}')
+            transaction = Transaction.objects.create(
+                student=cls.student, book=book, transaction_type='issue',
+                processed_by=cls.admin,
+            )
+            Fine.objects.create(
+                student=cls.student, transaction=transaction,
+                amount=Decimal('1.50'), reason='Overdue return',
+            )
+
+    def test_transaction_list(self):
+        self.client.force_login(self.admin)
+        # session, user, count, page
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('transactions:list'))
+        self.assertEqual(len(response.context['transactions']), 20)
+
+    def test_my_transactions(self):
+        self.client.force_login(self.student)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('transactions:my_transactions'))
+        self.assertEqual(len(response.context['transactions']), 20)
+
+    def test_fine_list(self):
+        self.client.force_login(self.admin)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('transactions:fines'))
+        self.assertEqual(len(response.context['fines']), 20)
+
+    def test_my_fines(self):
+        self.client.force_login(self.student)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('transactions:my_fines'))
+        self.assertEqual(len(response.context['fines']), 20)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked against SQLite.')
+class TransactionQueryPlanTests(TestCase):
+
+    def test_transaction_list_uses_date_index(self):
+        assert_uses_index(self, TransactionListView().get_queryset()[:20], 'transaction_date_idx')
+
+    def test_student_transactions_use_student_index(self):
+        assert_uses_index(self, Transaction.objects.filter(student_id=1)[:20],
+                          'transaction_student_date_idx')
+
+    def test_fine_list_uses_created_index(self):
+        assert_uses_index(self, FineListView().get_queryset()[:20], 'fine_created_idx')
+
+    def test_student_fines_use_student_index(self):
+        assert_uses_index(self, Fine.objects.filter(student_id=1)[:20], 'fine_student_created_idx')
+
+    def test_paid_fines_use_paid_index(self):
+        now = timezone.now()
+        assert_uses_index(self, Fine.objects.filter(is_paid=True, paid_date__gte=now, paid_date__lt=now),
+                          'fine_paid_idx')
+
+
+@override_settings(LEDGER_KEYSET_PAGINATION=True)
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        student = make_student()
+        book = make_book(Category.objects.create(name='Reference'), cls.admin)
+        Transaction.objects.bulk_create([
+            Transaction(student=student, book=book, transaction_type='issue', processed_by=cls.admin)
+            for _ in range(45)
+        ])
+        # Spread the rows over 15 days, three per day, with tied timestamps.
+        start = datetime(2025, 1, 1, 12, tzinfo=dt_timezone.utc)
+        for i, pk in enumerate(Transaction.objects.order_by('pk').values_list('pk', flat=True)):
+            Transaction.objects.filter(pk=pk).update(transaction_date=start + timedelta(days=i // 3))
+        cls.expected = list(
+            Transaction.objects.order_by('-transaction_date', '-pk').values_list('pk', flat=True)
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def get_page(self, **params):
+        response = self.client.get(reverse('transactions:list'), params)
+        return response.context['page_obj'], [t.pk for t in response.context['transactions']]
+
+    def test_walks_forward_and_back_without_count(self):
+        with self.assertNumQueries(3):
+            page, ids = self.get_page()
+        self.assertFalse(page.has_previous)
+        seen = list(ids)
+        while page.has_next:
+            page, ids = self.get_page(cursor=page.next_cursor)
+            seen.extend(ids)
+        self.assertEqual(seen, self.expected)
+
+        page, ids = self.get_page(cursor=page.previous_cursor)
+        self.assertEqual(ids, self.expected[20:40])
+
+    def test_jump_to_date(self):
+        page, ids = self.get_page(date='2025-01-10')
+        # Days 1-10 hold the oldest 30 rows; the page starts at the newest of them.
+        self.assertEqual(ids, self.expected[15:35])
+        self.assertTrue(page.has_previous)
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        page, ids = self.get_page(cursor='not-a-cursor')
+        self.assertEqual(ids, self.expected[:20])
+
+
+@override_settings(FINE_RATE_PER_DAY='0.50', FINE_MAX_AMOUNT='5.00', FINE_GRACE_DAYS=0)
+class FineAssessmentTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        cls.category = Category.objects.create(name='Reference')
+
+    def make_loan(self, days_overdue):
+        """An approved loan whose due date was ``days_overdue`` days ago."""
+        n = BookRequest.objects.count()
+        book = make_book(self.category, self.admin, isbn=f'{n:013d}')
+        loan = BookRequest.objects.create(student=make_reader(f'student{n}'), book=book)
+        loan.approve(self.admin)
+        due_date = timezone.now() - timedelta(days=days_overdue, hours=1)
+        BookRequest.objects.filter(pk=loan.pk).update(due_date=due_date)
+        Transaction.objects.filter(loan=loan).update(due_date=due_date)
+        loan.refresh_from_db()
+        return loan
+
+    def fine_for(self, loan):
+        return Fine.objects.get(transaction__loan=loan, reason=Fine.OVERDUE_REASON)
+
+    def test_fines_accrue_per_day_up_to_the_cap(self):
+        late, very_late, on_time = self.make_loan(3), self.make_loan(30), self.make_loan(-2)
+        stats = assess_overdue_fines()
+        self.assertEqual(stats['created'], 2)
+        self.assertEqual(self.fine_for(late).amount, Decimal('1.50'))
+        self.assertEqual(self.fine_for(very_late).amount, Decimal('5.00'))
+        self.assertFalse(Fine.objects.filter(transaction__loan=on_time).exists())
+        issue = Transaction.objects.get(loan=late, transaction_type='issue')
+        self.assertEqual(issue.fine_amount, Decimal('1.50'))
+
+    def test_rerun_is_idempotent(self):
+        self.make_loan(3)
+        assess_overdue_fines()
+        stats = assess_overdue_fines(full=True)
+        self.assertEqual((stats['created'], stats['updated']), (0, 0))
+        self.assertEqual(Fine.objects.count(), 1)
+
+    def test_incremental_run_skips_capped_loans_and_updates_the_rest(self):
+        late, capped = self.make_loan(3), self.make_loan(30)
+        assess_overdue_fines()
+        stats = assess_overdue_fines(now=timezone.now() + timedelta(days=2))
+        self.assertEqual(stats['scanned'], 1)
+        self.assertEqual(stats['updated'], 1)
+        self.assertEqual(self.fine_for(late).amount, Decimal('2.50'))
+        self.assertEqual(self.fine_for(capped).amount, Decimal('5.00'))
+        self.assertEqual(FineAssessmentRun.objects.filter(finished_at__isnull=False).count(), 2)
+
+    def test_late_return_gets_a_final_fine(self):
+        loan = self.make_loan(2)
+        assess_overdue_fines()
+        loan.mark_returned(self.admin)
+        stats = assess_overdue_fines(now=timezone.now() + timedelta(days=5))
+        self.assertEqual(stats['scanned'], 1)
+        # Charged up to the return, not up to the run.
+        self.assertEqual(self.fine_for(loan).amount, Decimal('1.00'))
+
+    def test_paid_fines_are_not_reassessed(self):
+        loan = self.make_loan(2)
+        assess_overdue_fines()
+        Fine.objects.update(is_paid=True)
+        assess_overdue_fines(now=timezone.now() + timedelta(days=3))
+        self.assertEqual(self.fine_for(loan).amount, Decimal('1.00'))
+
+    def test_command_reports_throughput(self):
+        self.make_loan(3)
+        out = StringIO()
+        call_command('assess_fines', batch_size=10, stdout=out)
+        self.assertIn('1 fines created', out.getvalue())
+
+
+class LedgerExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        cls.alice = make_student('alice')
+        cls.bob = make_student('bob')
+        book = make_book(Category.objects.create(name='Reference'), cls.admin, isbn='9780000000001')
+        for student in (cls.alice, cls.bob):
+            for transaction_type in ('issue', 'return'):
+                Transaction.objects.create(student=student, book=book, transaction_type=transaction_type,
+                                           processed_by=cls.admin)
+        Transaction.objects.filter(student=cls.bob).update(
+            transaction_date=datetime(2025, 3, 1, 12, tzinfo=dt_timezone.utc))
+        issue = Transaction.objects.get(student=cls.alice, transaction_type='issue')
+        cls.fine = Fine.objects.create(student=cls.alice, transaction=issue,
+                                       amount=Decimal('2.50'), reason='Damage')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def export(self, kind, **params):
+        response = self.client.get(reverse('transactions:export', args=[kind]), params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_export_filters_by_student_and_type(self):
+        response, body = self.export('transactions', student='alice', type='issue')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(body.splitlines()))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['student'], rows[0]['type'], rows[0]['book_isbn']),
+                         ('alice', 'issue', '9780000000001'))
+
+    def test_date_range_is_inclusive(self):
+        _, body = self.export('transactions', start='2025-03-01', end='2025-03-01')
+        self.assertEqual({row['student'] for row in csv.DictReader(body.splitlines())}, {'bob'})
+
+    def test_json_export(self):
+        response, body = self.export('fines', format='json', type='unpaid')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        [row] = json.loads(body)
+        self.assertEqual(row['id'], self.fine.pk)
+        self.assertEqual(row['student_id'], self.alice.student_id)
+        self.assertEqual((row['amount'], row['is_paid'], row['paid_date']), ('2.50', False, None))
+        _, body = self.export('fines', format='json', type='paid')
+        self.assertEqual(json.loads(body), [])
+
+    def test_bad_filters_are_rejected(self):
+        for params in ({'format': 'xml'}, {'start': 'yesterday'}, {'type': 'lost'}):
+            response = self.client.get(reverse('transactions:export', args=['transactions']), params)
+            self.assertEqual(response.status_code, 400)
+
+    def test_export_is_admin_only(self):
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('transactions:export', args=['fines']))
+        self.assertEqual(response.status_code, 403)
+
+    def test_command_streams_rows_in_chunks(self):
+        out = StringIO()
+        call_command('export_ledger', 'transactions', chunk_size=1, stdout=out)
+        rows = list(csv.reader(out.getvalue().splitlines()))
+        self.assertEqual(rows[0][:3], ['id', 'date', 'type'])
+        self.assertEqual(len(rows), 5)
+
+
+class CirculationRollupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_admin()
+        cls.today = timezone.localdate()
+        fiction, reference = Category.objects.create(name='Fiction'), Category.objects.create(name='Reference')
+        cls.novel = make_book(fiction, cls.admin, title='Novel', isbn='1')
+        cls.atlas = make_book(reference, cls.admin, title='Atlas', isbn='2')
+        # Returned two days late, with a fine paid today.
+        late = cls.loan(cls.novel, 'reader0', issued=10, due=3, returned=1)
+        Fine.objects.create(student=late.student, transaction=late.transactions.get(), amount=Decimal('2.00'),
+                            reason=Fine.OVERDUE_REASON, is_paid=True, paid_date=cls.at(0))
+        # Returned early.
+        cls.loan(cls.novel, 'reader1', issued=4, due=-5, returned=2)
+        # Still out and overdue.
+        cls.out = cls.loan(cls.atlas, 'reader2', issued=5, due=2)
+
+    @classmethod
+    def at(cls, days_ago, hour=12):
+        return day_start(cls.today - timedelta(days=days_ago)) + timedelta(hours=hour)
+
+    @classmethod
+    def loan(cls, book, username, issued, due, returned=None):
+        """A loan issued, due and returned the given numbers of days ago, at noon."""
+        loan = BookRequest.objects.create(
+            student=make_student(username), book=book, status='returned' if returned is not None else 'approved',
+            approved_by=cls.admin, approval_date=cls.at(issued), due_date=cls.at(due),
+            return_date=returned is not None and cls.at(returned) or None,
+        )
+        issue = Transaction.objects.create(student=loan.student, book=book, loan=loan, transaction_type='issue',
+                                           due_date=loan.due_date, processed_by=cls.admin)
+        Transaction.objects.filter(pk=issue.pk).update(transaction_date=loan.approval_date)
+        return loan
+
+    def rollups(self):
+        return {
+            (row.book.isbn, (self.today - row.day).days): (
+                row.issues, row.returns, row.overdue, row.loan_days, row.fines_charged, row.fines_paid,
+            )
+            for row in CirculationRollup.objects.select_related('book')
+        }
+
+    def test_backfill(self):
+        stats = rollup_circulation()
+        self.assertEqual(stats['days'], 11)
+        zero = Decimal('0.00')
+        self.assertEqual(self.rollups(), {
+            ('1', 10): (1, 0, 0, 0, zero, zero),
+            ('1', 4): (1, 0, 0, 0, zero, zero),
+            ('1', 3): (0, 0, 1, 0, zero, zero),
+            ('1', 2): (0, 1, 1, 2.0, zero, zero),
+            ('1', 1): (0, 1, 0, 9.0, Decimal('2.00'), zero),
+            ('1', 0): (0, 0, 0, 0, zero, Decimal('2.00')),
+            ('2', 5): (1, 0, 0, 0, zero, zero),
+            ('2', 2): (0, 0, 1, 0, zero, zero),
+            ('2', 1): (0, 0, 1, 0, zero, zero),
+            ('2', 0): (0, 0, 1, 0, zero, zero),
+        })
+        self.assertEqual(set(CirculationRollup.objects.filter(book=self.atlas).values_list('category__name', flat=True)),
+                         {'Reference'})
+
+    def test_incremental_run_rebuilds_only_recent_days(self):
+        rollup_circulation()
+        self.out.mark_returned(self.admin)
+        CirculationRollup.objects.filter(day=self.today - timedelta(days=5)).update(issues=7)
+
+        stats = rollup_circulation()
+        self.assertEqual(stats['days'], 2)
+        run = RollupRun.objects.first()
+        self.assertFalse(run.full_build)
+        self.assertEqual(run.first_day, self.today - timedelta(days=1))
+        rollups = self.rollups()
+        self.assertEqual(rollups[('2', 0)][:3], (0, 1, 0))
+        # Days before the lookback are left as they were.
+        self.assertEqual(rollups[('2', 5)][0], 7)
+
+        rollup_circulation(full=True)
+        self.assertEqual(self.rollups()[('2', 5)][0], 1)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('rollup_circulation', days_per_batch=3, stdout=out)
+        self.assertIn('Rolled up 11 days into 10 rows', out.getvalue())
+
+    def test_analytics_page_reads_the_rollups(self):
+        rollup_circulation()
+        self.client.force_login(self.admin)
+        # session, user, daily, categories, books, last run
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('transactions:analytics'))
+        totals = response.context['totals']
+        self.assertEqual((totals['issues'], totals['returns'], totals['overdue']), (3, 2, 1))
+        self.assertEqual(totals['average_loan_days'], 5.5)
+        self.assertEqual(totals['fines_paid'], Decimal('2.00'))
+        self.assertEqual([row['category__name'] for row in response.context['categories']],
+                         ['Fiction', 'Reference'])
+        self.assertEqual([row['book__title'] for row in response.context['books']], ['Novel', 'Atlas'])
+
+        response = self.client.get(reverse('transactions:analytics'),
+                                   {'start': str(self.today - timedelta(days=3)), 'end': str(self.today)})
+        self.assertEqual(response.context['totals']['issues'], 0)
+        self.assertEqual(len(response.context['daily']), 4)
+
+        # Overdue is read from the end day itself, not the last day that had rows.
+        CirculationRollup.objects.filter(day=self.today).delete()
+        response = self.client.get(reverse('transactions:analytics'))
+        self.assertEqual(response.context['totals']['overdue'], 0)
+
+    def test_analytics_page_rejects_bad_dates_and_students(self):
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get(reverse('transactions:analytics'), {'start': 'soon'}).status_code, 400)
+        response = self.client.get(reverse('transactions:analytics'),
+                                   {'start': str(self.today), 'end': str(self.today - timedelta(days=1))})
+        self.assertEqual(response.status_code, 400)
+        self.client.force_login(make_student('reader9'))
+        self.assertEqual(self.client.get(reverse('transactions:analytics')).status_code, 403)
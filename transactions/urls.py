@@ -8,4 +8,6 @@ urlpatterns = [
     path('my-transactions/', views.MyTransactionsView.as_view(), name='my_transactions'),
     path('fines/', views.FineListView.as_view(), name='fines'),
     path('my-fines/', views.MyFinesView.as_view(), name='my_fines'),
+    path('export/<str:kind>/', views.ExportView.as_view(), name='export'),
+    path('analytics/', views.CirculationAnalyticsView.as_view(), name='analytics'),
 ]
\ No newline at end of file
@@ -1,19 +1,34 @@
+from datetime import timedelta
+
 from django.shortcuts import render
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.views.generic import ListView
-from .models import Transaction, Fine
+from django.db.models import Sum
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.utils import timezone
+from django.views.generic import ListView, TemplateView, View
+from .export import export, parse_day
+from .models import CirculationRollup, RollupRun, Transaction, Fine
+from .pagination import KeysetPaginationMixin
 
-class TransactionListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class TransactionListView(LoginRequiredMixin, UserPassesTestMixin, KeysetPaginationMixin, ListView):
     model = Transaction
     template_name = 'transactions/list.html'
     context_object_name = 'transactions'
     paginate_by = 20
+    keyset_field = 'transaction_date'
     
     def test_func(self):
         return self.request.user.user_type == 'admin'
     
     def get_queryset(self):
-        return Transaction.objects.all().order_by('-transaction_date')
+        return (
+            Transaction.objects.select_related('student', 'book', 'processed_by')
+            .only(
+                'transaction_type', 'transaction_date', 'due_date', 'return_date',
+                'student__full_name', 'book__title', 'processed_by__full_name',
+            )
+            .order_by('-transaction_date')
+        )
 
 class MyTransactionsView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     model = Transaction
@@ -25,19 +40,35 @@ class MyTransactionsView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         return self.request.user.user_type == 'student'
     
     def get_queryset(self):
-        return Transaction.objects.filter(student=self.request.user).order_by('-transaction_date')
+        return (
+            Transaction.objects.filter(student=self.request.user)
+            .select_related('book')
+            .only(
+                'transaction_type', 'transaction_date', 'due_date', 'return_date',
+                'fine_amount', 'book__title',
+            )
+            .order_by('-transaction_date')
+        )
 
-class FineListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class FineListView(LoginRequiredMixin, UserPassesTestMixin, KeysetPaginationMixin, ListView):
     model = Fine
     template_name = 'transactions/fines.html'
     context_object_name = 'fines'
     paginate_by = 20
+    keyset_field = 'created_at'
     
     def test_func(self):
         return self.request.user.user_type == 'admin'
     
     def get_queryset(self):
-        return Fine.objects.all().order_by('-created_at')
+        return (
+            Fine.objects.select_related('student', 'transaction__book')
+            .only(
+                'amount', 'reason', 'is_paid', 'created_at', 'paid_date',
+                'student__full_name', 'transaction__book__title',
+            )
+            .order_by('-created_at')
+        )
 
 class MyFinesView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     model = Fine
@@ -49,4 +80,95 @@ class MyFinesView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         return self.request.user.user_type == 'student'
     
     def get_queryset(self):
-        return Fine.objects.filter(student=self.request.user).order_by('-created_at')
\ No newline at end of file
+        return (
+            Fine.objects.filter(student=self.request.user)
+            .select_related('transaction__book')
+            .only(
+                'amount', 'reason', 'is_paid', 'created_at', 'paid_date',
+                'transaction__book__title',
+            )
+            .order_by('-created_at')
+        )
+
+class ExportView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Stream a ledger as CSV or JSON. Accepts ``format``, ``start`` and
+    ``end`` (YYYY-MM-DD, inclusive), ``student`` and ``type``.
+    """
+    CONTENT_TYPES = {'csv': 'text/csv', 'json': 'application/json'}
+    
+    def test_func(self):
+        return self.request.user.user_type == 'admin'
+    
+    def get(self, request, kind):
+        format = request.GET.get('format', 'csv')
+        try:
+            chunks = export(
+                kind, format=format,
+                start=request.GET.get('start'), end=request.GET.get('end'),
+                student=request.GET.get('student'), type=request.GET.get('type'),
+            )
+        except ValueError as error:
+            return HttpResponseBadRequest(str(error))
+        
+        response = StreamingHttpResponse(chunks, content_type=self.CONTENT_TYPES[format])
+        filename = f'{kind}-{timezone.localdate():%Y%m%d}.{format}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+class CirculationAnalyticsView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    """
+    Circulation totals per day, per category and for the most borrowed
+    books between ``start`` and ``end`` (YYYY-MM-DD, inclusive; the last 30
+    days by default). Reads only ``CirculationRollup``.
+    """
+    template_name = 'transactions/analytics.html'
+    default_days = 30
+    top_books = 10
+    
+    def test_func(self):
+        return self.request.user.user_type == 'admin'
+    
+    def get(self, request, *args, **kwargs):
+        try:
+            self.end = parse_day(request.GET.get('end'), 'end') or timezone.localdate()
+            self.start = (parse_day(request.GET.get('start'), 'start')
+                          or self.end - timedelta(days=self.default_days - 1))
+        except ValueError as error:
+            return HttpResponseBadRequest(str(error))
+        if self.start > self.end:
+            return HttpResponseBadRequest('"start" must not be after "end".')
+        return super().get(request, *args, **kwargs)
+    
+    def summarize(self, rows):
+        for row in rows:
+            row['average_loan_days'] = row['loan_days'] / row['returns'] if row['returns'] else None
+        return rows
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        rollups = CirculationRollup.objects.filter(day__gte=self.start, day__lte=self.end).order_by()
+        sums = {name: Sum(name) for name in (
+            'issues', 'returns', 'overdue', 'loan_days', 'fines_charged', 'fines_paid',
+        )}
+        daily = self.summarize(list(rollups.values('day').annotate(**sums).order_by('day')))
+        totals = {name: sum(row[name] for row in daily) for name in sums if name != 'overdue'}
+        # Overdue loans are a level, not a flow: show where the range ends.
+        # A day without rows had nothing overdue.
+        totals['overdue'] = daily[-1]['overdue'] if daily and daily[-1]['day'] == self.end else 0
+        context.update({
+            'start': self.start,
+            'end': self.end,
+            'daily': daily,
+            'totals': self.summarize([totals])[0],
+            'categories': self.summarize(list(
+                rollups.values('category_id', 'category__name').annotate(**sums)
+                .order_by('-issues', 'category__name')
+            )),
+            'books': self.summarize(list(
+                rollups.values('book_id', 'book__title', 'book__author').annotate(**sums)
+                .order_by('-issues', 'book_id')[:self.top_books]
+            )),
+            'last_run': RollupRun.objects.filter(finished_at__isnull=False).first(),
+        })
+        return context